@@ -0,0 +1,422 @@
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+import traceback
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+from employees import EmployeeIndex
+from export_locks import ExportLocks
+from payroll_export import PARTITION_KEYS, run_export
+from ride_store import RIDE_TYPES, ride_points
+from rules import RulesEngine, month_bounds, year_bounds
+from storage import DB_PATH, POOL_SIZE, SqliteStorage
+
+# =============================================================================
+# HTTP/JSON API (ritregistratie zonder Streamlit)
+# =============================================================================
+# Een asyncio server (enkel standaardbibliotheek) voor de mobiele app en de
+# badgelezers, op dezelfde SQLite storage en dezelfde RulesEngine als de UI.
+#
+#   POST /rides                     {"employee_id", "date", "trajectory", "ride_type"}
+#   POST /rides/batch               {"rides": [...]} (in volgorde gevalideerd)
+#   GET  /employees/<id>/totals     ?date=YYYY-MM-DD (standaard vandaag)
+#   POST /exports                   {"compress": false, "partition_by": ["country"], "aggregate": false}
+#   GET  /health
+#   GET  /metrics                   Prometheus tekstformaat (zie metrics.py)
+#
+# Ritten van één medewerker worden in dit proces na elkaar afgehandeld (asyncio
+# lock per employee_id), zodat rit-punten en BE limiet zonder conflicten worden
+# gecontroleerd. Een lock bestaat enkel zolang een request ze vasthoudt of erop
+# wacht (WeakValueDictionary), zodat onbekende of steeds nieuwe ids het proces
+# niet laten groeien. Tegenover andere processen (Streamlit) beschermt de optimistische
+# versiecontrole van submit_ride. SQLite werk draait in een thread pool zodat de
+# event loop nooit blokkeert.
+
+API_HOST = "127.0.0.1"
+API_PORT = 8600
+STATE_TTL = 2.0  # seconden dat config, master data en export locks hergebruikt worden
+MAX_BODY_BYTES = 16 * 1024 * 1024
+MAX_BATCH_RIDES = 50_000
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class ApiError(Exception):
+    """Fout die als JSON {"error": ...} met de gegeven HTTP status wordt teruggegeven."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is niet JSON serialiseerbaar")
+
+
+def _parse_date(value, field="date"):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"Ongeldige {field}: verwacht YYYY-MM-DD") from None
+
+
+def _lock_key(employee_id):
+    """Sleutel voor de lock per medewerker ("101" en 101 zijn dezelfde medewerker)."""
+    try:
+        return int(employee_id)
+    except (TypeError, ValueError):
+        return employee_id
+
+
+def _check_ride_type(ride_type, where=""):
+    """Enkel de rittypes van het formulier; een onbekend type is geen stille enkele rit."""
+    if ride_type not in RIDE_TYPES:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"Ongeldig ride_type{where}: kies uit {', '.join(RIDE_TYPES)}")
+
+
+def _check_trajectory(trajectory, where=""):
+    """Een traject is een naam; een lijst of object in de JSON is geen opzoeksleutel."""
+    if not isinstance(trajectory, str):
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"Ongeldig trajectory{where}: verwacht een tekst")
+
+
+def _require(payload, *fields):
+    if not isinstance(payload, dict):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Verwacht een JSON object")
+    missing = [field for field in fields if payload.get(field) in (None, "")]
+    if missing:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"Ontbrekende velden: {', '.join(missing)}")
+    return [payload[field] for field in fields]
+
+
+class ApiState:
+    """
+    Config, master data, export locks en uitzonderingen van het API proces.
+    Wordt hooguit om de STATE_TTL seconden uit de storage herladen, zodat
+    wijzigingen van HR in de UI snel zichtbaar zijn zonder per request te laden.
+    """
+
+    def __init__(self, storage, ttl=STATE_TTL):
+        self.storage = storage
+        self.ttl = ttl
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        if not force and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        with self._lock:
+            if not force and time.monotonic() - self._loaded_at < self.ttl:
+                return
+            configs = self.storage.load_config_history()
+            if not configs:
+                raise RuntimeError("Database bevat geen configuratie. Start eerst de applicatie.")
+            # Nieuwe objecten in plaats van mutatie: lopende requests houden hun snapshot
+            self.employee_index = EmployeeIndex(self.storage.load_employees())
+            self.rules = RulesEngine(
+                configs,
+                self.storage.rides,
+                ExportLocks(self.storage.load_export_history()),
+                self.storage.load_deadline_exceptions(),
+            )
+            self._loaded_at = time.monotonic()
+
+
+class RideApi:
+    """Request handlers; het blokkerende SQLite werk draait in een thread pool."""
+
+    def __init__(self, storage, ttl=STATE_TTL):
+        self.storage = storage
+        self.state = ApiState(storage, ttl)
+        self._executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="api")
+        self._employee_locks = weakref.WeakValueDictionary()  # employee_id -> asyncio.Lock in gebruik
+        self._export_lock = asyncio.Lock()
+
+    def _employee_lock(self, employee_id):
+        """Lock van een medewerker; blijft bestaan zolang iemand een referentie houdt."""
+        key = _lock_key(employee_id)
+        lock = self._employee_locks.get(key)
+        if lock is None:
+            lock = self._employee_locks[key] = asyncio.Lock()
+        return lock
+
+    async def _run(self, func, *args):
+        # Optioneel geprofileerd in de worker thread (cProfile ziet enkel de eigen thread)
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, metrics.profile_call, f"api_{func.__name__.lstrip('_')}", func, *args
+        )
+
+    # -------------------------------------------------------------------------
+    # Routing
+    # -------------------------------------------------------------------------
+
+    async def dispatch(self, method, target, body):
+        """
+        Geeft (status, payload) terug voor één request: een JSON payload, of tekst
+        (str) voor /metrics.
+        """
+        if not metrics.enabled():
+            return await self._dispatch(method, target, body)
+        with metrics.span("api_request"):
+            status, payload = await self._dispatch(method, target, body)
+        metrics.count("api_requests", method=method, status=status.value)
+        return status, payload
+
+    async def _dispatch(self, method, target, body):
+        url = urlsplit(target)
+        parts = [part for part in url.path.split("/") if part]
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, {"error": "Ongeldige JSON"}
+        try:
+            if parts == ["health"] and method == "GET":
+                return HTTPStatus.OK, {"status": "ok"}
+            if parts == ["metrics"] and method == "GET":
+                return HTTPStatus.OK, metrics.exposition()
+            if parts == ["rides"] and method == "POST":
+                return HTTPStatus.OK, await self.submit_ride(payload)
+            if parts == ["rides", "batch"] and method == "POST":
+                return HTTPStatus.OK, await self.submit_batch(payload)
+            if len(parts) == 3 and parts[0] == "employees" and parts[2] == "totals" and method == "GET":
+                query = parse_qs(url.query)
+                return HTTPStatus.OK, await self._run(self.employee_totals, parts[1], query.get("date", [None])[0])
+            if parts == ["exports"] and method == "POST":
+                return HTTPStatus.OK, await self.trigger_export(payload)
+            if parts in (["health"], ["metrics"], ["rides"], ["rides", "batch"], ["exports"]):
+                return HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"{method} niet toegestaan"}
+            return HTTPStatus.NOT_FOUND, {"error": f"Onbekend pad: {url.path}"}
+        except ApiError as exc:
+            return exc.status, {"error": exc.message}
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Interne fout"}
+
+    # -------------------------------------------------------------------------
+    # Handlers
+    # -------------------------------------------------------------------------
+
+    def _employee(self, employee_id):
+        try:
+            employee = self.state.employee_index.get(int(employee_id))
+        except (TypeError, ValueError):
+            employee = None
+        if employee is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"Onbekende medewerker: {employee_id}")
+        return employee
+
+    @metrics.timed("api_submit_ride")
+    def _submit_ride(self, payload):
+        self.state.refresh()
+        employee_id, ride_date, trajectory, ride_type = _require(payload, "employee_id", "date", "trajectory", "ride_type")
+        _check_ride_type(ride_type)
+        _check_trajectory(trajectory)
+        employee = self._employee(employee_id)
+        ride_date = _parse_date(ride_date)
+        if trajectory not in employee["trajectories"]:
+            raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, f"Traject '{trajectory}' is niet goedgekeurd")
+        rules = self.state.rules
+        distance = employee["trajectories"][trajectory] * ride_points(ride_type)
+        rule = rules.rule_for(employee, ride_date)
+        valid, msgs, amount = self.storage.rides.submit_ride(
+            employee["id"],
+            lambda: rules.validate_ride(employee, ride_date, trajectory, ride_type),
+            lambda amount: {
+                "date": ride_date,
+                "employee_id": employee["id"],
+                "employee_name": employee["name"],
+                "trajectory": trajectory,
+                "ride_type": ride_type,
+                "distance": distance,
+                "amount": amount,
+                "rate_applied": rule.rate,
+                "processed": False,
+                "config_version": rule.version,
+            },
+        )
+        return {"valid": valid, "messages": msgs, "amount": amount}
+
+    async def submit_ride(self, payload):
+        employee_id = payload.get("employee_id") if isinstance(payload, dict) else None
+        async with self._employee_lock(employee_id):
+            return await self._run(self._submit_ride, payload)
+
+    @metrics.timed("api_submit_batch")
+    def _submit_batch(self, rides):
+        from batch_validation import accepted_rides, validate_batch  # pandas enkel voor batch requests
+
+        self.state.refresh()
+        rules = self.state.rules
+        with self.storage.transaction():
+            result = validate_batch(
+                rides, self.state.employee_index, rules.configs, self.storage.rides,
+                rules.export_locks, rules.deadline_exceptions, today=rules.clock(),
+            )
+            accepted = accepted_rides(result)
+            self.storage.rides.append_many(accepted)
+        return {
+            "accepted": len(accepted),
+            "rejected": len(result) - len(accepted),
+            "results": [
+                {"valid": bool(valid), "messages": msgs, "amount": float(amount)}
+                for valid, msgs, amount in zip(result["valid"], result["messages"], result["amount"])
+            ],
+        }
+
+    async def submit_batch(self, payload):
+        (rides,) = _require(payload, "rides")
+        if not isinstance(rides, list) or not all(isinstance(ride, dict) for ride in rides):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "'rides' moet een lijst van objecten zijn")
+        if len(rides) > MAX_BATCH_RIDES:
+            raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Maximaal {MAX_BATCH_RIDES} ritten per batch")
+        for pos, ride in enumerate(rides):
+            _check_ride_type(ride.get("ride_type"), where=f" in rit {pos}")
+            _check_trajectory(ride.get("trajectory"), where=f" in rit {pos}")
+        # Alle betrokken medewerkers vergrendelen, in vaste volgorde (geen deadlocks)
+        employee_ids = sorted({_lock_key(ride.get("employee_id")) for ride in rides}, key=repr)
+        locks = [self._employee_lock(employee_id) for employee_id in employee_ids]
+        for lock in locks:
+            await lock.acquire()
+        try:
+            return await self._run(self._submit_batch, rides)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    @metrics.timed("api_employee_totals")
+    def employee_totals(self, employee_id, day=None):
+        self.state.refresh()
+        employee = self._employee(employee_id)
+        day = _parse_date(day) if day else self.state.rules.clock()
+        rules = self.state.rules
+        rule = rules.rule_for(employee, day)
+        return {
+            "employee_id": employee["id"],
+            "date": day,
+            "rate": rule.rate,
+            "config_version": rule.version,
+            "month_total": rules.period_total(employee["id"], *month_bounds(day)),
+            "year_total": rules.period_total(employee["id"], *year_bounds(day)),
+            "day_points": self.storage.rides.day_points(employee["id"], day),
+            "pending_total": self.storage.rides.pending_total(employee["id"]),
+        }
+
+    def _export(self, compress, partition_by, aggregate):
+        self.state.refresh()
+        entry, path = run_export(
+            self.storage, self.state.employee_index, compress=compress, partition_by=partition_by, aggregate=aggregate
+        )
+        self.state.refresh(force=True)  # nieuwe export lock meteen actief
+        if entry is None:
+            return {"exported": False}
+        return {"exported": True, "path": path, **entry}
+
+    async def trigger_export(self, payload):
+        payload = payload if isinstance(payload, dict) else {}
+        compress = bool(payload.get("compress", False))
+        partition_by = payload.get("partition_by") or []
+        if not isinstance(partition_by, list) or any(key not in PARTITION_KEYS for key in partition_by):
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"Ongeldige partition_by: kies uit {', '.join(PARTITION_KEYS)}")
+        aggregate = bool(payload.get("aggregate", False))
+        if aggregate and partition_by:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "aggregate en partition_by kunnen niet samen")
+        async with self._export_lock:
+            return await self._run(self._export, compress, tuple(partition_by), aggregate)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    # -------------------------------------------------------------------------
+    # HTTP/1.1 (keep-alive) bovenop asyncio streams
+    # -------------------------------------------------------------------------
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_BYTES:
+                    status, payload, keep_alive = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "Body te groot"}, False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload = await self.dispatch(method, target, body)
+                    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+                if isinstance(payload, str):
+                    data, content_type = payload.encode("utf-8"), METRICS_CONTENT_TYPE
+                else:
+                    data = json.dumps(payload, default=_json_default, ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json; charset=utf-8"
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(storage, host=API_HOST, port=API_PORT):
+    api = RideApi(storage)
+    server = await asyncio.start_server(api.serve_connection, host, port, backlog=1024)
+    print(f"Fietsvergoeding API op http://{host}:{port}", file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        api.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP/JSON API voor ritregistratie.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database (standaard FIETSVERGOEDING_DB)")
+    parser.add_argument("--metrics", action="store_true", help="Verzamel metrics (GET /metrics)")
+    parser.add_argument("--profile-dir", help="Schrijf per request een cProfile dump naar deze map")
+    args = parser.parse_args(argv)
+    if args.metrics:
+        metrics.enable()
+    if args.profile_dir:
+        metrics.enable_profiling(args.profile_dir)
+
+    storage = SqliteStorage(args.db)
+    try:
+        asyncio.run(serve(storage, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        storage.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,262 +1,222 @@
-import streamlit as st
-import pandas as pd
-from datetime import datetime, date
-from dateutil.relativedelta import relativedelta
+import os
+from datetime import date, timedelta
+
+import metrics
+
+# Koude start: de imports zijn de eerste gemeten fase. pandas (en bulk_import, dat
+# pandas nodig heeft) wordt pas geladen in de views met tabellen: het werknemer
+# dashboard, de validatie en de ritregistratie draaien zonder.
+with metrics.startup_phase("imports"):
+    import streamlit as st
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    import event_log
+    from employees import DEFAULT_ENTITY, DEFAULT_FISCAL_STATUS
+    from payroll_export import PARTITION_KEYS, recover_exports, run_export
+    from recalculation import REPORT_COLUMNS as RECALC_COLUMNS, apply_plan, plan_recalculation
+    from rules import month_bounds, year_bounds
+    from scheduler import DeadlineJobs, FileSink, deadline_window
+    from shared_state import SharedState
+    from storage import DB_PATH, SqliteStorage
 
 # =============================================================================
-# 1. STATE MANAGEMENT (In-Memory Database)
+# 1. STATE MANAGEMENT (Persistente SQLite Database)
 # =============================================================================
 
+EXPORT_PREVIEW_ROWS = 500
+HISTORY_PAGE_SIZE = 50
+HISTORY_CACHE_ENTRIES = 1000  # geformatteerde historiek-pagina's, over alle sessies
+EXPORT_HISTORY_COLUMNS = ["batch_id", "export_date", "period_start", "period_end", "ride_count", "total_amount"]
+
+# 1. CONFIGURATIE DATA (Standaard waarden, aanpasbaar door HR)
+DEFAULT_CONFIG = {
+    "BE_RATE": 0.27,
+    "BE_LIMIT_TYPE": "YEARLY",  # NEW: YEARLY or MONTHLY
+    "BE_YEARLY_LIMIT": 3160.00,
+    "BE_MONTHLY_LIMIT": 265.00,  # NEW: ~3160/12
+    "BE_LIMIT_ENFORCE_MODE": "BLOCK",  # NEW v4.2: BLOCK or CAP
+    "NL_RATE": 0.23,
+    "NL_COMPANY_BIKE_RATE": 0.00,  # NEW v4.3: Configurable rate for NL company bikes (can be > 0 but taxable)
+    "DEADLINE_DAY": 15,
+    "MAX_RIDES_DAY": 2
+}
+
+# 2. MASTER DATA (Werknemers & Vaste Trajecten)
+DEFAULT_EMPLOYEES = {
+    "Jean (BE)": {
+        "id": 101,
+        "name": "Jean Dupont",
+        "country": "BE",
+        "bike_type": "own",
+        "current_year_total": 3140.00,
+        "trajectories": {"Thuis-Werk (Brussel)": 25} # VASTE AFSTAND (Verklaring op Eer)
+    },
+    "Kees (NL - Eigen fiets)": {
+        "id": 102,
+        "name": "Kees Jansen",
+        "country": "NL",
+        "bike_type": "own",
+        "current_year_total": 500.00,
+        "trajectories": {"Thuis-Werk (Utrecht)": 15}
+    },
+    "Sophie (NL - Bedrijfsfiets)": {
+        "id": 103,
+        "name": "Sophie de Vries",
+        "country": "NL",
+        "bike_type": "company",
+        "current_year_total": 0.00,
+        "trajectories": {"Thuis-Werk (Amsterdam)": 10}
+    }
+}
+
+@st.cache_resource
+def get_storage():
+    """
+    Eén gedeelde storage (SQLite in WAL mode) voor alle Streamlit sessies van dit proces.
+    Een lege database wordt gevuld met de standaard configuratie en master data,
+    en een door een crash onderbroken export wordt afgerond of opgeruimd. Staan er
+    veel events na de laatste snapshot van de event log, dan komt er een nieuwe.
+    """
+    with metrics.startup_phase("storage"):
+        storage = SqliteStorage(DB_PATH)
+        storage.seed(DEFAULT_CONFIG, DEFAULT_EMPLOYEES)
+        recover_exports(storage)
+        event_log.maybe_snapshot(storage)
+    return storage
+
+@st.cache_resource
+def get_shared_state():
+    """Procesbrede read-mostly toestand (config, master data, exports, uitzonderingen) voor alle sessies."""
+    return SharedState(get_storage())
+
+@st.cache_resource
+def get_deadline_jobs():
+    """
+    Scheduler thread van dit proces: laat deadline uitzonderingen op hun vervaldag
+    vervallen en verstuurt dagelijks de deadline herinneringen (zie scheduler.py).
+    """
+    jobs = DeadlineJobs(get_shared_state(), FileSink())
+    jobs.start()
+    return jobs
+
 def init_session_state():
     """
-    Initialiseert de applicatie state.
-    Simuleert een database met 3 tabellen: Config, Users (Master), Rides (Transactions).
+    Initialiseert de applicatie state vanuit de persistente storage.
+    Tabellen: Config, Users (Master), Rides (Transactions), Export History, Deadline Exceptions.
+    Elke sessie krijgt referenties naar dezelfde gedeelde snapshot (zie shared_state.py),
+    die enkel herladen wordt als de storage versie wijzigde; de ritten worden niet
+    gekopieerd maar via de store bevraagd. De snapshot is read-only: wijzigingen gaan
+    via de storage en zijn bij de volgende run zichtbaar in alle sessies.
     """
-    # 1. CONFIGURATIE DATA (Standaard waarden, aanpasbaar door HR)
-    if "config" not in st.session_state:
-        st.session_state.config = {
-            "BE_RATE": 0.27,
-            "BE_LIMIT_TYPE": "YEARLY",  # NEW: YEARLY or MONTHLY
-            "BE_YEARLY_LIMIT": 3160.00,
-            "BE_MONTHLY_LIMIT": 265.00,  # NEW: ~3160/12
-            "BE_LIMIT_ENFORCE_MODE": "BLOCK",  # NEW v4.2: BLOCK or CAP
-            "NL_RATE": 0.23,
-            "NL_COMPANY_BIKE_RATE": 0.00,  # NEW v4.3: Configurable rate for NL company bikes (can be > 0 but taxable)
-            "DEADLINE_DAY": 15,
-            "MAX_RIDES_DAY": 2
-        }
-
-    # 2. MASTER DATA (Werknemers & Vaste Trajecten)
-    if "employees" not in st.session_state:
-        st.session_state.employees = {
-            "Jean (BE)": {
-                "id": 101,
-                "name": "Jean Dupont",
-                "country": "BE",
-                "bike_type": "own",
-                "current_year_total": 3140.00,
-                "trajectories": {"Thuis-Werk (Brussel)": 25} # VASTE AFSTAND (Verklaring op Eer)
-            },
-            "Kees (NL - Eigen fiets)": {
-                "id": 102,
-                "name": "Kees Jansen",
-                "country": "NL",
-                "bike_type": "own",
-                "current_year_total": 500.00,
-                "trajectories": {"Thuis-Werk (Utrecht)": 15}
-            },
-            "Sophie (NL - Bedrijfsfiets)": {
-                "id": 103,
-                "name": "Sophie de Vries",
-                "country": "NL",
-                "bike_type": "company",
-                "current_year_total": 0.00,
-                "trajectories": {"Thuis-Werk (Amsterdam)": 10}
-            }
-        }
-
-    # 3. TRANSACTIONELE DATA (Ritten)
-    if "rides" not in st.session_state:
-        st.session_state.rides = []
+    shared = get_shared_state()
+    with metrics.startup_phase("state"):  # koud: uit de voorberekende startup snapshot
+        state = shared.current()
+    get_deadline_jobs().sync(state)  # nieuwe of verlengde uitzonderingen in de timer heap
+
+    # 1. CONFIGURATIE DATA (onveranderlijke snapshots met ingangsdatum; config = snapshot van vandaag)
+    st.session_state.config_history = state.config_history
+    st.session_state.config = state.config_history.at(date.today()).values
+
+    # 2. MASTER DATA
+    st.session_state.employees = state.employees
+    st.session_state.employee_index = state.employee_index  # employee_id -> employee
+
+    # 3. TRANSACTIONELE DATA (Ritten, geïndexeerd per medewerker/dag/maand)
+    st.session_state.rides = get_storage().rides
     
     # 4. EXPORT HISTORY (Logging van exports naar Payroll)
-    if "export_history" not in st.session_state:
-        st.session_state.export_history = []
+    st.session_state.export_history = state.export_history
+    st.session_state.export_locks = state.export_locks  # samengevoegde vergrendelde periodes
     
     # 5. DEADLINE EXCEPTIONS (v4.3: Per-employee deadline overrides)
-    if "deadline_exceptions" not in st.session_state:
-        st.session_state.deadline_exceptions = {}  # {employee_id: expiration_date}
+    st.session_state.deadline_exceptions = state.deadline_exceptions  # {employee_id: expiration_date}
+    
+    # 6. RULES ENGINE (Business logic op de state hierboven, zonder Streamlit afhankelijkheid)
+    st.session_state.rules = state.rules
+
+    # Eigen (niet gedeelde) state van deze sessie voor het geheugenrapport
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        shared.track_session(ctx.session_id, st.session_state)
 
 # =============================================================================
 # 2. BUSINESS LOGIC (Core Domain)
 # =============================================================================
 
+def get_rules():
+    """RulesEngine voor deze run, op de config snapshots, ritten, export locks en uitzonderingen uit de session state."""
+    return st.session_state.rules
+
+@metrics.timed()
 def calculate_period_total(employee_id, start_date, end_date):
     """
     Berekent het totaal bedrag voor een specifieke periode.
     Gebruikt voor maand- en jaarlimiet controles.
+    Volledige maanden/jaren zijn een O(1) lookup in de lopende totalen van de RideStore.
     """
-    total = 0.0
-    for ride in st.session_state.rides:
-        if ride["employee_id"] == employee_id:
-            if start_date <= ride["date"] <= end_date:
-                total += ride["amount"]
-    return total
+    return get_rules().period_total(employee_id, start_date, end_date)
 
+@metrics.timed()
 def is_month_exported(date_obj):
     """
     Controleert of een maand al geëxporteerd is (en dus read-only moet zijn).
+    Bisect lookup in de samengevoegde export periodes (ExportLocks).
     """
-    for export in st.session_state.export_history:
-        if export["period_start"] <= date_obj <= export["period_end"]:
-            return True
-    return False
+    return get_rules().is_month_exported(date_obj)
 
+@metrics.timed()
 def validate_ride_submission(employee, date_obj, trajectory_name, ride_type):
     """
-    Valideert een rit tegen de HUIDIGE configuratie regels.
-    Nieuwe versie: Ondersteunt maand/jaar limieten, historische correcties, export locking, en single/return trips.
+    Valideert een rit tegen de HUIDIGE configuratie regels (zie rules.RulesEngine).
+    Ondersteunt maand/jaar limieten, historische correcties, export locking, en single/return trips.
     """
-    cfg = st.session_state.config
-    msgs = []
-    is_valid = True
-    
-    # Haal vaste afstand op uit Master Data (Niet user input!)
-    distance = employee["trajectories"][trajectory_name]
-    
-    # 0. Toekomst Check (NIEUW v4.1)
-    if date_obj > date.today():
-        return False, ["❌ Je kan geen ritten in de toekomst registreren."], 0.0
-    
-    # 1. Export Lock Check (Nieuwe Regel)
-    if is_month_exported(date_obj):
-        return False, ["❌ Deze maand is al geëxporteerd en kan niet meer gewijzigd worden."], 0.0
-    
-    # 2. Tijdvenster Validatie (Huidige maand + Vorige maand tot deadline)
-    today = date.today()
-    current_month_start = date(today.year, today.month, 1)
-    
-    # Bereken vorige maand
-    if today.month == 1:
-        previous_month_start = date(today.year - 1, 12, 1)
-    else:
-        previous_month_start = date(today.year, today.month - 1, 1)
-    
-    # Deadline voor vorige maand
-    deadline_previous_month = date(today.year, today.month, cfg["DEADLINE_DAY"])
-    
-    # NEW v4.3: Check for deadline exceptions
-    has_exception = False
-    if employee["id"] in st.session_state.deadline_exceptions:
-        exception_date = st.session_state.deadline_exceptions[employee["id"]]
-        if today <= exception_date:
-            has_exception = True
-            msgs.append(f"ℹ️ Uitzondering actief: je mag ritten tot {exception_date} invoeren")
-    
-    # Logica:
-    # - Huidige maand: altijd toegestaan
-    # - Vorige maand: alleen tot deadline van huidige maand (tenzij exception actief)
-    # - Ouder dan vorige maand: niet toegestaan
-    if date_obj >= current_month_start:
-        # Huidige maand - OK
-        pass
-    elif date_obj >= previous_month_start:
-        # Vorige maand - check deadline OF exception
-        if today <= deadline_previous_month or has_exception:
-            msgs.append(f"ℹ️ Let op: je corrigeert een rit uit de vorige maand (deadline: {deadline_previous_month})")
-        else:
-            return False, [f"❌ Deze datum kan niet meer worden ingevoerd (alleen huidige + vorige maand tot {deadline_previous_month})"], 0.0
-    else:
-        # Te oud of na deadline
-        return False, [f"❌ Deze datum kan niet meer worden ingevoerd (alleen huidige + vorige maand tot {deadline_previous_month})"], 0.0
-
-    # 3. Daglimiet Check - Rit-Punten Systeem (v4.4)
-    # Nieuwe logica: Enkel=1 punt, Heen-en-Terug=2 punten, max 2 punten/dag
-    rides_today = [r for r in st.session_state.rides 
-                   if r["employee_id"] == employee["id"] and r["date"] == date_obj]
-    
-    # Bereken huidige rit-punten
-    current_points = 0
-    for ride in rides_today:
-        if ride.get("ride_type") == "Heen-en-Terug":
-            current_points += 2
-        else:  # "Enkel" of oude ritten zonder ride_type
-            current_points += 1
-    
-    # Bereken punten voor nieuwe rit
-    new_ride_points = 2 if ride_type == "Heen-en-Terug" else 1
-    total_points = current_points + new_ride_points
-    
-    # Valideer tegen limiet
-    if total_points > cfg["MAX_RIDES_DAY"]:
-        return False, [
-            f"❌ Daglimiet overschreden: je hebt al {current_points}/2 rit-punten vandaag. "
-        ], 0.0
-
-    # 4. Berekening (NU MET KEUZE ENKEL/RETOUR - v4.1)
-    factor = 2 if ride_type == "Heen-en-Terug" else 1
-    total_km = distance * factor
-    amount = 0.0
-    
-    if employee["country"] == "BE":
-        amount = total_km * cfg["BE_RATE"]
-        
-        # Fiscale Limiet Check (NU MET MAAND/JAAR KEUZE + ENFORCE MODE!)
-        if cfg["BE_LIMIT_TYPE"] == "MONTHLY":
-            # Bereken maand totaal
-            month_start = date(date_obj.year, date_obj.month, 1)
-            if date_obj.month == 12:
-                month_end = date(date_obj.year, 12, 31)
-            else:
-                next_month = date_obj.month + 1
-                month_end = date(date_obj.year, next_month, 1) - relativedelta(days=1)
-            
-            month_total = calculate_period_total(employee["id"], month_start, month_end)
-            limit = cfg["BE_MONTHLY_LIMIT"]
-            
-            if (month_total + amount) > limit:
-                # Check enforcement mode
-                if cfg.get("BE_LIMIT_ENFORCE_MODE", "BLOCK") == "CAP":
-                    # Afkap-logica: vergoed gedeeltelijk tot limiet
-                    allowed_amount = max(0, limit - month_total)
-                    if allowed_amount > 0:
-                        original_amount = amount
-                        amount = allowed_amount
-                        allowed_km = allowed_amount / cfg["BE_RATE"] if cfg["BE_RATE"] > 0 else 0
-                        msgs.append(f"⚠️ Maandlimiet bereikt! Slechts {allowed_km:.1f}km van je rit wordt vergoed (€{allowed_amount:.2f} van €{original_amount:.2f})")
-                    else:
-                        return False, [f"❌ Maandelijkse limiet (€{limit:.2f}) volledig bereikt. Geen vergoeding mogelijk."], 0.0
-                else:  # BLOCK mode
-                    return False, [f"❌ Maandelijkse limiet (€{limit:.2f}) overschreden!"], 0.0
-        else:  # YEARLY
-            # Bereken jaar totaal
-            year_start = date(date_obj.year, 1, 1)
-            year_end = date(date_obj.year, 12, 31)
-            year_total = calculate_period_total(employee["id"], year_start, year_end)
-            limit = cfg["BE_YEARLY_LIMIT"]
-            
-            if (year_total + amount) > limit:
-                # Check enforcement mode
-                if cfg.get("BE_LIMIT_ENFORCE_MODE", "BLOCK") == "CAP":
-                    # Afkap-logica: vergoed gedeeltelijk tot limiet
-                    allowed_amount = max(0, limit - year_total)
-                    if allowed_amount > 0:
-                        original_amount = amount
-                        amount = allowed_amount
-                        allowed_km = allowed_amount / cfg["BE_RATE"] if cfg["BE_RATE"] > 0 else 0
-                        msgs.append(f"⚠️ Jaarlimiet bereikt! Slechts {allowed_km:.1f}km van je rit wordt vergoed (€{allowed_amount:.2f} van €{original_amount:.2f})")
-                    else:
-                        return False, [f"❌ Jaarlijkse limiet (€{limit:.2f}) volledig bereikt. Geen vergoeding mogelijk."], 0.0
-                else:  # BLOCK mode
-                    return False, [f"❌ Jaarlijkse limiet (€{limit:.2f}) overschreden!"], 0.0
-            
-    elif employee["country"] == "NL":
-        # NEW v4.3: Bedrijfsfiets kan nu een configureerbaar tarief hebben (wel belastbaar)
-        if employee["bike_type"] == "company":
-            amount = total_km * cfg["NL_COMPANY_BIKE_RATE"]
-            if cfg["NL_COMPANY_BIKE_RATE"] == 0.0:
-                msgs.append("ℹ️ Bedrijfsfiets (NL) = €0 vergoeding.")
-            else:
-                msgs.append(f"⚠️ Bedrijfsfiets (NL) = €{cfg['NL_COMPANY_BIKE_RATE']:.2f}/km (BELASTBAAR inkomen).")
-        else:
-            amount = total_km * cfg["NL_RATE"]
-
-    msgs.append(f"✅ Rit gevalideerd: €{amount:.2f} voor {total_km}km")
-    return True, msgs, amount
+    return get_rules().validate_ride(employee, date_obj, trajectory_name, ride_type)
 
 # =============================================================================
 # 3. UI LAYOUTS (Role Based)
 # =============================================================================
 
+@st.cache_data(max_entries=HISTORY_CACHE_ENTRIES, show_spinner=False)
+def load_history_page(employee_id, year, month, page, data_version):
+    """
+    Geformatteerde pagina van "Mijn Ritten" (nieuwste eerst).
+    `data_version` is de ritversie van de medewerker: de cache blijft geldig tot
+    die medewerker een rit toevoegt of zijn ritten geëxporteerd worden.
+    """
+    import pandas as pd  # lazy: zie de imports bovenaan
+
+    page_rides = get_storage().rides.history(
+        employee_id, year, month, offset=page * HISTORY_PAGE_SIZE, limit=HISTORY_PAGE_SIZE
+    )
+    with metrics.span("load_history_page"):
+        df = pd.DataFrame(page_rides)
+        return pd.DataFrame({
+            "Datum": pd.to_datetime(df["date"]).dt.strftime("%d-%m-%Y"),
+            "Traject": df["trajectory"],
+            "Afstand": df["distance"].astype(str) + " km",
+            "Bedrag": "€" + df["amount"].map("{:.2f}".format),
+            "Status": df["processed"].map({True: "✅ Verwerkt", False: "⏳ Nieuw"}),
+        })
+
+@metrics.timed()
 def render_hr_dashboard():
+    import pandas as pd  # lazy: zie de imports bovenaan
+    from bulk_import import CSV_SEPARATOR, count_rows, import_rides, iter_chunks
+
     st.header("👔 HR Admin Dashboard")
     st.markdown("Beheer Configuratie en Master Data.")
     
-    tab1, tab2, tab3 = st.tabs(["⚙️ Configuratie", "👥 Medewerkers Beheer", "📊 Export"])
+    tab1, tab2, tab3, tab4 = st.tabs(["⚙️ Configuratie", "👥 Medewerkers Beheer", "📊 Export", "📥 Bulk Import"])
     
     with tab1:
         st.subheader("Systeem Parameters (Configuratie Data)")
-        st.info("⚠️ Pas op: Wijzigingen hebben direct effect op nieuwe ritten!")
+        st.info("⚠️ Pas op: Wijzigingen gelden voor alle ritten vanaf de ingangsdatum (ook correcties op oudere datums)!")
+        current = st.session_state.config_history.at(date.today())
+        st.caption(
+            f"Actieve versie: v{current.version} (geldig vanaf "
+            f"{'het begin' if current.effective_from == date.min else current.effective_from}) · "
+            f"{len(st.session_state.config_history)} versie(s) bewaard"
+        )
         
         # Wettelijke grenzen (voor waarschuwingen, geen harde blokkade)
         BE_TAX_FREE_MAX = 0.35  # Wettelijk belastingvrij maximum België
@@ -347,22 +307,75 @@ def render_hr_dashboard():
         else:
             st.caption("✂️ **CAP modus:** Het systeem vergoedt gedeeltelijk tot aan de limiet (overschrijdende kilometers worden niet vergoed).")
         
+        st.divider()
+        effective_from = st.date_input(
+            "Geldig vanaf",
+            date.today(),
+            help="Ritten met een datum vanaf deze dag worden berekend met de nieuwe versie; oudere ritten behouden de vorige versie."
+        )
+        
         if st.button("💾 Sla Configuratie Op"):
-            st.session_state.config["BE_RATE"] = new_be
-            st.session_state.config["BE_LIMIT_TYPE"] = new_limit_type
-            st.session_state.config["BE_LIMIT_ENFORCE_MODE"] = new_enforce_mode
-            st.session_state.config["NL_RATE"] = new_nl
-            st.session_state.config["NL_COMPANY_BIKE_RATE"] = new_nl_company  # NEW v4.3
-            st.session_state.config["DEADLINE_DAY"] = new_deadline_day
+            # Nieuwe snapshot in plaats van mutatie: ritten die nu gevalideerd worden,
+            # gebruiken ofwel de oude ofwel de nieuwe versie, nooit een mengvorm.
+            new_config = dict(st.session_state.config)
+            new_config["BE_RATE"] = new_be
+            new_config["BE_LIMIT_TYPE"] = new_limit_type
+            new_config["BE_LIMIT_ENFORCE_MODE"] = new_enforce_mode
+            new_config["NL_RATE"] = new_nl
+            new_config["NL_COMPANY_BIKE_RATE"] = new_nl_company  # NEW v4.3
+            new_config["DEADLINE_DAY"] = new_deadline_day
             
             # Update limits based on type
             if new_limit_type == "YEARLY":
-                st.session_state.config["BE_YEARLY_LIMIT"] = new_yearly_limit
+                new_config["BE_YEARLY_LIMIT"] = new_yearly_limit
             else:
-                st.session_state.config["BE_MONTHLY_LIMIT"] = new_monthly_limit
+                new_config["BE_MONTHLY_LIMIT"] = new_monthly_limit
+            
+            version = get_storage().save_config(new_config, effective_from)
                 
-            st.success("✅ Configuratie bijgewerkt!")
+            st.success(f"✅ Configuratie bijgewerkt (versie {version}, geldig vanaf {effective_from})!")
+            st.session_state.recalc_plan = None  # vorige impact analyse is verouderd
             st.rerun()
+        
+        # Retroactieve herberekening: eerst het diff rapport, pas na bevestiging doorvoeren
+        st.divider()
+        st.markdown("##### 🔁 Herberekening Onverwerkte Ritten")
+        st.caption("Berekent de nog niet geëxporteerde ritten opnieuw met de configuratie versie die op hun ritdatum geldt (in datumvolgorde, inclusief BLOCK/CAP). Geëxporteerde ritten blijven ongewijzigd.")
+        if st.button("🔍 Bereken Impact"):
+            st.session_state.recalc_plan = plan_recalculation(
+                st.session_state.rides,
+                st.session_state.employee_index,
+                st.session_state.config_history,
+            )
+        
+        plan = st.session_state.get("recalc_plan")
+        if plan is not None:
+            if not plan.changes and not plan.retagged:
+                st.success("✅ Alle onverwerkte ritten zijn berekend met de geldende configuratie.")
+            else:
+                col_a, col_b, col_c = st.columns(3)
+                col_a.metric("Ritten Gewijzigd", len(plan))
+                col_b.metric("Medewerkers", len(plan.employees))
+                col_c.metric("Verschil", f"€{plan.delta:+.2f}")
+                if plan.retagged:
+                    st.caption(f"ℹ️ {len(plan.retagged)} rit(ten) krijgen enkel het nieuwe versienummer (bedrag ongewijzigd).")
+                if plan.changes:
+                    diff = pd.DataFrame(plan.changes, columns=RECALC_COLUMNS)
+                    st.dataframe(diff.head(EXPORT_PREVIEW_ROWS), use_container_width=True, hide_index=True)
+                    st.download_button(
+                        "⬇️ Download Diff Rapport",
+                        diff.to_csv(sep=CSV_SEPARATOR, index=False),
+                        "herberekening_diff.csv",
+                        "text/csv",
+                        key="download_recalc_diff"
+                    )
+                if st.button("✅ Herberekening Doorvoeren", type="primary"):
+                    st.session_state.recalc_plan = None
+                    if apply_plan(st.session_state.rides, plan):
+                        st.success(f"✅ {len(plan)} ritten herberekend!")
+                        st.rerun()
+                    else:
+                        st.error("❌ Er werden intussen ritten toegevoegd of geëxporteerd. Bereken de impact opnieuw.")
 
     with tab2:
         st.subheader("Medewerkers Beheer (Master Data)")
@@ -379,20 +392,23 @@ def render_hr_dashboard():
                 bike = st.selectbox("Type Fiets", ["own", "company"])
                 traj_name = st.text_input("Initieel Traject (bv. Thuis-Werk)")
                 traj_dist = st.number_input("Afstand (km - Enkel)", min_value=1)
+                entity = st.text_input("Juridische Entiteit", value=DEFAULT_ENTITY)
                 
                 if st.form_submit_button("➕ Voeg Medewerker Toe"):
                     new_key = f"{name} ({country})"
                     if new_key in st.session_state.employees:
                         st.error(f"❌ Medewerker '{new_key}' bestaat al!")
                     else:
-                        st.session_state.employees[new_key] = {
-                            "id": len(st.session_state.employees) + 100,
+                        # De gedeelde master data blijft ongewijzigd; de volgende run laadt een nieuwe snapshot
+                        get_storage().save_employee(new_key, {
+                            "id": st.session_state.employee_index.next_id(),
                             "name": name,
                             "country": country,
                             "bike_type": bike,
+                            "entity": entity.strip() or DEFAULT_ENTITY,
                             "current_year_total": 0.0,
                             "trajectories": {traj_name: traj_dist}
-                        }
+                        })
                         st.success(f"✅ Medewerker {name} toegevoegd!")
                         st.rerun()
         
@@ -413,7 +429,10 @@ def render_hr_dashboard():
                     elif new_traj_name in st.session_state.employees[selected_emp]["trajectories"]:
                         st.error(f"❌ Traject '{new_traj_name}' bestaat al voor deze medewerker!")
                     else:
-                        st.session_state.employees[selected_emp]["trajectories"][new_traj_name] = new_traj_dist
+                        employee = st.session_state.employees[selected_emp]
+                        get_storage().save_employee(selected_emp, dict(
+                            employee, trajectories={**employee["trajectories"], new_traj_name: new_traj_dist}
+                        ))
                         st.success(f"✅ Traject '{new_traj_name}' goedgekeurd voor {selected_emp}!")
                         st.rerun()
         
@@ -429,39 +448,26 @@ def render_hr_dashboard():
                 exc_employee = st.selectbox("Medewerker", list(st.session_state.employees.keys()))
                 exc_until = st.date_input(
                     "Uitzondering geldig tot",
-                    value=date.today() + relativedelta(days=7),
+                    value=date.today() + timedelta(days=7),
                     help="Deze medewerker mag tot deze datum ritten voor de vorige maand invoeren"
                 )
                 
                 if st.form_submit_button("✅ Sta Uitzondering Toe"):
                     emp_id = st.session_state.employees[exc_employee]["id"]
-                    st.session_state.deadline_exceptions[emp_id] = exc_until
+                    get_storage().set_deadline_exception(emp_id, exc_until)
                     st.success(f"✅ Uitzondering voor {exc_employee} actief tot {exc_until}")
                     st.rerun()
         
         with col_exc_2:
             st.markdown("**Actieve Uitzonderingen:**")
             if st.session_state.deadline_exceptions:
+                # Vervallen uitzonderingen worden door de scheduler verwijderd (get_deadline_jobs)
                 today = date.today()
-                active_exceptions = []
-                expired_exceptions = []
-                
-                for emp_id, exp_date in st.session_state.deadline_exceptions.items():
-                    # Find employee name
-                    emp_name = "Onbekend"
-                    for key, emp_data in st.session_state.employees.items():
-                        if emp_data["id"] == emp_id:
-                            emp_name = key
-                            break
-                    
-                    if exp_date >= today:
-                        active_exceptions.append(f"✅ {emp_name} (tot {exp_date})")
-                    else:
-                        expired_exceptions.append(emp_id)
-                
-                # Clean up expired exceptions
-                for exp_id in expired_exceptions:
-                    del st.session_state.deadline_exceptions[exp_id]
+                active_exceptions = [
+                    f"✅ {st.session_state.employee_index.key(emp_id)} (tot {exp_date})"
+                    for emp_id, exp_date in st.session_state.deadline_exceptions.items()
+                    if exp_date >= today
+                ]
                 
                 if active_exceptions:
                     for exc in active_exceptions:
@@ -471,127 +477,243 @@ def render_hr_dashboard():
             else:
                 st.caption("Geen uitzonderingen ingesteld")
 
+        # Audit: append-only event log (zie event_log.py), nieuwste eerst
+        st.divider()
+        with st.expander("🔎 Audit Log"):
+            audit_employee = st.selectbox(
+                "Medewerker", ["(alle)"] + list(st.session_state.employees.keys()), key="audit_employee"
+            )
+            audit_kind = st.selectbox("Soort", ["(alle)"] + list(event_log.EVENT_KINDS), key="audit_kind")
+            audit_events = get_storage().load_events(
+                employee_id=None if audit_employee == "(alle)" else st.session_state.employees[audit_employee]["id"],
+                kind=None if audit_kind == "(alle)" else audit_kind,
+            )
+            if audit_events:
+                st.dataframe(pd.DataFrame({
+                    "#": [event.seq for event in audit_events],
+                    "Tijdstip": [event.recorded_at for event in audit_events],
+                    "Soort": [event.kind for event in audit_events],
+                    "Medewerker": [
+                        st.session_state.employee_index.key(event.employee_id) if event.employee_id is not None else ""
+                        for event in audit_events
+                    ],
+                    "Omschrijving": [event_log.describe(event) for event in audit_events],
+                }), use_container_width=True, hide_index=True)
+            else:
+                st.caption("Geen events gevonden")
+
     with tab3:
         st.subheader("📊 Export naar Payroll")
         
-        # Filter onverwerkte ritten
-        unprocessed_rides = [r for r in st.session_state.rides if not r.get("processed", False)]
+        # Aantal en totaal komen uit de store (geen scan over alle ritten). De secties
+        # hieronder zijn fragmenten: de export opties herrekenen de preview niet.
+        pending_count, total_amount = st.session_state.rides.pending_summary()
         
-        if unprocessed_rides:
-            st.success(f"✅ {len(unprocessed_rides)} nieuwe rit(ten) klaar voor export")
-            
-            # Preview van te exporteren ritten
-            df = pd.DataFrame(unprocessed_rides)
-            df_display = df.copy()
-            
-            # NEW v4.3: Add Fiscal Status column
-            def get_fiscal_status(row):
-                # Find employee data
-                for emp_data in st.session_state.employees.values():
-                    if emp_data["id"] == row["employee_id"]:
-                        if emp_data["country"] == "NL" and emp_data["bike_type"] == "company":
-                            return "BELAST"
-                        return "ONBELAST"
-                return "ONBELAST"
-            
-            df["fiscal_status"] = df.apply(get_fiscal_status, axis=1)
-            
-            df_display["date"] = pd.to_datetime(df_display["date"]).dt.strftime("%d-%m-%Y")
-            df_display["distance"] = df_display["distance"].apply(lambda x: f"{x} km")
-            df_display["amount"] = df_display["amount"].apply(lambda x: f"€{x:.2f}")
-            df_display["rate_applied"] = df_display["rate_applied"].apply(lambda x: f"€{x:.2f}/km")
-            df_display["fiscal_status"] = df["fiscal_status"]
-            
-            df_display = df_display.rename(columns={
-                "date": "Datum",
-                "employee_id": "Medewerker ID",
-                "employee_name": "Naam",
-                "trajectory": "Traject",
-                "distance": "Afstand",
-                "amount": "Bedrag",
-                "rate_applied": "Tarief",
-                "fiscal_status": "Fiscaal Statuut"
-            })
-            
-            st.dataframe(df_display, use_container_width=True, hide_index=True)
-            
-            # Totaal bedrag
-            total_amount = sum([r["amount"] for r in unprocessed_rides])
-            st.metric("Totaal te exporteren bedrag", f"€{total_amount:.2f}")
-            
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                # CSV export met processing
-                if st.button("📥 Verwerk Export en Download", type="primary"):
-                    # 1. Genereer export file
-                    csv = df.to_csv(sep=";", index=False).encode('utf-8')
-                    
-                    # 2. Bepaal export periode
-                    dates = [r["date"] for r in unprocessed_rides]
-                    period_start = min(dates)
-                    period_end = max(dates)
-                    
-                    # 3. Maak export batch ID
-                    batch_id = len(st.session_state.export_history) + 1
-                    export_timestamp = datetime.now()
-                    
-                    # 4. Markeer alle ritten als verwerkt
-                    for ride in st.session_state.rides:
-                        if not ride.get("processed", False):
-                            ride["processed"] = True
-                            ride["export_batch_id"] = batch_id
-                            ride["export_timestamp"] = export_timestamp
-                    
-                    # 5. Log export in geschiedenis
-                    st.session_state.export_history.append({
-                        "batch_id": batch_id,
-                        "export_date": export_timestamp,
-                        "period_start": period_start,
-                        "period_end": period_end,
-                        "ride_count": len(unprocessed_rides),
-                        "total_amount": total_amount
-                    })
-                    
-                    st.success(f"✅ Export Batch #{batch_id} verwerkt! Download hieronder:")
-                    st.download_button(
-                        "⬇️ Download Payroll CSV",
-                        csv,
-                        f"payroll_batch_{batch_id}_{export_timestamp.strftime('%Y%m%d_%H%M%S')}.csv",
-                        "text/csv",
-                        key="download_csv"
-                    )
-                    st.rerun()
-            
-            with col2:
-                st.info("ℹ️ Na verwerking worden deze ritten vergrendeld en niet meer weergegeven.")
+        if pending_count:
+            render_export_preview(pending_count, total_amount)
         else:
             st.info("✔️ Geen nieuwe ritten om te exporteren. Alle ritten zijn al verwerkt.")
+        render_export_actions(pending_count)
+        render_export_history()
+
+    with tab4:
+        st.subheader("📥 Bulk Import van Ritten")
+        st.caption(
+            f"CSV (scheidingsteken '{CSV_SEPARATOR}') of Parquet met kolommen date, employee_id, trajectory, ride_type. "
+            "Elke rij wordt gevalideerd met dezelfde regels als een ingediende rit, in bestandsvolgorde."
+        )
         
-        # Export Geschiedenis
-        st.divider()
-        st.markdown("#### 📜 Export Geschiedenis")
-        
-        if st.session_state.export_history:
-            export_df = pd.DataFrame(st.session_state.export_history)
-            export_df["export_date"] = pd.to_datetime(export_df["export_date"]).dt.strftime("%d-%m-%Y %H:%M")
-            export_df["period_start"] = pd.to_datetime(export_df["period_start"]).dt.strftime("%d-%m-%Y")
-            export_df["period_end"] = pd.to_datetime(export_df["period_end"]).dt.strftime("%d-%m-%Y")
-            export_df["total_amount"] = export_df["total_amount"].apply(lambda x: f"€{x:.2f}")
+        upload = st.file_uploader("Bestand met ritten", type=["csv", "parquet"])
+        if upload is not None and st.button("📥 Importeer Ritten", type="primary"):
+            total_rows = count_rows(upload, upload.name)
+            progress_bar = st.progress(0.0, text="Import gestart...")
             
-            export_df = export_df.rename(columns={
-                "batch_id": "Batch #",
-                "export_date": "Export Datum",
-                "period_start": "Periode Start",
-                "period_end": "Periode Eind",
-                "ride_count": "Aantal Ritten",
-                "total_amount": "Totaal Bedrag"
-            })
+            def show_progress(done):
+                if total_rows:
+                    progress_bar.progress(min(done / total_rows, 1.0), text=f"{done}/{total_rows} rijen verwerkt")
+                else:
+                    progress_bar.progress(0.0, text=f"{done} rijen verwerkt")
             
-            st.dataframe(export_df, use_container_width=True, hide_index=True)
+            st.session_state.last_import = import_rides(
+                get_storage(),
+                iter_chunks(upload, upload.name),
+                st.session_state.employee_index,
+                st.session_state.config_history,
+                st.session_state.export_locks,
+                st.session_state.deadline_exceptions,
+                progress=show_progress,
+            )
+            progress_bar.progress(1.0, text="Import voltooid")
+        
+        # Rapport van de laatste import (blijft zichtbaar na een rerun)
+        report = st.session_state.get("last_import")
+        if report:
+            col_a, col_b, col_c = st.columns(3)
+            col_a.metric("Geïmporteerd", report["accepted"])
+            col_b.metric("Afgewezen", report["rejected"])
+            col_c.metric("Totaal Bedrag", f"€{report['total_amount']:.2f}")
+            
+            if report["rejected"]:
+                st.warning(f"⚠️ {report['rejected']} van {report['total']} rijen afgewezen:")
+                st.dataframe(report["rejections"].head(EXPORT_PREVIEW_ROWS), use_container_width=True, hide_index=True)
+                st.download_button(
+                    "⬇️ Download Afwijzingsrapport",
+                    report["rejections"].to_csv(sep=CSV_SEPARATOR, index=False),
+                    "bulk_import_afgewezen.csv",
+                    "text/csv",
+                    key="download_rejections"
+                )
+            else:
+                st.success(f"✅ Alle {report['total']} rijen geïmporteerd.")
+
+@st.fragment
+@metrics.timed()
+def render_export_preview(pending_count, total_amount):
+    """
+    Preview van de eerste onverwerkte ritten met het totaal.
+    Hangt af van de onverwerkte ritten en de master data (fiscaal statuut); heeft geen eigen widgets.
+    """
+    import pandas as pd  # lazy: zie de imports bovenaan
+
+    st.success(f"✅ {pending_count} nieuwe rit(ten) klaar voor export")
+    
+    # Preview van de eerste ritten; de export zelf wordt in chunks gestreamd
+    preview_chunks = st.session_state.rides.iter_unprocessed(EXPORT_PREVIEW_ROWS)
+    preview_rides = next(preview_chunks, [])
+    preview_chunks.close()
+    
+    df_display = pd.DataFrame(preview_rides)
+    
+    # NEW v4.3: Add Fiscal Status column
+    df_display["fiscal_status"] = (
+        df_display["employee_id"].map(st.session_state.employee_index.status_by_id).fillna(DEFAULT_FISCAL_STATUS)
+    )
+    
+    df_display["date"] = pd.to_datetime(df_display["date"]).dt.strftime("%d-%m-%Y")
+    df_display["distance"] = df_display["distance"].apply(lambda x: f"{x} km")
+    df_display["amount"] = df_display["amount"].apply(lambda x: f"€{x:.2f}")
+    df_display["rate_applied"] = df_display["rate_applied"].apply(lambda x: f"€{x:.2f}/km")
+    
+    df_display = df_display.rename(columns={
+        "date": "Datum",
+        "employee_id": "Medewerker ID",
+        "employee_name": "Naam",
+        "trajectory": "Traject",
+        "distance": "Afstand",
+        "amount": "Bedrag",
+        "rate_applied": "Tarief",
+        "fiscal_status": "Fiscaal Statuut"
+    })
+    
+    st.dataframe(df_display, use_container_width=True, hide_index=True)
+    if pending_count > len(preview_rides):
+        st.caption(f"Preview van de eerste {len(preview_rides)} van {pending_count} ritten.")
+    
+    # Totaal bedrag
+    st.metric("Totaal te exporteren bedrag", f"€{total_amount:.2f}")
+
+@st.fragment
+@metrics.timed()
+def render_export_actions(pending_count):
+    """
+    Export opties, de verwerking en de downloads van de laatste batch.
+    De opties en downloads herrekenen enkel dit fragment; een verwerkte export
+    start een volledige run (preview, locks en geschiedenis veranderen mee).
+    """
+    if pending_count:
+        compress = st.checkbox("🗜️ Comprimeer export (gzip)", value=False)
+        aggregate = st.checkbox(
+            "📊 Samenvatting per medewerker per maand", value=False,
+            help="Eén rij per medewerker per maand (ritten, km, bedrag BELAST/ONBELAST) in plaats van één rij per rit.",
+        )
+        partition_by = st.multiselect(
+            "🗂️ Partitioneer per (één bestand per waarde + manifest)", PARTITION_KEYS,
+            help="Bv. land of entiteit: aparte payroll bestanden voor BE/NL, parallel gegenereerd.",
+        )
+    
+        col1, col2 = st.columns(2)
+    
+        with col1:
+            # CSV export met processing
+            if st.button("📥 Verwerk Export en Download", type="primary"):
+                # Bestand uit een leessnapshot, markering en geschiedenis in één korte transactie
+                # (zie payroll_export.run_export)
+                export_entry, export_path = run_export(
+                    get_storage(), st.session_state.employee_index, compress=compress,
+                    partition_by=() if aggregate else partition_by, aggregate=aggregate,
+                )
+                if export_entry is not None:  # None: een andere sessie exporteerde deze ritten al
+                    # Geschiedenis en locks komen bij de rerun uit een nieuwe gedeelde snapshot
+                    st.session_state.last_export = export_path
+                st.rerun()
+    
+        with col2:
+            st.info("ℹ️ Na verwerking worden deze ritten vergrendeld en niet meer weergegeven.")
+    
+    # Download van de laatst verwerkte batch (blijft beschikbaar na de rerun)
+    last_export = st.session_state.get("last_export")
+    if last_export and os.path.exists(last_export):
+        st.success("✅ Export verwerkt! Download hieronder:")
+        if os.path.isdir(last_export):  # gepartitioneerde batch: shards + manifest
+            export_files = [os.path.join(last_export, name) for name in sorted(os.listdir(last_export))]
         else:
-            st.caption("Nog geen exports uitgevoerd.")
+            export_files = [last_export]
+        for export_file_path in export_files:
+            file_name = os.path.basename(export_file_path)
+            if file_name.endswith(".gz"):
+                mime = "application/gzip"
+            elif file_name.endswith(".json"):
+                mime = "application/json"
+            else:
+                mime = "text/csv"
+            with open(export_file_path, "rb") as export_file:
+                st.download_button(
+                    f"⬇️ Download {file_name}" if len(export_files) > 1 else "⬇️ Download Payroll CSV",
+                    export_file,
+                    file_name,
+                    mime,
+                    key=f"download_{file_name}"
+                )
+
+@st.fragment
+@metrics.timed()
+def render_export_history():
+    """Export Geschiedenis. Hangt enkel af van de export geschiedenis in de session state en het archief."""
+    import pandas as pd  # lazy: zie de imports bovenaan
 
+    st.divider()
+    st.markdown("#### 📜 Export Geschiedenis")
+    
+    if st.session_state.export_history:
+        export_df = pd.DataFrame(st.session_state.export_history, columns=EXPORT_HISTORY_COLUMNS)
+        export_df["export_date"] = pd.to_datetime(export_df["export_date"]).dt.strftime("%d-%m-%Y %H:%M")
+        export_df["period_start"] = pd.to_datetime(export_df["period_start"]).dt.strftime("%d-%m-%Y")
+        export_df["period_end"] = pd.to_datetime(export_df["period_end"]).dt.strftime("%d-%m-%Y")
+        export_df["total_amount"] = export_df["total_amount"].apply(lambda x: f"€{x:.2f}")
+    
+        export_df = export_df.rename(columns={
+            "batch_id": "Batch #",
+            "export_date": "Export Datum",
+            "period_start": "Periode Start",
+            "period_end": "Periode Eind",
+            "ride_count": "Aantal Ritten",
+            "total_amount": "Totaal Bedrag"
+        })
+    
+        st.dataframe(export_df, use_container_width=True, hide_index=True)
+
+        # Geëxporteerde ritten verhuizen na de export naar het archief (zie ride_archive.py)
+        archived = get_storage().rides.archive_status()
+        if archived:
+            st.caption(
+                f"🧊 {sum(row[3] for row in archived):,} geëxporteerde ritten in het archief "
+                f"({len(archived)} maanden, {sum(row[2] for row in archived)} segmenten); "
+                "ze tellen mee in de totalen en blijven zichtbaar in de historiek."
+            )
+    else:
+        st.caption("Nog geen exports uitgevoerd.")
+
+@metrics.timed()
 def render_employee_portal():
     st.header("🚲 Werknemer Portaal")
     
@@ -599,29 +721,30 @@ def render_employee_portal():
     user_key = st.selectbox("Kies je account (Simulatie Login)", list(st.session_state.employees.keys()))
     employee = st.session_state.employees[user_key]
     
+    # Elke sectie is een fragment met de medewerker als expliciete input: een
+    # filter of een afgewezen rit herrekent enkel die sectie, een andere
+    # medewerker kiezen of een rit registreren herrekent alles.
+    render_employee_dashboard(employee)
+    render_ride_form(employee)
+    render_ride_history(employee)
+
+@st.fragment
+@metrics.timed()
+def render_employee_dashboard(employee):
+    """
+    1. Enhanced Dashboard (Read-Only Master Data + Totals).
+    Hangt af van de ritten van de medewerker (periodetotalen, rit-punten) en de config van vandaag;
+    heeft geen eigen widgets en wordt dus enkel bij een volledige run herrekend.
+    """
     # Calculate current month and year totals for this employee
     today = date.today()
-    month_start = date(today.year, today.month, 1)
-    if today.month == 12:
-        month_end = date(today.year, 12, 31)
-    else:
-        month_end = date(today.year, today.month + 1, 1) - relativedelta(days=1)
-    
-    year_start = date(today.year, 1, 1)
-    year_end = date(today.year, 12, 31)
+    month_total = calculate_period_total(employee["id"], *month_bounds(today))
+    year_total = calculate_period_total(employee["id"], *year_bounds(today))
     
-    month_total = calculate_period_total(employee["id"], month_start, month_end)
-    year_total = calculate_period_total(employee["id"], year_start, year_end)
+    # Tarief en limiet van vandaag (v4.3: NL bedrijfsfiets), gememoiseerd per (land, fiets, datum)
+    rule = get_rules().rule_for(employee, today)
+    rate = rule.rate
     
-    # Determine rate (v4.3: Updated for NL company bikes)
-    if employee["country"] == "BE":
-        rate = st.session_state.config["BE_RATE"]
-    elif employee["bike_type"] == "company":
-        rate = st.session_state.config["NL_COMPANY_BIKE_RATE"]  # NEW v4.3: Configurable
-    else:
-        rate = st.session_state.config["NL_RATE"]
-    
-    # 1. Enhanced Dashboard (Read-Only Master Data + Totals)
     with st.expander("👤 Mijn Dashboard", expanded=True):
         col1, col2, col3, col4 = st.columns(4)
         col1.metric("Land", employee["country"])
@@ -631,7 +754,6 @@ def render_employee_portal():
         
         # For Belgian employees, show limit status
         if employee["country"] == "BE":
-            cfg = st.session_state.config
             st.divider()
             st.markdown("##### 📊 Fiscale Limiet Status (België)")
             
@@ -641,21 +763,21 @@ def render_employee_portal():
                 st.metric("Dit Jaar", f"€{year_total:.2f}")
                 
             with col_b:
-                if cfg["BE_LIMIT_TYPE"] == "YEARLY":
-                    limit = cfg["BE_YEARLY_LIMIT"]
+                if rule.limit_type == "YEARLY":
+                    limit = rule.limit
                     remaining = limit - year_total
                     progress = year_total / limit if limit > 0 else 0
-                    st.metric(f"Jaarlijkse Limiet ({cfg['BE_LIMIT_TYPE']})", f"€{limit:.2f}")
+                    st.metric(f"Jaarlijkse Limiet ({rule.limit_type})", f"€{limit:.2f}")
                     
                     if progress >= 0.9:
                         st.warning(f"⚠️ Let op! Je benadert de jaarlijkse limiet. Nog €{remaining:.2f} beschikbaar.")
                     
                     st.progress(progress, text=f"€{remaining:.2f} resterend")
                 else:  # MONTHLY
-                    limit = cfg["BE_MONTHLY_LIMIT"]
+                    limit = rule.limit
                     remaining = limit - month_total
                     progress = month_total / limit if limit > 0 else 0
-                    st.metric(f"Maandelijkse Limiet ({cfg['BE_LIMIT_TYPE']})", f"€{limit:.2f}")
+                    st.metric(f"Maandelijkse Limiet ({rule.limit_type})", f"€{limit:.2f}")
                     
                     if progress >= 0.9:
                         st.warning(f"⚠️ Let op! Je benadert de maandelijkse limiet. Nog €{remaining:.2f} beschikbaar.")
@@ -664,28 +786,25 @@ def render_employee_portal():
         
         # NIEUWE FEATURE v4.4: Rit-Punten Vandaag (Enkel=1, Heen-Terug=2)
         st.divider()
-        rides_today = [r for r in st.session_state.rides 
-                       if r["employee_id"] == employee["id"] and r["date"] == today]
-        
         # Bereken rit-punten voor vandaag
-        points_today = 0
-        for ride in rides_today:
-            if ride.get("ride_type") == "Heen-en-Terug":
-                points_today += 2
-            else:
-                points_today += 1
-        
-        st.caption(f"🚴 **Rit-punten vandaag:** {points_today}/{st.session_state.config['MAX_RIDES_DAY']} (Enkel=1pt, Heen-Terug=2pt)")
+        points_today = st.session_state.rides.day_points(employee["id"], today)
         
-        # Deadline reminder
-        deadline_day = st.session_state.config["DEADLINE_DAY"]
-        deadline_date = date(today.year, today.month, deadline_day)
-        days_until_deadline = (deadline_date - today).days
+        st.caption(f"🚴 **Rit-punten vandaag:** {points_today}/{rule.max_ride_points} (Enkel=1pt, Heen-Terug=2pt)")
         
-        if 0 < days_until_deadline <= 5:
+        # Deadline reminder (zelfde venster als de herinneringen van de scheduler)
+        window = deadline_window(st.session_state.config, today)
+        if window is not None:
+            deadline_date, days_until_deadline = window
             st.warning(f"📅 Let op: Nog {days_until_deadline} dag(en) tot de deadline ({deadline_date}) voor ritten uit de vorige maand!")
 
-    # 2. Rit Registratie (Transactionele Data)
+@st.fragment
+@metrics.timed()
+def render_ride_form(employee):
+    """
+    2. Rit Registratie (Transactionele Data).
+    Hangt af van de trajecten van de medewerker; een afgewezen rit herrekent enkel dit fragment,
+    een geregistreerde rit start een volledige run (dashboard en historiek veranderen mee).
+    """
     st.subheader("📝 Nieuwe Rit Registreren")
     # NIEUWE FEATURE v4.2: Tooltip voor 2-ritten flexibiliteit
     st.caption("💡 **Tip:** Je kunt tot 2 verschillende ritten per dag invoeren (bijv. ochtend: Traject A, avond: Traject B)")
@@ -707,11 +826,18 @@ def render_employee_portal():
         st.caption(f"ℹ️ {r_traj}: {single_dist} km x {2 if r_type == 'Heen-en-Terug' else 1} = **{total_dist} km**")
         
         if st.form_submit_button("🚀 Dien In"):
+            # Dit fragment draait zonder init_session_state: eerst de export locks en
+            # uitzonderingen verversen, een andere sessie kan intussen geëxporteerd hebben.
+            init_session_state()
             # Geef r_type mee aan de validatie
-            valid, msgs, amount = validate_ride_submission(employee, r_date, r_traj, r_type)
-            
-            if valid:
-                st.session_state.rides.append({
+            # Validatie en opslag gebeuren samen: bij een gelijktijdige rit van dezelfde
+            # medewerker wordt opnieuw gevalideerd tegen de verse totalen.
+            # Tarief en config versie komen uit de snapshot die geldt op de ritdatum.
+            ride_rule = get_rules().rule_for(employee, r_date)
+            valid, msgs, amount = st.session_state.rides.submit_ride(
+                employee["id"],
+                lambda: validate_ride_submission(employee, r_date, r_traj, r_type),
+                lambda amount: {
                     "date": r_date,
                     "employee_id": employee["id"],
                     "employee_name": employee["name"],
@@ -719,58 +845,53 @@ def render_employee_portal():
                     "ride_type": r_type,  # Sla het type op
                     "distance": total_dist,
                     "amount": amount,
-                    "rate_applied": rate,
-                    "processed": False  # NEW: Default to unprocessed
-                })
+                    "rate_applied": ride_rule.rate,
+                    "processed": False,  # NEW: Default to unprocessed
+                    "config_version": ride_rule.version
+                }
+            )
+            
+            if valid:
                 st.success("✅ Rit geregistreerd!")
                 st.rerun()
             else:
                 for m in msgs: st.error(m)
     
-    # 3. Ride History View
+@st.fragment
+@metrics.timed()
+def render_ride_history(employee):
+    """
+    3. Ride History View (gepagineerd, per pagina gecachet op de data-versie van de medewerker).
+    Hangt af van de ritten van de medewerker; het maandfilter en de paginering herrekenen enkel dit fragment.
+    """
     st.divider()
     st.subheader("📜 Mijn Ritten")
     
-    my_rides = [r for r in st.session_state.rides if r["employee_id"] == employee["id"]]
+    rides = st.session_state.rides
+    months_with_rides = rides.months_for_employee(employee["id"])
     
-    if my_rides:
+    if months_with_rides:
         # Month filter
-        months_with_rides = sorted(list(set([r["date"].strftime("%Y-%m") for r in my_rides])), reverse=True)
         selected_month = st.selectbox(
             "Filter per maand",
-            options=["Alle"] + months_with_rides,
+            options=["Alle"] + [f"{y}-{m:02d}" for y, m in reversed(months_with_rides)],
             index=0
         )
+        sel_year, sel_month = (None, None) if selected_month == "Alle" else (int(part) for part in selected_month.split("-"))
+        ride_count, filtered_total = rides.history_summary(employee["id"], sel_year, sel_month)
         
-        # Filter rides
-        if selected_month != "Alle":
-            filtered_rides = [r for r in my_rides if r["date"].strftime("%Y-%m") == selected_month]
-        else:
-            filtered_rides = my_rides
-        
-        # Display table
-        if filtered_rides:
-            df = pd.DataFrame(filtered_rides)
-            df_display = df.copy()
-            df_display["date"] = pd.to_datetime(df_display["date"]).dt.strftime("%d-%m-%Y")
-            df_display["distance"] = df_display["distance"].apply(lambda x: f"{x} km")
-            df_display["amount"] = df_display["amount"].apply(lambda x: f"€{x:.2f}")
-            df_display["status"] = df_display["processed"].apply(lambda x: "✅ Verwerkt" if x else "⏳ Nieuw")
-            
-            df_display = df_display.rename(columns={
-                "date": "Datum",
-                "trajectory": "Traject",
-                "distance": "Afstand",
-                "amount": "Bedrag",
-                "status": "Status"
-            })
+        if ride_count:
+            page_count = -(-ride_count // HISTORY_PAGE_SIZE)
+            page = 1
+            if page_count > 1:
+                page = st.number_input("Pagina", min_value=1, max_value=page_count, value=1, step=1)
             
-            # Select only relevant columns
-            cols_to_show = ["Datum", "Traject", "Afstand", "Bedrag", "Status"]
-            st.dataframe(df_display[cols_to_show], use_container_width=True, hide_index=True)
+            df_display = load_history_page(employee["id"], sel_year, sel_month, page - 1, rides.version(employee["id"]))
+            st.dataframe(df_display, use_container_width=True, hide_index=True)
+            if page_count > 1:
+                st.caption(f"Pagina {page}/{page_count} ({ride_count} ritten, nieuwste eerst)")
             
             # Summary
-            filtered_total = sum([r["amount"] for r in filtered_rides])
             st.metric("Totaal Geselecteerde Periode", f"€{filtered_total:.2f}")
         else:
             st.info("Geen ritten in deze periode.")
@@ -789,10 +910,35 @@ def main():
     role = st.sidebar.radio("Log in als:", ("👤 Werknemer", "👔 HR Manager"))
     st.sidebar.divider()
     
+    # Optioneel één cProfile dump per Streamlit run (FIETSVERGOEDING_PROFILE_DIR)
+    with metrics.profiled("streamlit_run"), metrics.startup_phase("first_render"):
+        if role == "👔 HR Manager":
+            render_hr_dashboard()
+        else:
+            render_employee_portal()
+
+    if role == "👔 HR Manager" and metrics.enabled():
+        with st.sidebar.expander("📈 Metrics (Prometheus)"):
+            st.code(metrics.exposition(), language="text")
+
     if role == "👔 HR Manager":
-        render_hr_dashboard()
-    else:
-        render_employee_portal()
+        with st.sidebar.expander("🚀 Koude Start"):
+            phases = metrics.startup_report()
+            for phase, seconds in phases.items():
+                st.caption(f"{phase}: {seconds * 1000:.0f} ms")
+            st.caption(f"Totaal: {sum(phases.values()) * 1000:.0f} ms")
+
+        # Geheugenbudget: één gedeelde snapshot, per sessie enkel de eigen UI state
+        report = get_shared_state().memory_report()
+        with st.sidebar.expander("🧠 Geheugen (Gedeelde State)"):
+            st.metric("Gedeelde snapshot", f"{report.shared / 1024:.0f} KB")
+            st.metric(f"Eigen state van {report.sessions} sessie(s)", f"{report.session_bytes / 1024:.0f} KB")
+            st.caption(f"Zonder deling: ±{report.unshared / 1024:.0f} KB (een kopie per sessie)")
+            total = report.shared + report.session_bytes
+            if total > report.budget:
+                st.warning(f"⚠️ {total / 2**20:.1f} MB boven het budget van {report.budget / 2**20:.0f} MB")
+            else:
+                st.progress(total / report.budget, text=f"{total / 2**20:.1f} van {report.budget / 2**20:.0f} MB")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,326 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from ride_store import RIDE_TYPE_RETURN, RIDE_TYPES
+from rules import (
+    LIMIT_LABELS,
+    MSG_DAY_LIMIT,
+    MSG_EXCEPTION,
+    MSG_EXPORTED,
+    MSG_FUTURE,
+    MSG_LIMIT_BLOCKED,
+    MSG_LIMIT_CAPPED,
+    MSG_LIMIT_EXHAUSTED,
+    MSG_NL_COMPANY_FREE,
+    MSG_NL_COMPANY_TAXED,
+    MSG_PREVIOUS_MONTH,
+    MSG_VALID,
+    MSG_WINDOW,
+    REASON_CAPPED,
+    REASON_DAY_LIMIT,
+    REASON_EXPORTED,
+    REASON_FUTURE,
+    REASON_LIMIT_BLOCKED,
+    REASON_LIMIT_EXHAUSTED,
+    REASON_OK,
+    REASON_WINDOW,
+    submission_window,
+)
+
+# =============================================================================
+# BATCH VALIDATIE (Bulk import van ritten)
+# =============================================================================
+# Past dezelfde regels toe als rules.RulesEngine.validate_ride, maar op een
+# volledige tabel kandidaat-ritten tegelijk. De rijen worden beschouwd alsof ze één voor
+# één in tabelvolgorde werden ingediend: een geaccepteerde rit telt mee voor de
+# rit-punten en de BE limiet van de volgende rijen, een geweigerde niet.
+#
+# De regels per rij (toekomst, export lock, deadline venster + uitzonderingen,
+# tarief en bedrag) zijn volledig gevectoriseerd; tarief en limiet komen per rij
+# uit de config snapshot die geldt op de ritdatum (ConfigHistory.resolve).
+# De volgorde-afhankelijke regels (rit-punten per dag, BE limiet) gebruiken
+# gegroepeerde cumulatieve sommen; enkel de medewerkers waarbij een rij effectief over een limiet gaat,
+# worden daarna rij per rij (in volgorde) afgehandeld, zodat BLOCK/CAP exact
+# hetzelfde resultaat geven als het enkelvoudige pad.
+
+REQUIRED_COLUMNS = ("date", "employee_id", "trajectory", "ride_type")
+
+MSG_INVALID_DATE = "❌ Ongeldige datum."
+MSG_UNKNOWN_EMPLOYEE = "❌ Onbekende medewerker (employee_id {employee_id})."
+MSG_UNKNOWN_TRAJECTORY = "❌ Traject '{trajectory}' is niet goedgekeurd voor deze medewerker."
+MSG_UNKNOWN_RIDE_TYPE = "❌ Onbekend rittype '{ride_type}' (kies uit " + ", ".join(RIDE_TYPES) + ")."
+
+REASON_INVALID_DATE = "invalid_date"
+REASON_UNKNOWN_EMPLOYEE = "unknown_employee"
+REASON_UNKNOWN_TRAJECTORY = "unknown_trajectory"
+REASON_UNKNOWN_RIDE_TYPE = "unknown_ride_type"
+
+
+def _as_frame(candidates):
+    """Accepteert een DataFrame, een Arrow tabel (to_pandas) of alles wat pd.DataFrame aanvaardt."""
+    if hasattr(candidates, "to_pandas"):
+        candidates = candidates.to_pandas()
+    frame = pd.DataFrame(candidates).reset_index(drop=True)
+    missing = [col for col in REQUIRED_COLUMNS if col not in frame.columns]
+    if missing:
+        raise ValueError(f"Ontbrekende kolommen voor batch validatie: {', '.join(missing)}")
+    return frame
+
+
+def _limit_key(limit_type, emp_id, day):
+    if limit_type == "MONTHLY":
+        return (emp_id, day.year, day.month)
+    return (emp_id, day.year)
+
+
+def _store_limit_total(rides, key):
+    if len(key) == 3:
+        return rides.month_total(*key)
+    return rides.year_total(*key)
+
+
+def _record_outcomes(reasons, valid, capped):
+    """Telt de verdicts van een batch (zelfde tellers als RulesEngine.validate_ride)."""
+    accepted = int(valid.sum())
+    if accepted > capped:
+        metrics.count("validations", accepted - capped, outcome="accepted", reason=REASON_OK)
+    if capped:
+        metrics.count("validations", capped, outcome="capped", reason=REASON_CAPPED)
+    for reason, rejected in pd.Series(reasons[~valid]).value_counts().items():
+        metrics.count("validations", int(rejected), outcome="rejected", reason=reason)
+
+
+@metrics.timed()
+def validate_batch(candidates, employee_index, configs, rides, export_locks, deadline_exceptions, today=None):
+    """
+    Valideert een tabel kandidaat-ritten (kolommen date, employee_id, trajectory,
+    ride_type) tegen de config snapshots (ConfigHistory), de ride store, de
+    vergrendelde export periodes (ExportLocks) en de deadline uitzonderingen.
+
+    Geeft een kopie van de tabel terug met extra kolommen employee_name, distance
+    (totale km), rate_applied, config_version, amount, valid en messages; per rij dezelfde
+    verdict/berichten/bedragen als RulesEngine.validate_ride bij indienen in volgorde.
+    """
+    today = today or date.today()
+    frame = _as_frame(candidates)
+    n = len(frame)
+
+    days = pd.to_datetime(frame["date"], errors="coerce").to_numpy().astype("datetime64[D]")
+    ride_dates = days.astype(object)  # datetime.date (None bij een ongeldige datum), zoals in de ride store
+    frame["date"] = ride_dates
+    emp_ids = pd.to_numeric(frame["employee_id"], errors="coerce").to_numpy()
+    ride_types = frame["ride_type"].to_numpy(dtype=object)
+    trajectories = frame["trajectory"].to_numpy(dtype=object)
+
+    reject = np.full(n, None, dtype=object)
+    reasons = np.full(n, None, dtype=object)  # REASON_* van de weigerende regel (metrics)
+
+    def reject_where(mask, message, reason):
+        mask = mask & (reject == None)  # noqa: E711 (element-wise)
+        reasons[mask] = reason
+        if isinstance(message, str):
+            reject[mask] = message
+        else:
+            reject[mask] = [message(i) for i in np.flatnonzero(mask)]
+
+    reject_where(np.isnat(days), MSG_INVALID_DATE, REASON_INVALID_DATE)
+
+    # 1. Master data: medewerker, goedgekeurd traject (vaste afstand) en rittype
+    # (een tikfout is geen stille enkele rit)
+    employees = {emp_id: employee_index.get(emp_id) for emp_id in pd.unique(emp_ids)}
+    known = np.array([employees.get(emp_id) is not None for emp_id in emp_ids], dtype=bool)
+    reject_where(~known, lambda i: MSG_UNKNOWN_EMPLOYEE.format(employee_id=emp_ids[i]), REASON_UNKNOWN_EMPLOYEE)
+
+    distances = pd.Series(
+        {
+            (emp_id, name): km
+            for emp_id, employee in employees.items() if employee is not None
+            for name, km in employee["trajectories"].items()
+        },
+        dtype=object,
+    )
+    single_km = distances.reindex(pd.MultiIndex.from_arrays([emp_ids, trajectories])).to_numpy()
+    reject_where(
+        pd.isna(single_km), lambda i: MSG_UNKNOWN_TRAJECTORY.format(trajectory=trajectories[i]), REASON_UNKNOWN_TRAJECTORY
+    )
+    reject_where(
+        ~np.isin(ride_types, RIDE_TYPES), lambda i: MSG_UNKNOWN_RIDE_TYPE.format(ride_type=ride_types[i]),
+        REASON_UNKNOWN_RIDE_TYPE,
+    )
+
+    # 2. Toekomst en export lock
+    reject_where(days > np.datetime64(today, "D"), MSG_FUTURE, REASON_FUTURE)
+    lock_starts = np.array(export_locks.starts, dtype="datetime64[D]")
+    lock_ends = np.array(export_locks.ends, dtype="datetime64[D]")
+    interval = np.searchsorted(lock_starts, days, side="right") - 1
+    exported = (interval >= 0) & (days <= lock_ends[np.maximum(interval, 0)]) if len(lock_starts) else np.zeros(n, dtype=bool)
+    reject_where(exported, MSG_EXPORTED, REASON_EXPORTED)
+
+    # 3. Tijdvenster (huidige maand + vorige maand tot deadline, tenzij uitzondering)
+    current_month_start, previous_month_start, deadline_previous_month = submission_window(
+        today, configs.at(today).values["DEADLINE_DAY"]
+    )
+    active_exceptions = {emp_id: expires for emp_id, expires in deadline_exceptions.items() if today <= expires}
+    has_exception = np.array([emp_id in active_exceptions for emp_id in emp_ids], dtype=bool)
+
+    in_previous_month = (days < np.datetime64(current_month_start, "D")) & (days >= np.datetime64(previous_month_start, "D"))
+    window_closed = days < np.datetime64(previous_month_start, "D")
+    if today > deadline_previous_month:
+        window_closed |= in_previous_month & ~has_exception
+    reject_where(window_closed, MSG_WINDOW.format(deadline=deadline_previous_month), REASON_WINDOW)
+
+    # 4. Tarief en bedrag (Enkel/Heen-en-Terug), per rij uit de snapshot op de ritdatum
+    factor = np.where(ride_types == RIDE_TYPE_RETURN, 2, 1)
+    countries = np.array([employees[e]["country"] if employees.get(e) else None for e in emp_ids], dtype=object)
+    company_bike = np.array([bool(employees.get(e)) and employees[e]["bike_type"] == "company" for e in emp_ids], dtype=bool)
+    row_rules = [
+        configs.resolve(employees[e]["country"], employees[e]["bike_type"], day)
+        if employees.get(e) and day is not None else None
+        for e, day in zip(emp_ids, ride_dates)
+    ]
+    rate = np.array([rule.rate if rule else 0.0 for rule in row_rules], dtype=float)
+    total_km = np.where(pd.isna(single_km), 0, single_km) * factor
+    amount = np.where((countries == "BE") | (countries == "NL"), total_km * rate, 0.0).astype(float)
+    frame["employee_name"] = [employees[e]["name"] if employees.get(e) else None for e in emp_ids]
+    frame["distance"] = total_km
+    frame["rate_applied"] = rate
+    frame["config_version"] = [rule.version if rule else None for rule in row_rules]
+
+    # 5. Volgorde-afhankelijke regels: rit-punten per dag en BE limiet
+    pending = reject == None  # noqa: E711
+    points = factor  # Heen-en-Terug=2, Enkel=1 (zelfde als ride_points)
+    max_points = np.array([rule.max_ride_points if rule else 0 for rule in row_rules])
+    limit = np.array([rule.limit if rule and rule.limit is not None else np.inf for rule in row_rules], dtype=float)
+
+    rows = np.flatnonzero(pending)
+    # Sleutels met Python ints: sqlite3 bindt een numpy.int64 als BLOB (en vindt dan niets)
+    row_emp_ids = emp_ids[rows].astype(np.int64).tolist()
+    day_keys = [(emp_id, ride_dates[i]) for emp_id, i in zip(row_emp_ids, rows)]
+    day_base = {key: rides.day_points(*key) for key in set(day_keys)}
+    point_groups = pd.Series(points[rows]).groupby(pd.Series(day_keys, dtype=object).factorize()[0])
+    running_points = np.array([day_base[key] for key in day_keys], dtype=int) + point_groups.cumsum().to_numpy()
+    conflict = running_points > max_points[rows]
+
+    be_rows = countries[rows] == "BE"
+    limit_keys = [
+        _limit_key(row_rules[i].limit_type, emp_id, ride_dates[i]) if is_be else None
+        for i, emp_id, is_be in zip(rows, row_emp_ids, be_rows)
+    ]
+    limit_base = {key: _store_limit_total(rides, key) for key in set(limit_keys) if key is not None}
+    if limit_base:
+        be_keys = [key for key in limit_keys if key is not None]
+        # De basis wordt bij de eerste rit van elke groep opgeteld, zodat de cumulatieve
+        # som in dezelfde volgorde optelt als opeenvolgende indieningen ((basis + a1) + a2 ...)
+        group_ids = pd.Series(be_keys, dtype=object).factorize()[0]
+        values = amount[rows[be_rows]].copy()
+        first = pd.Series(group_ids).groupby(group_ids).cumcount().to_numpy() == 0
+        values[first] += np.array([limit_base[key] for key, is_first in zip(be_keys, first) if is_first])
+        running_amount = pd.Series(values).groupby(group_ids).cumsum().to_numpy()
+        conflict[be_rows] |= running_amount > limit[rows[be_rows]]
+
+    # Medewerkers zonder enige overschrijding: alles aanvaard (gevectoriseerd).
+    # Medewerkers met een overschrijding: rij per rij met lokale lopende totalen.
+    # Ook medewerkers met zowel maand- als jaarlimieten in de batch (limiet type
+    # gewijzigd tussen snapshots) gaan rij per rij, want die totalen overlappen.
+    limit_types_per_employee = {}
+    for i, key in zip(rows, limit_keys):
+        if key is not None:
+            limit_types_per_employee.setdefault(emp_ids[i], set()).add(len(key))
+    conflicted_employees = set(emp_ids[rows[conflict]]) | {
+        emp_id for emp_id, kinds in limit_types_per_employee.items() if len(kinds) > 1
+    }
+    sequential = np.array([emp_ids[i] in conflicted_employees for i in rows], dtype=bool) if conflicted_employees else np.zeros(len(rows), dtype=bool)
+    cap_messages = {}
+    for pos in np.flatnonzero(sequential):
+        i = rows[pos]
+        rule = row_rules[i]
+        day_key = day_keys[pos]
+        current_points = day_base[day_key]
+        if current_points + points[i] > rule.max_ride_points:
+            reject[i] = MSG_DAY_LIMIT.format(points=current_points)
+            reasons[i] = REASON_DAY_LIMIT
+            continue
+        limit_key = limit_keys[pos]
+        if limit_key is not None:
+            label, adjective = LIMIT_LABELS[rule.limit_type]
+            period_total = limit_base[limit_key]
+            if period_total + amount[i] > rule.limit:
+                if rule.enforce_mode != "CAP":
+                    reject[i] = MSG_LIMIT_BLOCKED.format(adjective=adjective, limit=rule.limit)
+                    reasons[i] = REASON_LIMIT_BLOCKED
+                    continue
+                allowed_amount = max(0, rule.limit - period_total)
+                if not allowed_amount > 0:
+                    reject[i] = MSG_LIMIT_EXHAUSTED.format(adjective=adjective, limit=rule.limit)
+                    reasons[i] = REASON_LIMIT_EXHAUSTED
+                    continue
+                original_amount = amount[i]
+                amount[i] = allowed_amount
+                allowed_km = allowed_amount / rule.rate if rule.rate > 0 else 0
+                cap_messages[i] = MSG_LIMIT_CAPPED.format(
+                    label=label, km=allowed_km, allowed=allowed_amount, original=original_amount
+                )
+            # Een aanvaarde rit telt mee voor zowel het maand- als het jaartotaal
+            day = ride_dates[i]
+            for key in ((row_emp_ids[pos], day.year, day.month), (row_emp_ids[pos], day.year)):
+                if key in limit_base:
+                    limit_base[key] += amount[i]
+        day_base[day_key] = current_points + points[i]
+
+    # 6. Verdicts en berichten (zelfde volgorde als het enkelvoudige pad)
+    valid = reject == None  # noqa: E711
+    amount[~valid] = 0.0
+    total_km_list = total_km.tolist()
+    messages = []
+    for i in range(n):
+        if not valid[i]:
+            messages.append([reject[i]])
+            continue
+        msgs = []
+        if has_exception[i]:
+            msgs.append(MSG_EXCEPTION.format(expires=active_exceptions[emp_ids[i]]))
+        if in_previous_month[i]:
+            msgs.append(MSG_PREVIOUS_MONTH.format(deadline=deadline_previous_month))
+        if i in cap_messages:
+            msgs.append(cap_messages[i])
+        if countries[i] == "NL" and company_bike[i]:
+            company_rate = row_rules[i].rate
+            msgs.append(MSG_NL_COMPANY_FREE if company_rate == 0.0 else MSG_NL_COMPANY_TAXED.format(rate=company_rate))
+        msgs.append(MSG_VALID.format(amount=amount[i], km=total_km_list[i]))
+        messages.append(msgs)
+
+    if metrics.enabled():
+        _record_outcomes(reasons, valid, len(cap_messages))
+
+    frame["amount"] = amount
+    frame["valid"] = valid
+    frame["messages"] = messages
+    return frame
+
+
+def _python_value(value):
+    """NumPy scalars naar Python types (sqlite3 bindt geen numpy.int64)."""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def accepted_rides(result):
+    """Zet de aanvaarde rijen van validate_batch om naar rit-dicts voor de ride store."""
+    accepted = result[result["valid"]]
+    return [
+        {
+            "date": row.date,
+            "employee_id": int(row.employee_id),
+            "employee_name": row.employee_name,
+            "trajectory": row.trajectory,
+            "ride_type": row.ride_type,
+            "distance": _python_value(row.distance),
+            "amount": _python_value(row.amount),
+            "rate_applied": _python_value(row.rate_applied),
+            "processed": False,
+            "config_version": int(row.config_version),
+        }
+        for row in accepted.itertuples(index=False)
+    ]
@@ -0,0 +1,549 @@
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from config_snapshots import ConfigHistory, make_snapshot
+from employees import EmployeeIndex
+from export_locks import ExportLocks
+from payroll_export import write_payroll_csv, write_summary_csv
+from ride_store import RIDE_TYPE_RETURN, RideStore, ride_points
+from rules import RulesEngine, month_bounds, year_bounds
+from storage import SqliteStorage
+
+# =============================================================================
+# BENCHMARKS (Validatie, totalen, historiek en export op productieschaal)
+# =============================================================================
+# Reproduceerbare benchmark harness: een synthetische dataset (medewerkers
+# verdeeld over BE/NL en eigen/bedrijfsfiets, M jaar werkdagen aan ritten,
+# maandelijkse export geschiedenis, deadline uitzonderingen en twee config
+# versies) wordt geladen in de in-memory of de SQLite ride store, waarna elk
+# scenario N keer getimed wordt. Per scenario: latency percentielen, doorvoer
+# en piekgeheugen (tracemalloc, in een aparte run zodat de timing niet vertraagt).
+#
+# Resultaten kunnen als JSON bewaard worden en vergeleken met een baseline; een
+# p95 of piekgeheugen boven baseline * (1 + tolerantie) telt als regressie.
+#
+#   python benchmarks.py --employees 2000 --years 2 --store sqlite --json run.json
+#   python benchmarks.py --store sqlite --archive   # geëxporteerde ritten in het archief
+#   python benchmarks.py --baseline run.json --tolerance 0.25
+
+# Zelfde waarden als app.DEFAULT_CONFIG (app.py importeert streamlit)
+BENCH_CONFIG = {
+    "BE_RATE": 0.27,
+    "BE_LIMIT_TYPE": "YEARLY",
+    "BE_YEARLY_LIMIT": 3160.00,
+    "BE_MONTHLY_LIMIT": 265.00,
+    "BE_LIMIT_ENFORCE_MODE": "BLOCK",
+    "NL_RATE": 0.23,
+    "NL_COMPANY_BIKE_RATE": 0.00,
+    "DEADLINE_DAY": 15,
+    "MAX_RIDES_DAY": 2,
+}
+
+SCENARIO_ITERATIONS = {
+    "single_submit": 2000,
+    "bulk_validation": 5,
+    "dashboard_totals": 2000,
+    "history_page": 2000,
+    "payroll_export": 3,
+    "payroll_summary": 10,
+    "cold_start": 5,
+}
+BULK_BATCH_SIZE = 20_000
+HISTORY_PAGE_SIZE = 50  # zelfde als app.HISTORY_PAGE_SIZE
+REGRESSION_SLACK_MS = 0.05  # absolute marge zodat ruis op sub-ms scenario's geen regressie is
+COLD_START_TARGET_MS = 1000  # doel voor de p50 van cold_start (nieuw proces tot gevalideerde rit)
+
+# Koude start in een nieuw proces: app importeren, storage en gedeelde state
+# opbouwen en één rit valideren zoals het werknemer portaal. Print de startup
+# fases en of pandas geladen werd (het portaal en de validatie hebben het niet nodig).
+COLD_START_SCRIPT = """
+import json, sys
+sys.path.insert(0, sys.argv[1])
+import app, metrics
+state = app.get_shared_state().current()
+employee = next(iter(state.employees.values()))
+day = state.rules.clock()
+state.rules.validate_ride(employee, day, next(iter(employee["trajectories"])), "Enkel")
+print(json.dumps({"phases": metrics.startup_report(), "pandas": "pandas" in sys.modules}))
+"""
+
+
+# =============================================================================
+# SYNTHETISCHE DATASET
+# =============================================================================
+
+def generate_dataset(n_employees=1000, years=2, seed=42, today=None, ride_probability=0.7):
+    """
+    Bouwt een deterministische dataset (zelfde seed en today = zelfde data):
+    employees, configs (v1 sinds altijd, v2 met een hoger BE tarief vanaf 1 januari),
+    ritten op werkdagen (max. 2 rit-punten per dag, BE jaarlimiet gerespecteerd),
+    export_history (één batch per maand vóór de vorige maand, die ritten zijn
+    processed) en deadline_exceptions voor ~2% van de medewerkers.
+    """
+    rng = random.Random(seed)
+    today = today or date.today()
+    employees = {}
+    for i in range(n_employees):
+        employees[f"emp-{i}"] = {
+            "id": 1000 + i,
+            "name": f"Medewerker {i}",
+            "country": "BE" if rng.random() < 0.6 else "NL",
+            "bike_type": "company" if rng.random() < 0.3 else "own",
+            "current_year_total": 0.0,
+            "trajectories": {"Thuis-Werk": rng.randint(3, 30), "Thuis-Station": rng.randint(1, 8)},
+        }
+    configs = ConfigHistory([
+        make_snapshot(1, date.min, BENCH_CONFIG),
+        make_snapshot(2, date(today.year, 1, 1), dict(BENCH_CONFIG, BE_RATE=0.30)),
+    ])
+
+    # Alles vóór de vorige maand is geëxporteerd (één batch per maand)
+    export_before = (date(today.year, today.month, 1) - timedelta(days=1)).replace(day=1)
+    start = today - timedelta(days=365 * years)
+    rides = []
+    year_totals = {}
+    for offset in range((today - start).days + 1):
+        day = start + timedelta(days=offset)
+        if day.weekday() >= 5:
+            continue
+        for employee in employees.values():
+            if rng.random() >= ride_probability:
+                continue
+            rule = configs.resolve(employee["country"], employee["bike_type"], day)
+            # Heen-en-Terug (2 punten) of twee enkele ritten op verschillende trajecten
+            legs = [(RIDE_TYPE_RETURN, "Thuis-Werk")] if rng.random() < 0.8 else [
+                ("Enkel", "Thuis-Werk"), ("Enkel", "Thuis-Station")
+            ]
+            for ride_type, trajectory in legs:
+                distance = employee["trajectories"][trajectory] * ride_points(ride_type)
+                amount = distance * rule.rate
+                key = (employee["id"], day.year)
+                if rule.limit is not None and year_totals.get(key, 0.0) + amount > rule.limit:
+                    continue
+                year_totals[key] = year_totals.get(key, 0.0) + amount
+                rides.append({
+                    "date": day,
+                    "employee_id": employee["id"],
+                    "employee_name": employee["name"],
+                    "trajectory": trajectory,
+                    "ride_type": ride_type,
+                    "distance": distance,
+                    "amount": amount,
+                    "rate_applied": rule.rate,
+                    "processed": False,
+                    "config_version": rule.version,
+                })
+
+    export_history = []
+    batches = {}
+    for ride in rides:
+        if ride["date"] < export_before:
+            month = (ride["date"].year, ride["date"].month)
+            batches.setdefault(month, []).append(ride)
+    for batch_id, (month, batch) in enumerate(sorted(batches.items()), start=1):
+        period_start, period_end = month_bounds(date(month[0], month[1], 1))
+        exported_at = datetime.combine(period_end + timedelta(days=16), datetime.min.time())
+        for ride in batch:
+            ride["processed"] = True
+            ride["export_batch_id"] = batch_id
+            ride["export_timestamp"] = exported_at
+        export_history.append({
+            "batch_id": batch_id,
+            "export_date": exported_at,
+            "period_start": period_start,
+            "period_end": period_end,
+            "ride_count": len(batch),
+            "total_amount": sum(ride["amount"] for ride in batch),
+        })
+
+    deadline_exceptions = {
+        employee["id"]: today + timedelta(days=rng.randint(0, 10))
+        for employee in employees.values() if rng.random() < 0.02
+    }
+    return {
+        "today": today,
+        "employees": employees,
+        "configs": configs,
+        "rides": rides,
+        "export_history": export_history,
+        "deadline_exceptions": deadline_exceptions,
+    }
+
+
+def load_dataset(dataset, store="memory", path=None, archive=False):
+    """
+    Laadt de dataset in een ride store ("memory" of "sqlite") en bouwt de
+    RulesEngine context. Voor sqlite wordt een tijdelijke database gebruikt als
+    `path` niet gegeven is; met `archive` verhuizen de geëxporteerde ritten
+    daarna naar het archief (zie ride_archive.py). Geeft (context, storage of None) terug.
+    """
+    if archive and store != "sqlite":
+        raise ValueError("Het archief bestaat enkel voor de sqlite store")
+    storage = None
+    if store == "sqlite":
+        path = path or os.path.join(tempfile.mkdtemp(prefix="fietsvergoeding-bench-"), "bench.db")
+        storage = SqliteStorage(path)
+        snapshots = list(dataset["configs"])
+        storage.seed(snapshots[0].values, dataset["employees"])
+        for snapshot in snapshots[1:]:
+            storage.save_config(snapshot.values, snapshot.effective_from)
+        for pos in range(0, len(dataset["rides"]), 50_000):
+            storage.rides.append_many(dataset["rides"][pos:pos + 50_000])
+        for entry in dataset["export_history"]:
+            storage.append_export(entry)
+        for employee_id, expires in dataset["deadline_exceptions"].items():
+            storage.set_deadline_exception(employee_id, expires)
+        if archive:
+            storage.rides.archive_exported()
+        rides = storage.rides
+        configs = storage.load_config_history()
+    elif store == "memory":
+        rides = RideStore(dataset["rides"])
+        configs = dataset["configs"]
+    else:
+        raise ValueError(f"Onbekende store: {store}")
+
+    today = dataset["today"]
+    export_locks = ExportLocks(dataset["export_history"])
+    context = {
+        "db_path": path if store == "sqlite" else None,
+        "today": today,
+        "employees": list(dataset["employees"].values()),
+        "employee_index": EmployeeIndex(dataset["employees"]),
+        "configs": configs,
+        "rides": rides,
+        "export_locks": export_locks,
+        "deadline_exceptions": dataset["deadline_exceptions"],
+        "rules": RulesEngine(configs, rides, export_locks, dataset["deadline_exceptions"], clock=lambda: today),
+    }
+    return context, storage
+
+
+# =============================================================================
+# SCENARIO'S
+# =============================================================================
+# Elk scenario krijgt (context, rng) en geeft een functie terug die één
+# operatie uitvoert; de harness timet elke aanroep afzonderlijk.
+
+def scenario_single_submit(ctx, rng):
+    """Eén rit valideren en bewaren (validate_ride_submission + submit_ride)."""
+    rules, rides, today = ctx["rules"], ctx["rides"], ctx["today"]
+
+    def run():
+        employee = rng.choice(ctx["employees"])
+        ride_date = today - timedelta(days=rng.randint(0, 20))
+        trajectory = rng.choice(list(employee["trajectories"]))
+        rule = rules.rule_for(employee, ride_date)
+        rides.submit_ride(
+            employee["id"],
+            lambda: rules.validate_ride(employee, ride_date, trajectory, "Enkel"),
+            lambda amount: {
+                "date": ride_date,
+                "employee_id": employee["id"],
+                "employee_name": employee["name"],
+                "trajectory": trajectory,
+                "ride_type": "Enkel",
+                "distance": employee["trajectories"][trajectory],
+                "amount": amount,
+                "rate_applied": rule.rate,
+                "processed": False,
+                "config_version": rule.version,
+            },
+        )
+    return run
+
+
+def scenario_bulk_validation(ctx, rng):
+    """Eén batch van BULK_BATCH_SIZE kandidaat-ritten valideren (validate_batch, zonder bewaren)."""
+    import pandas as pd
+
+    from batch_validation import validate_batch
+
+    today = ctx["today"]
+    employees = ctx["employees"]
+    frame = pd.DataFrame([
+        {
+            "date": today - timedelta(days=rng.randint(0, 40)),
+            "employee_id": employee["id"],
+            "trajectory": rng.choice(list(employee["trajectories"])),
+            "ride_type": rng.choice([RIDE_TYPE_RETURN, "Enkel"]),
+        }
+        for employee in (rng.choice(employees) for _ in range(BULK_BATCH_SIZE))
+    ])
+
+    def run():
+        validate_batch(
+            frame, ctx["employee_index"], ctx["configs"], ctx["rides"],
+            ctx["export_locks"], ctx["deadline_exceptions"], today=today,
+        )
+    return run
+
+
+def scenario_dashboard_totals(ctx, rng):
+    """De totalen van "Mijn Dashboard": tarief, maand/jaar totaal, rit-punten, openstaand bedrag."""
+    rules, rides, today = ctx["rules"], ctx["rides"], ctx["today"]
+
+    def run():
+        employee = rng.choice(ctx["employees"])
+        rules.rule_for(employee, today)
+        rules.period_total(employee["id"], *month_bounds(today))
+        rules.period_total(employee["id"], *year_bounds(today))
+        rides.day_points(employee["id"], today)
+        rides.pending_total(employee["id"])
+    return run
+
+
+def scenario_history_page(ctx, rng):
+    """Eén pagina "Mijn Ritten": maanden, samenvatting en HISTORY_PAGE_SIZE ritten van een willekeurige maand."""
+    rides = ctx["rides"]
+
+    def run():
+        employee = rng.choice(ctx["employees"])
+        months = rides.months_for_employee(employee["id"])
+        if not months:
+            return
+        year, month = rng.choice(months)
+        count, _ = rides.history_summary(employee["id"], year, month)
+        offset = rng.randrange(0, max(count, 1), HISTORY_PAGE_SIZE)
+        rides.history(employee["id"], year, month, offset=offset, limit=HISTORY_PAGE_SIZE)
+    return run
+
+
+def scenario_payroll_export(ctx, rng):
+    """Volledige payroll CSV van de onverwerkte ritten (naar os.devnull, zonder markering)."""
+    def run():
+        with open(os.devnull, "wb") as sink:
+            write_payroll_csv(ctx["rides"].iter_unprocessed(), ctx["employee_index"], sink)
+    return run
+
+
+def scenario_payroll_summary(ctx, rng):
+    """Maandsamenvatting (per medewerker per maand) van de onverwerkte ritten (naar os.devnull)."""
+    def run():
+        with open(os.devnull, "wb") as sink:
+            write_summary_csv(ctx["rides"].pending_groups(), ctx["employee_index"], sink)
+    return run
+
+
+def scenario_cold_start(ctx, rng):
+    """
+    Koude start van de app in een nieuw Python proces (COLD_START_SCRIPT), op de
+    benchmark database; bij de memory store op een database met enkel config en
+    master data (de ritten blijven in SQLite en worden bij de start niet geladen).
+    """
+    path = ctx["db_path"]
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix="fietsvergoeding-bench-"), "cold_start.db")
+        storage = SqliteStorage(path)
+        storage.seed(BENCH_CONFIG, {f"{employee['name']} ({employee['id']})": employee for employee in ctx["employees"]})
+        storage.close()
+    env = dict(os.environ, FIETSVERGOEDING_DB=path)
+    repo = os.path.dirname(os.path.abspath(__file__))
+
+    def run():
+        completed = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT, repo], env=env, capture_output=True, text=True, check=True
+        )
+        report = json.loads(completed.stdout.strip().splitlines()[-1])
+        if report["pandas"]:
+            raise RuntimeError(f"pandas geladen tijdens de koude start ({report['phases']})")
+    return run
+
+
+SCENARIOS = {
+    "single_submit": scenario_single_submit,
+    "bulk_validation": scenario_bulk_validation,
+    "dashboard_totals": scenario_dashboard_totals,
+    "history_page": scenario_history_page,
+    "payroll_export": scenario_payroll_export,
+    "payroll_summary": scenario_payroll_summary,
+    "cold_start": scenario_cold_start,
+}
+
+
+# =============================================================================
+# HARNESS
+# =============================================================================
+
+def percentile(sorted_values, pct):
+    """Percentiel (nearest-rank) van een gesorteerde lijst."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def run_scenario(name, ctx, iterations, seed=42, measure_memory=True):
+    """
+    Timet `iterations` aanroepen van een scenario. Geeft latency percentielen (ms),
+    doorvoer (ops/s) en piekgeheugen (MB, tracemalloc over één extra aanroep) terug.
+    """
+    rng = random.Random(seed)
+    run = SCENARIOS[name](ctx, rng)
+    run()  # warm-up (imports, caches, prepared statements)
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        run()
+        latencies.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - started
+
+    peak_mb = None
+    if measure_memory:
+        tracemalloc.start()
+        try:
+            run()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "mean_ms": sum(latencies) / len(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": latencies[-1],
+        "ops_per_sec": iterations / elapsed if elapsed > 0 else float("inf"),
+        "peak_mb": peak_mb,
+    }
+
+
+def run_benchmarks(n_employees=1000, years=2, store="memory", scenarios=None, iterations=None,
+                   seed=42, today=None, measure_memory=True, progress=None, archive=False):
+    """Genereert de dataset, laadt ze en draait de scenario's. Geeft het volledige resultaat (dict) terug."""
+    started = time.perf_counter()
+    dataset = generate_dataset(n_employees, years, seed=seed, today=today)
+    generated = time.perf_counter()
+    ctx, storage = load_dataset(dataset, store, archive=archive)
+    loaded = time.perf_counter()
+    results = {}
+    try:
+        for name in scenarios or SCENARIOS:
+            if progress is not None:
+                progress(name)
+            count = (iterations or {}).get(name, SCENARIO_ITERATIONS[name])
+            results[name] = run_scenario(name, ctx, count, seed=seed, measure_memory=measure_memory)
+    finally:
+        if storage is not None:
+            storage.close()
+    return {
+        "params": {
+            "employees": n_employees,
+            "years": years,
+            "store": store,
+            "archive": archive,
+            "seed": seed,
+            "today": dataset["today"].isoformat(),
+            "rides": len(dataset["rides"]),
+            "exports": len(dataset["export_history"]),
+        },
+        "setup_seconds": {"generate": generated - started, "load": loaded - generated},
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # Linux: KB
+        "scenarios": results,
+    }
+
+
+def find_regressions(results, baseline, tolerance=0.25):
+    """
+    Vergelijkt p95 latency en piekgeheugen per scenario met een baseline resultaat.
+    Geeft een lijst van (scenario, metriek, baseline, huidig) terug.
+    """
+    regressions = []
+    for name, current in results["scenarios"].items():
+        reference = baseline.get("scenarios", {}).get(name)
+        if reference is None:
+            continue
+        if current["p95_ms"] > reference["p95_ms"] * (1 + tolerance) + REGRESSION_SLACK_MS:
+            regressions.append((name, "p95_ms", reference["p95_ms"], current["p95_ms"]))
+        if current.get("peak_mb") is not None and reference.get("peak_mb") is not None:
+            if current["peak_mb"] > reference["peak_mb"] * (1 + tolerance) + 1.0:
+                regressions.append((name, "peak_mb", reference["peak_mb"], current["peak_mb"]))
+    return regressions
+
+
+def format_results(results):
+    """Tabel (tekst) met één regel per scenario."""
+    params = results["params"]
+    lines = [
+        f"{params['rides']:,} ritten, {params['employees']} medewerkers, {params['years']} jaar, "
+        f"store={params['store']}{' + archief' if params.get('archive') else ''} (generatie {results['setup_seconds']['generate']:.1f}s, "
+        f"laden {results['setup_seconds']['load']:.1f}s, max RSS {results['max_rss_mb']:.0f} MB)",
+        f"{'scenario':<18}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'ops/s':>11}{'piek MB':>9}",
+    ]
+    for name, r in results["scenarios"].items():
+        peak = f"{r['peak_mb']:.1f}" if r["peak_mb"] is not None else "-"
+        lines.append(
+            f"{name:<18}{r['iterations']:>7}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}"
+            f"{r['max_ms']:>10.3f}{r['ops_per_sec']:>11,.0f}{peak:>9}"
+        )
+    return "\n".join(lines)
+
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks voor validatie, totalen, historiek en export.")
+    parser.add_argument("--employees", type=int, default=1000)
+    parser.add_argument("--years", type=int, default=2)
+    parser.add_argument("--store", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--archive", action="store_true", help="Geëxporteerde ritten naar het archief (enkel sqlite)")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="Enkel dit scenario (herhaalbaar)")
+    parser.add_argument("--iterations", type=int, help="Aantal iteraties voor elk scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--today", type=date.fromisoformat, help="Referentiedatum (YYYY-MM-DD) voor een reproduceerbare dataset")
+    parser.add_argument("--no-memory", action="store_true", help="Geen tracemalloc meting")
+    parser.add_argument("--json", help="Schrijf de resultaten naar dit JSON bestand")
+    parser.add_argument("--baseline", help="Vergelijk met een eerder JSON resultaat (exit 1 bij regressie)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Toegelaten verslechtering t.o.v. de baseline")
+    parser.add_argument("--cold-start-target", type=float, default=COLD_START_TARGET_MS, help="Doel (ms) voor de p50 van cold_start")
+    args = parser.parse_args(argv)
+
+    scenarios = args.scenario or list(SCENARIOS)
+    results = run_benchmarks(
+        args.employees,
+        args.years,
+        store=args.store,
+        scenarios=scenarios,
+        iterations={name: args.iterations for name in scenarios} if args.iterations else None,
+        seed=args.seed,
+        today=args.today,
+        measure_memory=not args.no_memory,
+        progress=lambda name: print(f"… {name}", file=sys.stderr, flush=True),
+        archive=args.archive,
+    )
+    print(format_results(results))
+    status = 0
+    cold_start = results["scenarios"].get("cold_start")
+    if cold_start is not None and cold_start["p50_ms"] > args.cold_start_target:
+        print(f"❌ Koude start p50 {cold_start['p50_ms']:.0f} ms boven het doel van {args.cold_start_target:.0f} ms")
+        status = 1
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fileobj:
+            json.dump(results, fileobj, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fileobj:
+            regressions = find_regressions(results, json.load(fileobj), args.tolerance)
+        for name, metric, before, after in regressions:
+            print(f"❌ Regressie {name}.{metric}: {before:.3f} → {after:.3f}")
+        if regressions:
+            return 1
+        print("✅ Geen regressies t.o.v. de baseline")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
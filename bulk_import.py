@@ -0,0 +1,168 @@
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+import metrics
+from batch_validation import REQUIRED_COLUMNS, accepted_rides, validate_batch
+from employees import EmployeeIndex
+from export_locks import ExportLocks
+from storage import DB_PATH, SqliteStorage
+
+# =============================================================================
+# BULK IMPORT (CSV/Parquet van het badge-systeem)
+# =============================================================================
+# Leest een bestand met kandidaat-ritten in chunks, valideert elke chunk met
+# batch_validation.validate_batch en bewaart de aanvaarde ritten. Alle chunks
+# lopen in één storage transactie: chunk N ziet de ritten van chunk 1..N-1 voor
+# de rit-punten en de BE limiet, en bij een fout wordt niets bewaard.
+
+IMPORT_CHUNK_SIZE = 20_000
+CSV_SEPARATOR = ";"  # zelfde scheidingsteken als de payroll export
+REPORT_COLUMNS = ["row", "date", "employee_id", "trajectory", "ride_type", "reason"]
+
+
+def _is_parquet(name):
+    return str(name).lower().endswith((".parquet", ".pq"))
+
+
+def count_rows(source, name=None):
+    """
+    Aantal data-rijen in het bestand (voor de voortgangsbalk), of None als dat
+    niet goedkoop te bepalen is. Parquet leest enkel de metadata.
+    """
+    name = name or getattr(source, "name", source)
+    if _is_parquet(name):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            return None
+        return pq.ParquetFile(source).metadata.num_rows
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as fileobj:
+            lines = sum(block.count(b"\n") for block in iter(lambda: fileobj.read(1 << 20), b""))
+    else:
+        position = source.tell()
+        lines = source.read().count(b"\n")
+        source.seek(position)
+    return max(lines - 1, 0)  # header
+
+
+def iter_chunks(source, name=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """Streamt het bestand (pad of binair file-object) als DataFrames van maximaal chunk_size rijen."""
+    name = name or getattr(source, "name", source)
+    if _is_parquet(name):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as exc:
+            raise RuntimeError("Parquet import vereist pyarrow (pip install pyarrow).") from exc
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size, columns=list(REQUIRED_COLUMNS)):
+            yield batch.to_pandas()
+        return
+    reader = pd.read_csv(
+        source,
+        sep=CSV_SEPARATOR,
+        encoding="utf-8-sig",
+        usecols=list(REQUIRED_COLUMNS),
+        dtype={"trajectory": str, "ride_type": str},
+        chunksize=chunk_size,
+    )
+    with reader:
+        yield from reader
+
+
+@metrics.timed()
+def import_rides(storage, chunks, employee_index, configs, export_locks, deadline_exceptions,
+                 progress=None, today=None):
+    """
+    Valideert en bewaart alle ritten uit `chunks` in één transactie, met de
+    config snapshots (ConfigHistory) die gelden op de ritdatums.
+    progress(verwerkte_rijen) wordt na elke chunk aangeroepen.
+    Geeft een rapport terug met total, accepted, rejected, total_amount en een
+    DataFrame `rejections` (rijnummer in het bestand, rit en reden).
+    """
+    report = {"total": 0, "accepted": 0, "rejected": 0, "total_amount": 0.0}
+    rejections = []
+    with storage.transaction():
+        for chunk in chunks:
+            result = validate_batch(
+                chunk, employee_index, configs, storage.rides, export_locks, deadline_exceptions, today=today
+            )
+            rides = accepted_rides(result)
+            storage.rides.append_many(rides)
+
+            rejected = result[~result["valid"]]
+            if len(rejected):
+                rejections.append(pd.DataFrame({
+                    "row": rejected.index + report["total"] + 1,
+                    "date": rejected["date"],
+                    "employee_id": rejected["employee_id"],
+                    "trajectory": rejected["trajectory"],
+                    "ride_type": rejected["ride_type"],
+                    "reason": rejected["messages"].str[0],
+                }))
+            report["total"] += len(result)
+            report["accepted"] += len(rides)
+            report["rejected"] += len(rejected)
+            report["total_amount"] += sum(ride["amount"] for ride in rides)
+            if progress is not None:
+                progress(report["total"])
+    report["rejections"] = (
+        pd.concat(rejections, ignore_index=True) if rejections else pd.DataFrame(columns=REPORT_COLUMNS)
+    )
+    return report
+
+
+# =============================================================================
+# CLI (python bulk_import.py ritten.csv [--report afgewezen.csv])
+# =============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import van ritten (CSV met ; of Parquet).")
+    parser.add_argument("path", help="CSV of Parquet bestand met kolommen " + ", ".join(REQUIRED_COLUMNS))
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database (standaard FIETSVERGOEDING_DB)")
+    parser.add_argument("--report", help="Schrijf de afgewezen rijen naar dit CSV bestand")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    storage = SqliteStorage(args.db)
+    try:
+        configs = storage.load_config_history()
+        if not configs:
+            print("❌ Database bevat geen configuratie. Start eerst de applicatie.", file=sys.stderr)
+            return 1
+        total_rows = count_rows(args.path)
+
+        def progress(done):
+            suffix = f"/{total_rows}" if total_rows is not None else ""
+            print(f"\r{done}{suffix} rijen verwerkt", end="", file=sys.stderr, flush=True)
+
+        started = time.perf_counter()
+        report = import_rides(
+            storage,
+            iter_chunks(args.path, chunk_size=args.chunk_size),
+            EmployeeIndex(storage.load_employees()),
+            configs,
+            ExportLocks(storage.load_export_history()),
+            storage.load_deadline_exceptions(),
+            progress=progress,
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        storage.close()
+
+    print(file=sys.stderr)
+    print(
+        f"{report['accepted']} van {report['total']} ritten geïmporteerd (€{report['total_amount']:.2f}), "
+        f"{report['rejected']} afgewezen in {elapsed:.2f}s"
+    )
+    if args.report:
+        report["rejections"].to_csv(args.report, sep=CSV_SEPARATOR, index=False)
+        print(f"Afgewezen rijen: {args.report}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
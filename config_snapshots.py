@@ -0,0 +1,87 @@
+from bisect import bisect_right
+from collections import namedtuple
+from types import MappingProxyType
+
+# =============================================================================
+# CONFIG SNAPSHOTS (Geversioneerde configuratie met ingangsdatum)
+# =============================================================================
+# Elke keer dat HR de configuratie bewaart, ontstaat een nieuwe, onveranderlijke
+# snapshot met een versienummer en een ingangsdatum. Een rit wordt berekend met
+# de snapshot die geldt op de datum van de rit en bewaart dat versienummer, zodat
+# altijd na te gaan is met welke regels een bedrag tot stand kwam.
+
+# Onveranderlijke configuratie: `values` is een read-only mapping
+ConfigSnapshot = namedtuple("ConfigSnapshot", "version effective_from values")
+
+# Opgeloste regel voor (land, fietstype, datum); limit/limit_type zijn None buiten België
+RateRule = namedtuple("RateRule", "version rate limit_type limit enforce_mode max_ride_points")
+
+
+def make_snapshot(version, effective_from, values):
+    """Bouwt een ConfigSnapshot met een read-only kopie van `values`."""
+    return ConfigSnapshot(version, effective_from, MappingProxyType(dict(values)))
+
+
+class ConfigHistory:
+    """
+    Alle config snapshots, gesorteerd op ingangsdatum (bij gelijke datum wint de
+    hoogste versie). resolve() onthoudt elke opgeloste (land, fietstype, datum),
+    zodat tarief en limiet op het hot path één dict lookup zijn.
+    """
+
+    def __init__(self, snapshots=()):
+        self._snapshots = sorted(snapshots, key=lambda snapshot: (snapshot.effective_from, snapshot.version))
+        self._starts = [snapshot.effective_from for snapshot in self._snapshots]
+        self._by_version = {snapshot.version: snapshot for snapshot in self._snapshots}
+        self._rules = {}
+        self._version_rules = {}
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def __iter__(self):
+        return iter(self._snapshots)
+
+    @property
+    def latest(self):
+        """Laatst bewaarde snapshot (hoogste versie), ongeacht de ingangsdatum."""
+        return max(self._snapshots, key=lambda snapshot: snapshot.version)
+
+    def at(self, day):
+        """Snapshot die geldt op `day` (vóór de eerste ingangsdatum: de eerste snapshot)."""
+        pos = bisect_right(self._starts, day) - 1
+        return self._snapshots[max(pos, 0)]
+
+    def resolve(self, country, bike_type, day):
+        """Tarief, limiet en handhaving voor een medewerkerprofiel op een datum (gememoiseerd)."""
+        key = (country, bike_type, day)
+        rule = self._rules.get(key)
+        if rule is None:
+            rule = self._rules[key] = self._resolve(country, bike_type, self.at(day))
+        return rule
+
+    def resolve_version(self, country, bike_type, version):
+        """Regel van een specifieke config versie (gememoiseerd), of None voor een onbekende versie."""
+        key = (country, bike_type, version)
+        if key not in self._version_rules:
+            snapshot = self._by_version.get(version)
+            self._version_rules[key] = None if snapshot is None else self._resolve(country, bike_type, snapshot)
+        return self._version_rules[key]
+
+    @staticmethod
+    def _resolve(country, bike_type, snapshot):
+        cfg = snapshot.values
+        if country == "BE":
+            limit_type = "MONTHLY" if cfg["BE_LIMIT_TYPE"] == "MONTHLY" else "YEARLY"
+            limit = cfg["BE_MONTHLY_LIMIT"] if limit_type == "MONTHLY" else cfg["BE_YEARLY_LIMIT"]
+            return RateRule(
+                snapshot.version,
+                cfg["BE_RATE"],
+                limit_type,
+                limit,
+                cfg.get("BE_LIMIT_ENFORCE_MODE", "BLOCK"),
+                cfg["MAX_RIDES_DAY"],
+            )
+        # v4.3: NL bedrijfsfiets heeft een eigen (belastbaar) tarief
+        rate = cfg["NL_COMPANY_BIKE_RATE"] if bike_type == "company" else cfg["NL_RATE"]
+        return RateRule(snapshot.version, rate, None, None, None, cfg["MAX_RIDES_DAY"])
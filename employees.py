@@ -0,0 +1,73 @@
+# =============================================================================
+# EMPLOYEE INDEX (Master data lookups per employee_id)
+# =============================================================================
+
+# Fiscaal statuut per (land, fietstype), één keer vastgelegd (v4.3):
+# enkel een NL bedrijfsfiets is belastbaar, al de rest is onbelast.
+FISCAL_STATUS_BY_PROFILE = {
+    ("BE", "own"): "ONBELAST",
+    ("BE", "company"): "ONBELAST",
+    ("NL", "own"): "ONBELAST",
+    ("NL", "company"): "BELAST",
+}
+DEFAULT_FISCAL_STATUS = "ONBELAST"
+
+# Juridische entiteit (werkgever) van een medewerker zonder expliciete entiteit
+DEFAULT_ENTITY = "HOOFDZETEL"
+
+
+def fiscal_status(employee):
+    """Fiscaal statuut voor Payroll van één medewerker (None = onbekend = ONBELAST)."""
+    if employee is None:
+        return DEFAULT_FISCAL_STATUS
+    return FISCAL_STATUS_BY_PROFILE.get((employee["country"], employee["bike_type"]), DEFAULT_FISCAL_STATUS)
+
+
+class EmployeeIndex:
+    """
+    Index over de master data `{account_key: employee}` op employee_id.
+    Houdt per id de medewerker, de account key en het voorberekende fiscaal
+    statuut bij, zodat export en uitzonderingen een O(1) lookup doen in plaats
+    van alle medewerkers te doorlopen.
+    """
+
+    def __init__(self, employees=None):
+        self._by_id = {}
+        self._key_by_id = {}
+        self.status_by_id = {}
+        for key, employee in (employees or {}).items():
+            self.add(key, employee)
+
+    def add(self, key, employee):
+        """Voegt een (nieuwe of gewijzigde) medewerker toe aan de index."""
+        emp_id = employee["id"]
+        self._by_id[emp_id] = employee
+        self._key_by_id[emp_id] = key
+        self.status_by_id[emp_id] = fiscal_status(employee)
+
+    def __contains__(self, emp_id):
+        return emp_id in self._by_id
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def next_id(self, start=101):
+        """Eerstvolgende vrije employee_id."""
+        return max(self._by_id, default=start - 1) + 1
+
+    def get(self, emp_id):
+        """Medewerker-dict voor een id, of None."""
+        return self._by_id.get(emp_id)
+
+    def key(self, emp_id, default="Onbekend"):
+        """Account key (weergavenaam in de UI) voor een id."""
+        return self._key_by_id.get(emp_id, default)
+
+    def fiscal_status(self, emp_id):
+        """Voorberekend fiscaal statuut voor een id (onbekend = ONBELAST)."""
+        return self.status_by_id.get(emp_id, DEFAULT_FISCAL_STATUS)
+
+    def entity(self, emp_id):
+        """Juridische entiteit voor een id (onbekend of niet ingesteld = DEFAULT_ENTITY)."""
+        employee = self._by_id.get(emp_id)
+        return (employee.get("entity") if employee else None) or DEFAULT_ENTITY
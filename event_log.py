@@ -0,0 +1,296 @@
+import io
+import json
+import sys
+from collections import namedtuple
+from datetime import date, datetime
+
+import numpy as np
+
+from config_snapshots import ConfigHistory, make_snapshot
+from ride_store import RideStore
+
+# =============================================================================
+# EVENT LOG (Append-only geschiedenis met snapshots en replay)
+# =============================================================================
+# Elke wijziging (rit ingediend, ritten geëxporteerd, herberekend of gearchiveerd,
+# config of master data bewaard, deadline uitzondering toegekend of opgeruimd) wordt als
+# event in de `events` tabel geschreven, in dezelfde transactie als de wijziging
+# zelf: de log kan nooit achterlopen op de tabellen (of omgekeerd), en een bulk
+# import schrijft al zijn events in één commit. Events worden nooit gewijzigd of
+# verwijderd.
+#
+# Een snapshot is de volledige toestand (ritten als gecomprimeerde NumPy kolommen
+# + JSON) op een event seq. restore() laadt de laatste snapshot en speelt enkel de
+# events daarna af; state_at() doet hetzelfde tot een tijdstip, zodat een audit
+# ("welke uitzonderingen liepen er op 3 maart?") de live tabellen niet raakt.
+
+EVENT_RIDE_SUBMITTED = "ride_submitted"
+EVENT_RIDES_EXPORTED = "rides_exported"
+EVENT_RIDES_RECALCULATED = "rides_recalculated"
+EVENT_RIDES_ARCHIVED = "rides_archived"  # enkel de opslagplaats wijzigt (zie ride_archive.py)
+EVENT_CONFIG_CHANGED = "config_changed"
+EVENT_EMPLOYEE_SAVED = "employee_saved"
+EVENT_EXCEPTION_GRANTED = "exception_granted"
+EVENT_EXCEPTION_REMOVED = "exception_removed"
+
+EVENT_KINDS = (
+    EVENT_RIDE_SUBMITTED,
+    EVENT_RIDES_EXPORTED,
+    EVENT_RIDES_RECALCULATED,
+    EVENT_RIDES_ARCHIVED,
+    EVENT_CONFIG_CHANGED,
+    EVENT_EMPLOYEE_SAVED,
+    EVENT_EXCEPTION_GRANTED,
+    EVENT_EXCEPTION_REMOVED,
+)
+
+# Nieuwe snapshot zodra er zoveel events na de laatste snapshot staan
+SNAPSHOT_INTERVAL = 50_000
+# Aantal recente snapshots dat bewaard blijft (plus de oudste; de events blijven altijd)
+SNAPSHOTS_KEPT = 3
+
+# Eén event uit de log; `ref` is de rit seq, batch id of config versie, `payload`
+# is al gedecodeerd (een rit-dict, export entry, ConfigSnapshot, ...)
+Event = namedtuple("Event", "seq recorded_at kind employee_id ref payload")
+
+
+class EventState:
+    """
+    Toestand opgebouwd uit de event log: de ritten (kolomgebaseerde RideStore, rij
+    = seq - 1), de config snapshots, master data, actieve deadline uitzonderingen
+    en de export geschiedenis, tot en met event `event_seq`.
+    """
+
+    def __init__(self):
+        self.event_seq = 0
+        self.rides = RideStore()
+        self.configs = {}  # versie -> ConfigSnapshot
+        self.employees = {}  # account_key -> employee
+        self.deadline_exceptions = {}  # employee_id -> vervaldatum
+        self.export_history = []
+
+    @property
+    def config_history(self):
+        return ConfigHistory(self.configs.values())
+
+    def apply(self, event):
+        """Past één event toe (in seq volgorde)."""
+        kind, payload = event.kind, event.payload
+        if kind == EVENT_RIDE_SUBMITTED:
+            if event.ref != len(self.rides) + 1:
+                raise RuntimeError(f"Event {event.seq}: rit seq {event.ref}, verwacht {len(self.rides) + 1}")
+            self.rides.append(payload)
+        elif kind == EVENT_RIDES_EXPORTED:
+            if payload["last_seq"] is not None:
+                self.rides.mark_processed(payload["batch_id"], payload["export_date"], upto=payload["last_seq"])
+            self.export_history.append(payload)
+        elif kind == EVENT_RIDES_RECALCULATED:
+            self.rides.apply_recalculation([(seq - 1, *update) for seq, *update in payload], {})
+        elif kind == EVENT_CONFIG_CHANGED:
+            self.configs[payload.version] = payload
+        elif kind == EVENT_EMPLOYEE_SAVED:
+            account_key, employee = payload
+            for key in [key for key, known in self.employees.items() if known["id"] == employee["id"]]:
+                del self.employees[key]  # de account key kan wijzigen
+            self.employees[account_key] = employee
+        elif kind == EVENT_EXCEPTION_GRANTED:
+            self.deadline_exceptions[event.employee_id] = payload
+        elif kind == EVENT_EXCEPTION_REMOVED:
+            self.deadline_exceptions.pop(event.employee_id, None)
+        self.event_seq = event.seq
+
+    @classmethod
+    def from_storage(cls, storage):
+        """Toestand van de live tabellen (basis-snapshot voor een database van vóór de event log)."""
+        state = cls()
+        state.event_seq = storage.last_event_seq()
+        state.rides = RideStore(storage.rides)
+        state.configs = {snapshot.version: snapshot for snapshot in storage.load_config_history()}
+        state.employees = storage.load_employees()
+        state.deadline_exceptions = storage.load_deadline_exceptions()
+        state.export_history = storage.load_export_history()
+        return state
+
+
+# =============================================================================
+# SNAPSHOTS (NumPy kolommen + JSON in één gecomprimeerde blob)
+# =============================================================================
+
+def _export_to_json(entry):
+    return dict(
+        entry,
+        export_date=entry["export_date"].isoformat(),
+        period_start=entry["period_start"].isoformat(),
+        period_end=entry["period_end"].isoformat(),
+    )
+
+
+def _export_from_json(entry):
+    return dict(
+        entry,
+        export_date=datetime.fromisoformat(entry["export_date"]),
+        period_start=date.fromisoformat(entry["period_start"]),
+        period_end=date.fromisoformat(entry["period_end"]),
+    )
+
+
+def master_to_json(configs, employees, deadline_exceptions, export_history):
+    """
+    Config snapshots (iterable), master data, uitzonderingen en export geschiedenis
+    als JSON-compatibele dict (ook gebruikt voor de startup snapshot, zie shared_state.py).
+    """
+    return {
+        "configs": [
+            [snapshot.version, snapshot.effective_from.isoformat(), dict(snapshot.values)]
+            for snapshot in configs
+        ],
+        "employees": employees,
+        "deadline_exceptions": [[emp_id, expires.isoformat()] for emp_id, expires in deadline_exceptions.items()],
+        "export_history": [_export_to_json(entry) for entry in export_history],
+    }
+
+
+def master_from_json(meta):
+    """(configs {versie: ConfigSnapshot}, employees, deadline_exceptions, export_history) uit master_to_json."""
+    configs = {
+        version: make_snapshot(version, date.fromisoformat(effective_from), values)
+        for version, effective_from, values in meta["configs"]
+    }
+    deadline_exceptions = {emp_id: date.fromisoformat(expires) for emp_id, expires in meta["deadline_exceptions"]}
+    export_history = [_export_from_json(entry) for entry in meta["export_history"]]
+    return configs, meta["employees"], deadline_exceptions, export_history
+
+
+def encode_snapshot(state):
+    """Snapshot van een EventState als bytes (npz: ritkolommen + JSON metadata)."""
+    arrays, ride_meta = state.rides.snapshot()
+    meta = {
+        "event_seq": state.event_seq,
+        "rides": ride_meta,
+        **master_to_json(state.configs.values(), state.employees, state.deadline_exceptions, state.export_history),
+    }
+    buffer = io.BytesIO()
+    np.savez_compressed(
+        buffer, meta=np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8), **arrays
+    )
+    return buffer.getvalue()
+
+
+def decode_snapshot(blob):
+    """EventState uit een snapshot van encode_snapshot."""
+    with np.load(io.BytesIO(blob)) as archive:
+        meta = json.loads(archive["meta"].tobytes().decode("utf-8"))
+        arrays = {name: archive[name] for name in archive.files if name != "meta"}
+    state = EventState()
+    state.event_seq = meta["event_seq"]
+    state.rides = RideStore.from_snapshot(arrays, meta["rides"])
+    state.configs, state.employees, state.deadline_exceptions, state.export_history = master_from_json(meta)
+    return state
+
+
+# =============================================================================
+# RESTORE, REPLAY EN AUDIT
+# =============================================================================
+
+def restore(storage, upto=None):
+    """
+    Toestand tot en met event `upto` (standaard de volledige log): de laatste
+    snapshot op of vóór `upto`, aangevuld met de events erna.
+    """
+    found = storage.latest_snapshot(upto)
+    state = decode_snapshot(found[1]) if found is not None else EventState()
+    for events in storage.iter_events(state.event_seq, upto):
+        for event in events:
+            state.apply(event)
+    return state
+
+
+def state_at(storage, moment):
+    """Toestand zoals ze was op `moment` (datetime): replay tot het laatste event ervoor."""
+    return restore(storage, storage.event_seq_at(moment))
+
+
+def take_snapshot(storage, state=None):
+    """Bewaart een snapshot van de (herstelde) toestand; geeft de event seq terug."""
+    state = state if state is not None else restore(storage)
+    storage.save_snapshot(state.event_seq, encode_snapshot(state), keep=SNAPSHOTS_KEPT)
+    return state.event_seq
+
+
+def maybe_snapshot(storage, interval=SNAPSHOT_INTERVAL):
+    """
+    Neemt een snapshot als er minstens `interval` events na de laatste staan (bij
+    de start van de app). Geeft de event seq van de nieuwe snapshot terug, of None.
+    """
+    found = storage.latest_snapshot()
+    if storage.last_event_seq() - (found[0] if found is not None else 0) < interval:
+        return None
+    return take_snapshot(storage)
+
+
+def describe(event):
+    """Korte omschrijving van een event voor de audit weergave."""
+    kind, payload = event.kind, event.payload
+    if kind == EVENT_RIDE_SUBMITTED:
+        return f"Rit #{event.ref} op {payload['date']}: {payload['trajectory']} ({payload['ride_type']}), €{payload['amount']:.2f}"
+    if kind == EVENT_RIDES_EXPORTED:
+        return (
+            f"Batch {payload['batch_id']}: {payload['ride_count']} ritten, €{payload['total_amount']:.2f} "
+            f"({payload['period_start']} - {payload['period_end']})"
+        )
+    if kind == EVENT_RIDES_RECALCULATED:
+        return f"{len(payload)} ritten herberekend (Δ €{sum(update[4] - update[3] for update in payload):+.2f})"
+    if kind == EVENT_RIDES_ARCHIVED:
+        return f"{payload['ride_count']} ritten (seq {payload['after_seq'] + 1}-{event.ref}) gearchiveerd in {len(payload['segments'])} segment(en)"
+    if kind == EVENT_CONFIG_CHANGED:
+        return f"Config versie {payload.version}, geldig vanaf {payload.effective_from}"
+    if kind == EVENT_EMPLOYEE_SAVED:
+        return f"Medewerker {payload[0]} bewaard"
+    if kind == EVENT_EXCEPTION_GRANTED:
+        return f"Uitzondering tot {payload}"
+    if kind == EVENT_EXCEPTION_REMOVED:
+        return f"Uitzondering (tot {payload}) verwijderd" if payload else "Uitzondering verwijderd"
+    return kind
+
+
+def verify(storage):
+    """
+    Vergelijkt de herstelde toestand met de live tabellen. Geeft een lijst van
+    verschillen (omschrijvingen) terug; leeg als log en tabellen overeenkomen.
+    """
+    state = restore(storage)
+    differences = []
+    rides, live = state.rides, storage.rides
+    if len(rides) != len(live):
+        differences.append(f"ritten: {len(rides)} in de log, {len(live)} in de tabel")
+    if rides.pending_summary()[0] != live.pending_summary()[0]:
+        differences.append(f"onverwerkte ritten: {rides.pending_summary()[0]} in de log, {live.pending_summary()[0]} in de tabel")
+    if sorted(state.configs) != [snapshot.version for snapshot in storage.load_config_history()]:
+        differences.append("config versies verschillen")
+    if state.employees != storage.load_employees():
+        differences.append("master data verschilt")
+    if state.deadline_exceptions != storage.load_deadline_exceptions():
+        differences.append("deadline uitzonderingen verschillen")
+    if [entry["batch_id"] for entry in state.export_history] != [entry["batch_id"] for entry in storage.load_export_history()]:
+        differences.append("export geschiedenis verschilt")
+    return differences
+
+
+if __name__ == "__main__":
+    from storage import DB_PATH, SqliteStorage
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ("snapshot", "verify", "audit"):
+        print("Gebruik: python event_log.py snapshot | verify | audit <employee_id> [aantal]")
+        sys.exit(2)
+    storage = SqliteStorage(DB_PATH)
+    if sys.argv[1] == "snapshot":
+        print(f"Snapshot op event {take_snapshot(storage)}")
+    elif sys.argv[1] == "verify":
+        problems = verify(storage)
+        print("\n".join(problems) if problems else "Event log en tabellen komen overeen")
+        sys.exit(1 if problems else 0)
+    else:
+        limit = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+        for event in storage.load_events(employee_id=int(sys.argv[2]), limit=limit):
+            print(f"{event.seq:>8}  {event.recorded_at:%Y-%m-%d %H:%M:%S}  {event.kind:<20} {describe(event)}")
+    storage.close()
@@ -0,0 +1,56 @@
+from bisect import bisect_right
+
+# =============================================================================
+# EXPORT LOCKS (Vergrendelde periodes na export)
+# =============================================================================
+# Elke export vergrendelt de periode [period_start, period_end] (min/max datum
+# van de geëxporteerde ritten). Die periodes kunnen willekeurig overlappen; hier
+# worden ze samengevoegd tot gesorteerde, disjuncte intervallen zodat een lookup
+# een bisect is in plaats van een scan over de volledige export geschiedenis.
+
+
+class ExportLocks:
+    """
+    Gesorteerde, samengevoegde intervallen van geëxporteerde periodes.
+    `starts` en `ends` zijn parallelle lijsten van datums (inclusief), gesorteerd
+    en niet overlappend; ze kunnen ook rechtstreeks gebruikt worden voor een
+    gevectoriseerde lookup (np.searchsorted) bij batch validatie.
+    """
+
+    def __init__(self, export_history=None):
+        self.starts = []
+        self.ends = []
+        for export in export_history or []:
+            self.add(export["period_start"], export["period_end"])
+
+    def add(self, start, end):
+        """Vergrendelt [start, end] en voegt overlappende of aansluitende intervallen samen."""
+        if start is None or end is None:
+            return
+        pos = bisect_right(self.starts, start)
+        # Begin bij het vorige interval als dat overlapt met (of aansluit op) het nieuwe
+        if pos > 0 and self.ends[pos - 1].toordinal() + 1 >= start.toordinal():
+            pos -= 1
+            start = min(start, self.starts[pos])
+        last = pos
+        while last < len(self.starts) and self.starts[last].toordinal() <= end.toordinal() + 1:
+            end = max(end, self.ends[last])
+            last += 1
+        del self.starts[pos:last]
+        del self.ends[pos:last]
+        self.starts.insert(pos, start)
+        self.ends.insert(pos, end)
+
+    def is_locked(self, day):
+        """True als de datum in een geëxporteerde periode valt (O(log n))."""
+        pos = bisect_right(self.starts, day) - 1
+        return pos >= 0 and day <= self.ends[pos]
+
+    __contains__ = is_locked
+
+    def __len__(self):
+        return len(self.starts)
+
+    def intervals(self):
+        """Lijst van (start, end) tuples, gesorteerd."""
+        return list(zip(self.starts, self.ends))
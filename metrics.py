@@ -0,0 +1,247 @@
+import cProfile
+import functools
+import itertools
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+# =============================================================================
+# METRICS (Instrumentatie van de hot paths, Prometheus tekstformaat)
+# =============================================================================
+# Timing spans (histogrammen per span naam) en tellers (bv. gevalideerde ritten
+# per uitkomst en reden), gedeeld door alle threads/sessies van het proces.
+# Uitgeschakeld (standaard) kost een span of @timed functie één globale check;
+# aanzetten met FIETSVERGOEDING_METRICS=1 of enable().
+#
+# Optioneel wordt elke request (Streamlit run of API request) met cProfile
+# geprofileerd: FIETSVERGOEDING_PROFILE_DIR=<map> of enable_profiling(<map>)
+# schrijft per request een .prof bestand (te bekijken met pstats/snakeviz).
+
+# Histogram grenzen in seconden (zelfde reeks als de Prometheus client defaults + sub-ms)
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_PREFIX = "fietsvergoeding"
+
+_enabled = os.environ.get("FIETSVERGOEDING_METRICS", "0") not in ("", "0", "false")
+_profile_dir = os.environ.get("FIETSVERGOEDING_PROFILE_DIR") or None
+_profile_seq = itertools.count(1)
+_NOOP = nullcontext()
+
+
+class Registry:
+    """Thread-safe verzameling van span histogrammen en tellers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = {}  # naam -> [bucket tellingen..., count, sum]
+        self._counters = {}  # (naam, labels) -> waarde
+
+    def observe(self, name, seconds):
+        slot = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            series = self._spans.get(name)
+            if series is None:
+                series = self._spans[name] = [0] * (len(BUCKETS) + 2) + [0.0]
+            series[slot] += 1  # slot len(BUCKETS) = +Inf
+            series[-2] += 1
+            series[-1] += seconds
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        """(spans, counters) kopie: {naam: (buckets, count, sum)}, {(naam, labels): waarde}."""
+        with self._lock:
+            spans = {name: (series[:len(BUCKETS) + 1], series[-2], series[-1]) for name, series in self._spans.items()}
+            return spans, dict(self._counters)
+
+
+REGISTRY = Registry()
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+# =============================================================================
+# SPANS EN TELLERS
+# =============================================================================
+
+class _Span:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        REGISTRY.observe(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def span(name):
+    """Context manager die de duur van het blok registreert onder `name`."""
+    if not _enabled:
+        return _NOOP
+    return _Span(name)
+
+
+def timed(name=None):
+    """Decorator: elke aanroep is een span (standaard de functienaam)."""
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                REGISTRY.observe(span_name, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+def count(name, value=1, **labels):
+    """Verhoogt een teller (met labels) als metrics aan staan."""
+    if _enabled:
+        REGISTRY.inc(name, value, **labels)
+
+
+# =============================================================================
+# STARTUP (Koude start, één meting per fase per proces)
+# =============================================================================
+# De fases van de eerste run (imports, storage, gedeelde state, eerste render)
+# worden altijd bijgehouden, ook als metrics uit staan: het kost één dict lookup
+# per run. Met metrics aan komen ze ook als span `startup_<fase>` in de export.
+
+_startup_phases = {}  # fase -> seconden
+
+
+@contextmanager
+def startup_phase(name):
+    """Meet het blok als fase `name` van de koude start; latere runs van hetzelfde blok tellen niet."""
+    if name in _startup_phases:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        if name not in _startup_phases:
+            _startup_phases[name] = seconds
+            if _enabled:
+                REGISTRY.observe(f"startup_{name}", seconds)
+
+
+def startup_report():
+    """{fase: seconden} van de koude start van dit proces, in volgorde van meting."""
+    return dict(_startup_phases)
+
+
+# =============================================================================
+# PROFILING (cProfile per request)
+# =============================================================================
+
+def profiling_enabled():
+    return _profile_dir is not None
+
+
+def enable_profiling(directory):
+    """Schrijft vanaf nu per request een cProfile dump naar `directory` (None = uit)."""
+    global _profile_dir
+    _profile_dir = directory
+
+
+def _dump_path(name):
+    os.makedirs(_profile_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    return os.path.join(_profile_dir, f"{name}_{stamp}_{os.getpid()}_{next(_profile_seq)}.prof")
+
+
+@contextmanager
+def _profiled(name):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(_dump_path(name))
+
+
+def profiled(name):
+    """Context manager: profileert het blok met cProfile als profiling aan staat."""
+    if _profile_dir is None:
+        return _NOOP
+    return _profiled(name)
+
+
+def profile_call(name, func, *args):
+    """Roept func(*args) aan, geprofileerd als profiling aan staat (bv. in een worker thread)."""
+    with profiled(name):
+        return func(*args)
+
+
+# =============================================================================
+# PROMETHEUS TEKST EXPOSITIE
+# =============================================================================
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def exposition(registry=REGISTRY):
+    """Alle metrics in het Prometheus text exposition formaat (version 0.0.4)."""
+    spans, counters = registry.snapshot()
+    lines = []
+    if spans:
+        metric = f"{METRIC_PREFIX}_span_seconds"
+        lines.append(f"# HELP {metric} Duur van geïnstrumenteerde code paden.")
+        lines.append(f"# TYPE {metric} histogram")
+        for name in sorted(spans):
+            buckets, total, seconds = spans[name]
+            cumulative = 0
+            for bound, observed in zip(BUCKETS + (float("inf"),), buckets):
+                cumulative += observed
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{metric}_bucket{_labels([('span', name), ('le', le)])} {cumulative}")
+            lines.append(f"{metric}_sum{_labels([('span', name)])} {seconds!r}")
+            lines.append(f"{metric}_count{_labels([('span', name)])} {total}")
+    for name in sorted({key[0] for key in counters}):
+        metric = f"{METRIC_PREFIX}_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for (counter, labels), value in sorted(counters.items()):
+            if counter == name:
+                lines.append(f"{metric}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
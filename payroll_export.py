@@ -0,0 +1,585 @@
+import calendar
+import csv
+import gzip
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import metrics
+from employees import DEFAULT_FISCAL_STATUS, EmployeeIndex
+from ride_store import CHUNK_SIZE, RideStore
+from storage import iter_shard_rides
+
+# =============================================================================
+# PAYROLL EXPORT (Streaming CSV)
+# =============================================================================
+# De export leest de onverwerkte ritten in chunks uit de ride store en schrijft
+# ze meteen als ;-gescheiden CSV weg. Er wordt nooit een DataFrame van alle
+# ritten opgebouwd: het geheugengebruik is begrensd door de chunk grootte.
+
+# Zelfde kolommen (en volgorde) als de vroegere df.to_csv() van de ritten + fiscal_status
+EXPORT_COLUMNS = [
+    "date",
+    "employee_id",
+    "employee_name",
+    "trajectory",
+    "ride_type",
+    "distance",
+    "amount",
+    "rate_applied",
+    "processed",
+    "fiscal_status",
+]
+
+# Maandsamenvatting: één rij per medewerker per maand (zie write_summary_csv)
+SUMMARY_COLUMNS = [
+    "month",
+    "employee_id",
+    "employee_name",
+    "fiscal_status",
+    "ride_count",
+    "distance",
+    "amount_belast",
+    "amount_onbelast",
+    "amount",
+]
+
+EXPORT_DIR = os.environ.get("FIETSVERGOEDING_EXPORT_DIR", "exports")
+
+# Partities voor een gesplitste export (één bestand per combinatie van waarden)
+PARTITION_KEYS = ("country", "fiscal_status", "entity", "month")
+MANIFEST_NAME = "manifest.json"
+UNKNOWN_PARTITION = "ONBEKEND"
+
+# Een batch wordt eerst als <bestand>.part geschreven en pas na de commit van
+# markering + geschiedenis hernoemd (zie run_export en recover_exports)
+PARTIAL_SUFFIX = ".part"
+_BATCH_ID_PATTERN = re.compile(r"^payroll_(?:batch|summary)_(\d+)_")
+
+# Pogingen van run_export als een andere export of een herberekening de ritten
+# tijdens het streamen wijzigde
+MAX_EXPORT_ATTEMPTS = 3
+
+
+def export_filename(batch_id, export_timestamp, compress=False):
+    """Bestandsnaam van een payroll batch, met timestamp (en .gz bij compressie)."""
+    name = f"payroll_batch_{batch_id}_{export_timestamp.strftime('%Y%m%d_%H%M%S')}.csv"
+    return name + ".gz" if compress else name
+
+
+@contextmanager
+def _csv_writer(fileobj, columns, compress=False):
+    """;-gescheiden CSV writer met header `columns` op het binaire `fileobj` (optioneel gzip)."""
+    raw = gzip.GzipFile(fileobj=fileobj, mode="wb") if compress else fileobj
+    text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    writer = csv.writer(text, delimiter=";", lineterminator="\n")
+    writer.writerow(columns)
+    yield writer
+    text.flush()
+    text.detach()
+    if compress:
+        raw.close()  # schrijft de gzip trailer, sluit fileobj niet
+
+
+def _new_summary():
+    """Lege samenvatting van een batch (zie write_payroll_csv)."""
+    return {
+        "ride_count": 0, "total_amount": 0.0, "totals_by_fiscal_status": {}, "period_start": None, "period_end": None,
+    }
+
+
+def _add_to_summary(summary, ride_count, total_amount, status_amounts, period_start, period_end):
+    """Telt ritten, bedrag, (statuut, bedrag) paren en hun periode op bij `summary`."""
+    summary["ride_count"] += ride_count
+    summary["total_amount"] += total_amount
+    by_status = summary["totals_by_fiscal_status"]
+    for status, amount in status_amounts:
+        by_status[status] = by_status.get(status, 0.0) + amount
+    if summary["period_start"] is None or period_start < summary["period_start"]:
+        summary["period_start"] = period_start
+    if summary["period_end"] is None or period_end > summary["period_end"]:
+        summary["period_end"] = period_end
+
+
+def write_payroll_csv(chunks, employee_index, fileobj, compress=False):
+    """
+    Schrijft de ritten uit `chunks` (iterable van lijsten rit-dicts) als payroll CSV
+    naar het binaire `fileobj`. Het fiscaal statuut komt uit `status_by_id` van de
+    EmployeeIndex (hash join op employee_id). Geeft een samenvatting terug met
+    ride_count, total_amount, totals_by_fiscal_status, period_start en period_end
+    (None als er geen ritten waren).
+    """
+    status_by_id = employee_index.status_by_id
+    summary = _new_summary()
+    with _csv_writer(fileobj, EXPORT_COLUMNS, compress) as writer:
+        for chunk in chunks:
+            statuses = [status_by_id.get(ride["employee_id"], DEFAULT_FISCAL_STATUS) for ride in chunk]
+            writer.writerows(
+                (
+                    ride["date"],
+                    ride["employee_id"],
+                    ride["employee_name"],
+                    ride["trajectory"],
+                    ride.get("ride_type"),
+                    ride["distance"],
+                    ride["amount"],
+                    ride["rate_applied"],
+                    ride.get("processed", False),
+                    status,
+                )
+                for ride, status in zip(chunk, statuses)
+            )
+            _add_to_summary(
+                summary,
+                len(chunk),
+                sum(ride["amount"] for ride in chunk),
+                zip(statuses, (ride["amount"] for ride in chunk)),
+                min(ride["date"] for ride in chunk),
+                max(ride["date"] for ride in chunk),
+            )
+    return summary
+
+
+def summary_filename(batch_id, export_timestamp, compress=False):
+    """Bestandsnaam van een payroll batch als maandsamenvatting."""
+    name = f"payroll_summary_{batch_id}_{export_timestamp.strftime('%Y%m%d_%H%M%S')}.csv"
+    return name + ".gz" if compress else name
+
+
+def write_summary_csv(groups, employee_index, fileobj, compress=False):
+    """
+    Schrijft de maandtotalen `groups` (zie pending_groups van de ride store) als
+    payroll samenvatting naar het binaire `fileobj`: per medewerker per maand het
+    aantal ritten, de kilometers en het bedrag, opgesplitst in BELAST/ONBELAST.
+    Geeft dezelfde samenvatting terug als write_payroll_csv.
+    """
+    summary = _new_summary()
+    with _csv_writer(fileobj, SUMMARY_COLUMNS, compress) as writer:
+        for emp_id, year, month, count, distance, amount, first_day, last_day in groups:
+            employee = employee_index.get(emp_id)
+            status = employee_index.fiscal_status(emp_id)
+            rounded = round(amount, 2)
+            writer.writerow((
+                f"{year:04d}-{month:02d}",
+                emp_id,
+                employee["name"] if employee else employee_index.key(emp_id),
+                status,
+                count,
+                round(distance, 2),
+                rounded if status == "BELAST" else 0.0,
+                rounded if status != "BELAST" else 0.0,
+                rounded,
+            ))
+            _add_to_summary(summary, count, amount, ((status, amount),), first_day, last_day)
+    return summary
+
+
+def export_dirname(batch_id, export_timestamp):
+    """Mapnaam van een gepartitioneerde payroll batch (shards + manifest)."""
+    return f"payroll_batch_{batch_id}_{export_timestamp.strftime('%Y%m%d_%H%M%S')}"
+
+
+def export_unprocessed(rides, employee_index, path, compress=False, chunk_size=CHUNK_SIZE, upto=None):
+    """
+    Streamt de onverwerkte ritten van de store (na de export watermark, tot en met
+    seq `upto`) naar het bestand `path`, en forceert het bestand naar schijf.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as fileobj:
+        summary = write_payroll_csv(
+            rides.iter_unprocessed(chunk_size, upto=upto), employee_index, fileobj, compress=compress
+        )
+        fileobj.flush()
+        os.fsync(fileobj.fileno())
+    return summary
+
+
+def export_summary(rides, employee_index, path, compress=False, upto=None):
+    """
+    Schrijft de maandsamenvatting van de onverwerkte ritten van de store (na de
+    export watermark, tot en met seq `upto`) naar `path`. De totalen komen uit één
+    gegroepeerde aggregatie in de store; er wordt geen rit-dict opgebouwd.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as fileobj:
+        summary = write_summary_csv(rides.pending_groups(upto), employee_index, fileobj, compress=compress)
+        fileobj.flush()
+        os.fsync(fileobj.fileno())
+    return summary
+
+
+def _discard(path):
+    """Verwijdert een (half) geschreven batch: een bestand of een map met shards."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _publish(partial_path, export_path):
+    """Hernoemt een volledig geschreven batch atomair naar zijn definitieve naam."""
+    os.replace(partial_path, export_path)
+    if hasattr(os, "O_DIRECTORY"):  # de hernoeming zelf duurzaam maken (POSIX)
+        fd = os.open(os.path.dirname(export_path) or ".", os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def recover_exports(storage, export_dir=None):
+    """
+    Herstelt na een crash tijdens een export: een .part bestand waarvan de batch in
+    de export geschiedenis staat (commit gelukt) wordt alsnog gepubliceerd, een
+    .part bestand zonder batch wordt verwijderd zodra zijn batch id niet meer
+    gecommit kan worden (lager dan het volgende batch id). Een .part van het
+    volgende batch id kan van een export zijn die nog aan het streamen is en
+    blijft staan tot een batch gecommit wordt.
+    Geeft (gepubliceerd, verwijderd) terug als lijsten bestandsnamen.
+    """
+    export_dir = export_dir or EXPORT_DIR
+    if not os.path.isdir(export_dir):
+        return [], []
+    committed = {entry["file_name"] for entry in storage.load_export_history() if entry["file_name"]}
+    next_batch_id = storage.next_export_batch_id()
+    published, removed = [], []
+    for name in sorted(os.listdir(export_dir)):
+        if not name.endswith(PARTIAL_SUFFIX):
+            continue
+        final_name = name[:-len(PARTIAL_SUFFIX)]
+        match = _BATCH_ID_PATTERN.match(name)
+        try:
+            if final_name in committed:
+                _publish(os.path.join(export_dir, name), os.path.join(export_dir, final_name))
+                published.append(final_name)
+            elif match is None or int(match.group(1)) < next_batch_id:
+                _discard(os.path.join(export_dir, name))
+                removed.append(name)
+        except FileNotFoundError:
+            pass  # intussen door een ander proces afgehandeld
+    return published, removed
+
+
+# =============================================================================
+# GEPARTITIONEERDE EXPORT (shards per land / fiscaal statuut / entiteit / maand)
+# =============================================================================
+# BE en NL payroll (en elke juridische entiteit) krijgen hun eigen bestand. De
+# planning (welke medewerker-maanden in welke shard) komt uit één GROUP BY over
+# de ritten na de watermark; elke shard wordt daarna in een worker proces met
+# een eigen read-only connectie gelezen en gestreamd. Het manifest bevat per
+# shard het aantal rijen, de totalen per fiscaal statuut en een SHA-256.
+# Alle shards vormen samen één export batch (één transactie, één watermark).
+
+def _partition_label(value):
+    return re.sub(r"[^A-Za-z0-9._-]+", "-", str(value)).strip("-") or UNKNOWN_PARTITION
+
+
+def plan_shards(groups, employee_index, partition_by):
+    """
+    Verdeelt (employee_id, jaar, maand, aantal) groepen over shards. Geeft
+    {partitiewaarden: {"employee_ids": set, "month": (jaar, maand) of None, "rows": n}} terug.
+    """
+    unknown = [key for key in partition_by if key not in PARTITION_KEYS]
+    if unknown:
+        raise ValueError(f"Onbekende partitie: {', '.join(unknown)} (kies uit {', '.join(PARTITION_KEYS)})")
+    shards = {}
+    for emp_id, year, month, count, *_ in groups:
+        employee = employee_index.get(emp_id)
+        values = {
+            "country": employee["country"] if employee else UNKNOWN_PARTITION,
+            "fiscal_status": employee_index.fiscal_status(emp_id),
+            "entity": employee_index.entity(emp_id),
+            "month": f"{year:04d}-{month:02d}",
+        }
+        key = tuple(values[name] for name in partition_by)
+        shard = shards.setdefault(key, {
+            "employee_ids": set(), "month": (year, month) if "month" in partition_by else None, "rows": 0,
+        })
+        shard["employee_ids"].add(emp_id)
+        shard["rows"] += count
+    return shards
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fileobj:
+        for block in iter(lambda: fileobj.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_shard(db_path, watermark, upto, employee_ids, month, employees, path, compress):
+    """Worker: streamt één shard naar `path` en geeft de samenvatting + checksum terug."""
+    start_date = end_date = None
+    if month is not None:
+        start_date = date(month[0], month[1], 1)
+        end_date = date(month[0], month[1], calendar.monthrange(*month)[1])
+    chunks = iter_shard_rides(db_path, watermark, upto, employee_ids, start_date, end_date)
+    with open(path, "wb") as fileobj:
+        summary = write_payroll_csv(chunks, EmployeeIndex(employees), fileobj, compress=compress)
+        fileobj.flush()
+        os.fsync(fileobj.fileno())
+    summary["sha256"] = _file_sha256(path)
+    return summary
+
+
+def export_partitioned(storage, employee_index, path, partition_by, compress=False, upto=None, workers=None,
+                       batch_info=None):
+    """
+    Schrijft de onverwerkte ritten (na de watermark, tot en met seq `upto`) als één
+    shard per partitie naar de map `path`, parallel in een process pool, plus een
+    manifest. De workers lezen via hun eigen connectie; wijzigt een andere export of
+    een herberekening de ritten intussen, dan legt run_export de batch niet vast.
+    Geeft de samenvatting van de volledige batch terug, met de shards.
+    """
+    shards = plan_shards(storage.rides.pending_groups(upto), employee_index, partition_by)
+    summary = dict(_new_summary(), shards=[])
+    if not shards:
+        return summary
+    os.makedirs(path, exist_ok=True)
+    watermark = storage.rides.export_watermark()
+    upto = storage.rides.last_seq() if upto is None else upto
+    suffix = ".csv.gz" if compress else ".csv"
+    ordered = sorted(shards.items())
+    tasks = []
+    for key, shard in ordered:
+        file_name = "_".join(_partition_label(value) for value in key) + suffix
+        employees = {
+            employee_index.key(emp_id): employee_index.get(emp_id)
+            for emp_id in shard["employee_ids"] if emp_id in employee_index
+        }
+        tasks.append((
+            storage.path, watermark, upto, shard["employee_ids"], shard["month"], employees,
+            os.path.join(path, file_name), compress,
+        ))
+
+    workers = min(len(tasks), workers or os.cpu_count() or 1)
+    if workers <= 1:
+        results = [_write_shard(*task) for task in tasks]
+    else:
+        # spawn: de Streamlit/API processen hebben threads en open SQLite connecties
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            results = list(pool.map(_write_shard, *zip(*tasks)))
+
+    for (key, shard), task, result in zip(ordered, tasks, results):
+        if result["ride_count"] != shard["rows"]:
+            raise RuntimeError(f"Shard {os.path.basename(task[6])}: {result['ride_count']} ritten, {shard['rows']} verwacht")
+        _add_to_summary(
+            summary, result["ride_count"], result["total_amount"], result["totals_by_fiscal_status"].items(),
+            result["period_start"], result["period_end"],
+        )
+        summary["shards"].append({
+            "file": os.path.basename(task[6]),
+            "partition": dict(zip(partition_by, key)),
+            "rows": result["ride_count"],
+            "total_amount": round(result["total_amount"], 2),
+            "totals_by_fiscal_status": {status: round(amount, 2) for status, amount in sorted(result["totals_by_fiscal_status"].items())},
+            "period_start": result["period_start"].isoformat(),
+            "period_end": result["period_end"].isoformat(),
+            "sha256": result["sha256"],
+        })
+
+    manifest = dict(batch_info or {})
+    manifest.update({
+        "partition_by": list(partition_by),
+        "compressed": compress,
+        "ride_count": summary["ride_count"],
+        "total_amount": round(summary["total_amount"], 2),
+        "totals_by_fiscal_status": {status: round(amount, 2) for status, amount in sorted(summary["totals_by_fiscal_status"].items())},
+        "period_start": summary["period_start"].isoformat(),
+        "period_end": summary["period_end"].isoformat(),
+        "shards": summary["shards"],
+    })
+    with open(os.path.join(path, MANIFEST_NAME), "w", encoding="utf-8") as fileobj:
+        json.dump(manifest, fileobj, indent=2, ensure_ascii=False)
+        fileobj.flush()
+        os.fsync(fileobj.fileno())
+    return summary
+
+
+@metrics.timed("payroll_export")
+def run_export(storage, employee_index, compress=False, export_dir=None, export_timestamp=None,
+               partition_by=(), workers=None, aggregate=False, archive=True):
+    """
+    Volledige export batch: stream de onverwerkte ritten naar een bestand, markeer
+    ze als verwerkt en log de batch in de geschiedenis.
+    Enkel de ritten na de export watermark worden gelezen en gemarkeerd; de batch
+    loopt tot de hoogste seq bij de start (last_seq in de geschiedenis).
+    Het streamen gebeurt in een leessnapshot zonder schrijflock, zodat ritten en
+    API requests tijdens een grote export gewoon doorgaan. Markering en
+    geschiedenis volgen in een korte schrijftransactie die eerst controleert dat
+    de snapshot nog geldt (zelfde watermark, geen export of herberekening sinds);
+    anders wordt de batch opnieuw geschreven (hooguit MAX_EXPORT_ATTEMPTS keer).
+    Het bestand wordt als .part geschreven en pas na de commit hernoemd, zodat een
+    crash nooit een gepubliceerd bestand zonder batch (of omgekeerd) achterlaat.
+    Met `partition_by` (zie PARTITION_KEYS) is de batch een map met één shard per
+    partitie en een manifest (zie export_partitioned), in `workers` processen.
+    Met `aggregate` bevat het bestand één rij per medewerker per maand in plaats van
+    één rij per rit (zie write_summary_csv); de ritten van de batch zijn dezelfde.
+    Met `archive` verhuizen de geëxporteerde ritten na de publicatie naar het
+    archief (koude opslag, zie ride_archive.py).
+    Geeft (export_entry, pad) terug, of (None, None) als er niets te exporteren was.
+    """
+    if aggregate and partition_by:
+        raise ValueError("Een maandsamenvatting kan niet gepartitioneerd worden")
+    export_timestamp = export_timestamp or datetime.now()
+    export_dir = export_dir or EXPORT_DIR
+
+    # 0. Restanten van een onderbroken export
+    recover_exports(storage, export_dir)
+
+    for _ in range(MAX_EXPORT_ATTEMPTS):
+        partial_path = None
+        try:
+            with storage.snapshot():
+                # 1. Batch ID, watermark en bovengrens uit één snapshot
+                batch_id = storage.next_export_batch_id()
+                watermark = storage.rides.export_watermark()
+                last_seq = storage.rides.last_seq()
+                event_seq = storage.last_event_seq()
+                if partition_by:
+                    file_name = export_dirname(batch_id, export_timestamp)
+                elif aggregate:
+                    file_name = summary_filename(batch_id, export_timestamp, compress)
+                else:
+                    file_name = export_filename(batch_id, export_timestamp, compress)
+                export_path = os.path.join(export_dir, file_name)
+                partial_path = export_path + PARTIAL_SUFFIX
+                _discard(partial_path)  # restant van een vorige poging met dezelfde naam
+
+                # 2. Stream de export file(s) tot en met last_seq (zonder schrijflock)
+                if partition_by:
+                    summary = export_partitioned(
+                        storage, employee_index, partial_path, tuple(partition_by), compress=compress, upto=last_seq,
+                        workers=workers,
+                        batch_info={"batch_id": batch_id, "export_date": export_timestamp.isoformat(), "last_seq": last_seq},
+                    )
+                elif aggregate:
+                    summary = export_summary(
+                        storage.rides, employee_index, partial_path, compress=compress, upto=last_seq
+                    )
+                else:
+                    summary = export_unprocessed(
+                        storage.rides, employee_index, partial_path, compress=compress, upto=last_seq
+                    )
+            if not summary["ride_count"]:
+                _discard(partial_path)
+                return None, None
+
+            # 3. Export periode = min/max datum van de geëxporteerde ritten
+            export_entry = {
+                "batch_id": batch_id,
+                "export_date": export_timestamp,
+                "period_start": summary["period_start"],
+                "period_end": summary["period_end"],
+                "ride_count": summary["ride_count"],
+                "total_amount": summary["total_amount"],
+                "last_seq": last_seq,
+                "file_name": file_name,
+            }
+
+            with storage.transaction():
+                # 4. Geldt de snapshot nog? Nieuwe ritten (seq > last_seq) horen niet bij de batch
+                committed = (
+                    storage.rides.export_watermark() == watermark
+                    and storage.next_export_batch_id() == batch_id
+                    and not storage.pending_rides_changed(event_seq)
+                )
+                if committed:
+                    # 5. Markeer de ritten van de batch als verwerkt (werkt ook de lopende totalen bij)
+                    storage.rides.mark_processed(batch_id, export_timestamp, upto=last_seq)
+
+                    # 6. Log export in geschiedenis (schuift de watermark op)
+                    storage.append_export(export_entry)
+        except BaseException:
+            # Transactie teruggedraaid: het halve bestand hoort bij geen enkele batch
+            if partial_path is not None:
+                _discard(partial_path)
+            raise
+        if committed:
+            break
+        _discard(partial_path)
+        metrics.count("export_conflicts")
+    else:
+        raise RuntimeError(
+            f"Export na {MAX_EXPORT_ATTEMPTS} pogingen niet vastgelegd: de ritten wijzigden telkens tijdens het schrijven."
+        )
+
+    # 7. Publiceer het bestand; een crash hiervoor wordt door recover_exports hersteld
+    _publish(partial_path, export_path)
+    recover_exports(storage, export_dir)  # .part bestanden van deze batch id kunnen nu weg
+
+    # 8. Archiveer de verwerkte ritten; mislukt dat, dan blijven ze in de tabel tot de volgende export
+    if archive:
+        try:
+            storage.rides.archive_exported()
+        except Exception:
+            metrics.count("archive_errors")
+            traceback.print_exc()
+    return export_entry, export_path
+
+
+# =============================================================================
+# BENCHMARK (python payroll_export.py [aantal_ritten] [--gzip])
+# =============================================================================
+
+def benchmark_export(n_rides=200_000, compress=False, chunk_size=CHUNK_SIZE, seed=42):
+    """
+    Meet de export doorvoer (rijen/sec) op een synthetische in-memory ride store.
+    De output gaat naar os.devnull zodat enkel de export zelf gemeten wordt.
+    """
+    rng = random.Random(seed)
+    employees = {
+        f"emp-{i}": {
+            "id": 1000 + i,
+            "name": f"Medewerker {i}",
+            "country": "BE" if i % 2 else "NL",
+            "bike_type": "company" if i % 3 == 0 else "own",
+            "trajectories": {"Thuis-Werk": 5 + i % 20},
+        }
+        for i in range(4000)
+    }
+    store = RideStore()
+    start_day = date(2026, 1, 1)
+    for n in range(n_rides):
+        emp = employees[f"emp-{rng.randrange(4000)}"]
+        distance = emp["trajectories"]["Thuis-Werk"] * 2
+        store.append({
+            "date": start_day + timedelta(days=n % 365),
+            "employee_id": emp["id"],
+            "employee_name": emp["name"],
+            "trajectory": "Thuis-Werk",
+            "ride_type": "Heen-en-Terug",
+            "distance": distance,
+            "amount": distance * 0.27,
+            "rate_applied": 0.27,
+            "processed": False,
+        })
+
+    with open(os.devnull, "wb") as sink:
+        started = time.perf_counter()
+        summary = write_payroll_csv(store.iter_unprocessed(chunk_size), EmployeeIndex(employees), sink, compress=compress)
+        elapsed = time.perf_counter() - started
+    return {
+        "rows": summary["ride_count"],
+        "seconds": elapsed,
+        "rows_per_sec": summary["ride_count"] / elapsed if elapsed > 0 else float("inf"),
+    }
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 200_000
+    result = benchmark_export(n, compress="--gzip" in sys.argv)
+    print(f"{result['rows']} rijen in {result['seconds']:.2f}s = {result['rows_per_sec']:,.0f} rijen/sec")
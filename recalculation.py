@@ -0,0 +1,277 @@
+import argparse
+import csv
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from employees import EmployeeIndex
+from ride_store import DRIFT_TOLERANCE
+from storage import DB_PATH, POOL_SIZE, SqliteStorage
+
+# =============================================================================
+# HERBEREKENING (Retroactieve toepassing van config wijzigingen)
+# =============================================================================
+# Na een nieuwe config snapshot kunnen nog niet geëxporteerde ritten een bedrag
+# hebben dat met een oudere regel berekend werd. De herberekening gebeurt in
+# twee stappen:
+#   1. plan_recalculation(): bepaalt welke medewerkers en maanden geraakt zijn
+#      (onverwerkte ritten waarvan de geldende regel verschilt van de regel van
+#      hun bewaarde config versie) en speelt per medewerker de onverwerkte
+#      ritten vanaf de eerste geraakte maand opnieuw af in datumvolgorde, door
+#      dezelfde CAP/BLOCK logica. Medewerkers zijn onafhankelijk en worden
+#      parallel afgespeeld. Er wordt niets gewijzigd; het plan is het diff rapport.
+#   2. apply_plan(): voert het plan door met optimistische versiecontrole per
+#      medewerker (zoals submit_ride). Kreeg een medewerker intussen een nieuwe
+#      rit of werd er geëxporteerd, dan wordt niets gewijzigd en moet opnieuw
+#      gepland worden.
+#
+# Geëxporteerde ritten worden nooit aangepast; hun bedragen tellen wel mee in
+# de limiet van de periode.
+
+STATUS_RECALCULATED = "herberekend"
+STATUS_CAPPED = "afgekapt"
+STATUS_BLOCKED = "geblokkeerd"
+
+REPORT_COLUMNS = [
+    "ride_id",
+    "employee_id",
+    "employee_name",
+    "date",
+    "trajectory",
+    "ride_type",
+    "distance",
+    "old_rate",
+    "new_rate",
+    "old_amount",
+    "new_amount",
+    "delta",
+    "old_version",
+    "new_version",
+    "status",
+]
+
+
+class RecalculationPlan:
+    """
+    Resultaat van plan_recalculation: de rijen van het diff rapport (ritten waarvan
+    bedrag of tarief wijzigt), de ritten die enkel een nieuwe config versie krijgen
+    en de versies per medewerker waarop het plan gebaseerd is.
+    """
+
+    def __init__(self, changes, retagged, versions):
+        self.changes = changes
+        self.retagged = retagged
+        self.versions = versions
+
+    def __len__(self):
+        return len(self.changes)
+
+    @property
+    def employees(self):
+        """Medewerkers met minstens één gewijzigd bedrag of tarief."""
+        return sorted({change["employee_id"] for change in self.changes})
+
+    @property
+    def months(self):
+        """Gesorteerde (jaar, maand) waarin een bedrag of tarief wijzigt."""
+        return sorted({(change["date"].year, change["date"].month) for change in self.changes})
+
+    @property
+    def delta(self):
+        """Totaal verschil in vergoeding (nieuw - oud) over alle wijzigingen."""
+        return sum(change["delta"] for change in self.changes)
+
+    def updates(self):
+        """Tuples voor apply_recalculation van de ride store (wijzigingen + nieuwe versies)."""
+        return [
+            (
+                change["ride_id"],
+                change["employee_id"],
+                change["date"],
+                change["old_amount"],
+                change["new_amount"],
+                change["new_rate"],
+                change["new_version"],
+            )
+            for change in self.changes + self.retagged
+        ]
+
+
+def _month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def affected_scope(rides, employee_index, configs, since=None):
+    """
+    {employee_id: eerste geraakte datum} voor de onverwerkte ritten (optioneel vanaf
+    `since`) waarvan de regel op de ritdatum financieel verschilt van de regel van
+    de bewaarde config versie. Ritten zonder (gekende) versie zijn altijd geraakt.
+    """
+    scope = {}
+    for chunk in rides.iter_unprocessed():
+        for ride in chunk:
+            ride_date = ride["date"]
+            if since is not None and ride_date < since:
+                continue
+            employee = employee_index.get(ride["employee_id"])
+            if employee is None:
+                continue
+            current = configs.resolve(employee["country"], employee["bike_type"], ride_date)
+            recorded = configs.resolve_version(employee["country"], employee["bike_type"], ride.get("config_version"))
+            # (rate, limit_type, limit, enforce_mode); rit-punten beïnvloeden geen bedrag
+            if recorded is None or current[1:5] != recorded[1:5] or abs(ride["rate_applied"] - current.rate) > 1e-9:
+                first = scope.get(ride["employee_id"])
+                if first is None or ride_date < first:
+                    scope[ride["employee_id"]] = ride_date
+    return scope
+
+
+def _replay_employee(rides, employee, configs, start):
+    """
+    Speelt de onverwerkte ritten van één medewerker vanaf de maand van `start`
+    opnieuw af. Geeft (versie, wijzigingen, enkel nieuwe versie) terug.
+    """
+    emp_id = employee["id"]
+    version = rides.version(emp_id)  # vóór het lezen van de ritten (zie apply_plan)
+    pending = rides.unprocessed_for_employee(emp_id, _month_start(start))
+
+    # Lopende totalen zonder de ritten die opnieuw afgespeeld worden
+    month_running = {}
+    year_running = {}
+    for _, ride in pending:
+        month_key = (ride["date"].year, ride["date"].month)
+        if month_key not in month_running:
+            month_running[month_key] = rides.month_total(emp_id, *month_key)
+        if month_key[0] not in year_running:
+            year_running[month_key[0]] = rides.year_total(emp_id, month_key[0])
+        month_running[month_key] -= ride["amount"]
+        year_running[month_key[0]] -= ride["amount"]
+
+    changes = []
+    retagged = []
+    for ride_id, ride in pending:
+        ride_date = ride["date"]
+        month_key = (ride_date.year, ride_date.month)
+        rule = configs.resolve(employee["country"], employee["bike_type"], ride_date)
+        amount = ride["distance"] * rule.rate
+        status = STATUS_RECALCULATED
+
+        if employee["country"] == "BE":
+            period_total = month_running[month_key] if rule.limit_type == "MONTHLY" else year_running[ride_date.year]
+            if period_total + amount > rule.limit:
+                allowed_amount = max(0, rule.limit - period_total) if rule.enforce_mode == "CAP" else 0.0
+                if allowed_amount > 0:
+                    amount, status = allowed_amount, STATUS_CAPPED
+                else:
+                    amount, status = 0.0, STATUS_BLOCKED
+
+        old_amount = ride["amount"]
+        rate_changed = abs(ride["rate_applied"] - rule.rate) > 1e-9
+        if abs(amount - old_amount) <= DRIFT_TOLERANCE:
+            amount = old_amount  # geen afrondingsruis wegschrijven
+        entry = {
+            "ride_id": ride_id,
+            "employee_id": emp_id,
+            "employee_name": ride["employee_name"],
+            "date": ride_date,
+            "trajectory": ride["trajectory"],
+            "ride_type": ride["ride_type"],
+            "distance": ride["distance"],
+            "old_rate": ride["rate_applied"],
+            "new_rate": rule.rate,
+            "old_amount": old_amount,
+            "new_amount": amount,
+            "delta": amount - old_amount,
+            "old_version": ride.get("config_version"),
+            "new_version": rule.version,
+            "status": status,
+        }
+        if amount != old_amount or rate_changed:
+            changes.append(entry)
+        elif entry["old_version"] != rule.version:
+            retagged.append(entry)
+        month_running[month_key] += amount
+        year_running[ride_date.year] += amount
+    return version, changes, retagged
+
+
+def plan_recalculation(rides, employee_index, configs, since=None, workers=POOL_SIZE):
+    """
+    Berekent (zonder te wijzigen) de nieuwe bedragen van alle geraakte onverwerkte
+    ritten met de config snapshots `configs`. Medewerkers worden parallel afgespeeld.
+    """
+    scope = affected_scope(rides, employee_index, configs, since)
+    jobs = [(employee_index.get(emp_id), start) for emp_id, start in sorted(scope.items())]
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="recalc") as pool:
+        results = list(pool.map(lambda job: _replay_employee(rides, job[0], configs, job[1]), jobs))
+
+    changes, retagged, versions = [], [], {}
+    for (employee, _), (version, employee_changes, employee_retagged) in zip(jobs, results):
+        versions[employee["id"]] = version
+        changes.extend(employee_changes)
+        retagged.extend(employee_retagged)
+    return RecalculationPlan(changes, retagged, versions)
+
+
+def apply_plan(rides, plan):
+    """
+    Voert een plan door. Geeft False terug (en wijzigt niets) als een betrokken
+    medewerker sinds de planning gewijzigd is.
+    """
+    if not plan.versions:
+        return True
+    return rides.apply_recalculation(plan.updates(), plan.versions)
+
+
+def write_report(plan, fileobj):
+    """Schrijft het diff rapport als ;-gescheiden CSV naar een tekst `fileobj`."""
+    writer = csv.writer(fileobj, delimiter=";", lineterminator="\n")
+    writer.writerow(REPORT_COLUMNS)
+    writer.writerows([change[col] for col in REPORT_COLUMNS] for change in plan.changes)
+
+
+# =============================================================================
+# CLI (python recalculation.py [--since YYYY-MM-DD] [--report diff.csv] [--apply])
+# =============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Herbereken onverwerkte ritten na een config wijziging.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database (standaard FIETSVERGOEDING_DB)")
+    parser.add_argument("--since", type=date.fromisoformat, help="Enkel ritten vanaf deze datum (YYYY-MM-DD)")
+    parser.add_argument("--report", help="Schrijf het diff rapport naar dit CSV bestand")
+    parser.add_argument("--apply", action="store_true", help="Voer de herberekening door (standaard enkel rapport)")
+    parser.add_argument("--workers", type=int, default=POOL_SIZE)
+    args = parser.parse_args(argv)
+
+    storage = SqliteStorage(args.db)
+    try:
+        configs = storage.load_config_history()
+        if not configs:
+            print("❌ Database bevat geen configuratie. Start eerst de applicatie.", file=sys.stderr)
+            return 1
+        started = time.perf_counter()
+        plan = plan_recalculation(
+            storage.rides, EmployeeIndex(storage.load_employees()), configs, since=args.since, workers=args.workers
+        )
+        elapsed = time.perf_counter() - started
+        print(
+            f"{len(plan)} ritten wijzigen (€{plan.delta:+.2f}) voor {len(plan.employees)} medewerker(s) "
+            f"in {len(plan.months)} maand(en); {len(plan.retagged)} enkel nieuwe versie ({elapsed:.2f}s)"
+        )
+        if args.report:
+            with open(args.report, "w", encoding="utf-8", newline="") as fileobj:
+                write_report(plan, fileobj)
+            print(f"Diff rapport: {args.report}")
+        if args.apply:
+            if not apply_plan(storage.rides, plan):
+                print("❌ Ritten gewijzigd tijdens de herberekening. Probeer opnieuw.", file=sys.stderr)
+                return 1
+            print("✅ Herberekening doorgevoerd")
+    finally:
+        storage.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
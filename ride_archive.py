@@ -0,0 +1,292 @@
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from ride_columns import COLUMNS, MISSING, RideColumns, day_number
+from ride_store import RIDE_TYPE_RETURN
+
+# =============================================================================
+# RIDE ARCHIVE (Koude opslag van geëxporteerde ritten, memory-mapped kolommen)
+# =============================================================================
+# Geëxporteerde ritten zijn read-only (is_month_exported), maar bleven met hun
+# indexen in de rides tabel staan. Na een export verhuizen ze naar het archief:
+# per archiveringsronde en per (jaar, maand) één onveranderlijk bestand
+# <archief>/<jaar>/<maand>/rides-<na>-<tot>.cols met de ritkolommen van
+# ride_columns (zelfde encoding als de in-memory RideStore) plus de seq:
+#
+#   magic (8 bytes) | lengte header (uint64) | JSON header | kolommen
+#
+# De header beschrijft de kolommen (dtype, offset), de dictionaries en de
+# statistieken (aantal, min/max van employee_id, dag en seq, totaal bedrag). Elke
+# kolom staat aaneengesloten op een 64-byte grens: een lezer mapt het bestand één
+# keer (np.memmap) en gebruikt de kolommen als views zonder kopie, zodat enkel de
+# pagina's die een query raakt van schijf komen.
+#
+# Predicate pushdown: de partities (jaar, maand) van een query komen uit het
+# register in SQLite (tabel ride_archive, zie storage.py), enkel die bestanden
+# worden geopend; binnen een bestand staan de ritten op (employee_id, seq), zodat
+# de ritten van één medewerker een binary search op de employee_id kolom zijn.
+#
+# Het register is de bron van waarheid: een bestand wordt eerst volledig
+# geschreven en pas geregistreerd in de transactie die de ritten uit de rides
+# tabel verwijdert. Een bestand zonder registratie (crash ertussen) wordt bij de
+# volgende ronde opgeruimd; een geregistreerd bestand wordt nooit gewijzigd.
+
+# Archiefmap; standaard naast de database (<database>-archive)
+ARCHIVE_DIR = os.environ.get("FIETSVERGOEDING_ARCHIVE_DIR")
+# Maximaal seq bereik per archiveringsronde (één transactie, begrensd geheugen)
+ARCHIVE_CHUNK = 100_000
+# Geopende (gemapte) segmenten per proces
+SEGMENT_CACHE = 256
+
+SEGMENT_MAGIC = b"FVRIDES1"
+SEGMENT_SUFFIX = ".cols"
+PARTIAL_SUFFIX = ".part"  # zoals payroll_export: pas na het volledig schrijven hernoemd
+ALIGNMENT = 64
+
+_DTYPES = dict(COLUMNS, seq=np.int64)
+
+
+def archive_dir_for(db_path):
+    """Archiefmap voor een database (FIETSVERGOEDING_ARCHIVE_DIR of <database>-archive)."""
+    return ARCHIVE_DIR or os.path.splitext(db_path)[0] + "-archive"
+
+
+def segment_name(year, month, after_seq, upto_seq):
+    """Pad (relatief t.o.v. de archiefmap) van de partitie (jaar, maand) van ronde (after_seq, upto_seq]."""
+    return f"{year:04d}/{month:02d}/rides-{after_seq}-{upto_seq}{SEGMENT_SUFFIX}"
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_segment(path, columns, seqs):
+    """
+    Schrijft de ritten van `columns` (RideColumns, gesorteerd op (employee_id, seq))
+    met hun `seqs` als segmentbestand: eerst als .part, fsync, dan hernoemd.
+    Geeft de header terug.
+    """
+    arrays, values = columns.snapshot()
+    arrays["seq"] = np.asarray(seqs, dtype=np.int64)
+    layout, offset = [], 0
+    for name, array in arrays.items():
+        layout.append([name, array.dtype.str, offset])
+        offset = _aligned(offset + array.nbytes)
+    employee_ids, days, amounts = arrays["employee_id"], arrays["day"], arrays["amount"]
+    header = {
+        "rows": len(seqs),
+        "columns": layout,
+        "dictionaries": values,
+        "sorted_by": ["employee_id", "seq"],
+        "stats": {
+            "employee_id": [int(employee_ids.min()), int(employee_ids.max())],
+            "day": [int(days.min()), int(days.max())],
+            "seq": [int(arrays["seq"].min()), int(arrays["seq"].max())],
+            "amount": float(amounts.sum()),
+        },
+    }
+    encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    start = _aligned(len(SEGMENT_MAGIC) + 8 + len(encoded))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = path + PARTIAL_SUFFIX
+    with open(partial_path, "wb") as fileobj:
+        fileobj.write(SEGMENT_MAGIC + len(encoded).to_bytes(8, "little") + encoded)
+        for (name, _, column_offset), array in zip(layout, arrays.values()):
+            fileobj.seek(start + column_offset)
+            fileobj.write(np.ascontiguousarray(array).tobytes())
+        fileobj.flush()
+        os.fsync(fileobj.fileno())
+    os.replace(partial_path, path)
+    return header
+
+
+class ArchiveSegment:
+    """
+    Eén memory-mapped segmentbestand. De kolommen zijn views op de mapping
+    (RideColumns.mapped), gesorteerd op (employee_id, seq); `seq` apart.
+    """
+
+    def __init__(self, path):
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(buffer[:len(SEGMENT_MAGIC)]) != SEGMENT_MAGIC:
+            raise ValueError(f"Geen archiefsegment: {path}")
+        header_start = len(SEGMENT_MAGIC) + 8
+        header_length = int.from_bytes(bytes(buffer[len(SEGMENT_MAGIC):header_start]), "little")
+        header = json.loads(bytes(buffer[header_start:header_start + header_length]).decode("utf-8"))
+        start = _aligned(header_start + header_length)
+        arrays = {}
+        for name, dtype, offset in header["columns"]:
+            dtype = np.dtype(dtype)
+            arrays[name] = buffer[start + offset:start + offset + header["rows"] * dtype.itemsize].view(dtype)
+        self.path = path
+        self.header = header
+        self.stats = header["stats"]
+        self.seq = arrays.pop("seq")
+        self.columns = RideColumns.mapped(arrays, header["dictionaries"])
+
+    def __len__(self):
+        return self.header["rows"]
+
+    def rows(self, employee_id=None, first_day=None, last_day=None):
+        """
+        Rijnummers die aan de predicaten voldoen: eerst de statistieken (hele bestand
+        overslaan), dan een binary search op employee_id, dan een filter op de dagkolom.
+        """
+        stats = self.stats
+        first = day_number(first_day) if first_day is not None else None
+        last = day_number(last_day) if last_day is not None else None
+        if (employee_id is not None and not stats["employee_id"][0] <= employee_id <= stats["employee_id"][1]) \
+                or (first is not None and stats["day"][1] < first) or (last is not None and stats["day"][0] > last):
+            return np.empty(0, dtype=np.int64)
+        if employee_id is None:
+            rows = np.arange(len(self), dtype=np.int64)
+        else:
+            low, high = np.searchsorted(self.columns.column("employee_id"), [employee_id, employee_id + 1])
+            rows = np.arange(low, high, dtype=np.int64)
+        if first is not None or last is not None:
+            days = self.columns.column("day")[rows]
+            keep = np.ones(len(rows), dtype=bool)
+            if first is not None:
+                keep &= days >= first
+            if last is not None:
+                keep &= days <= last
+            rows = rows[keep]
+        return rows
+
+
+class ArchiveSelection:
+    """
+    Geselecteerde rijen uit één of meer segmenten, als één virtuele tabel: kolommen
+    worden samengevoegd in de volgorde van de delen, rit-dicts pas bij het opvragen.
+    """
+
+    def __init__(self, parts):
+        self.parts = [(segment, rows) for segment, rows in parts if len(rows)]
+        self._offsets = np.cumsum([0] + [len(rows) for _, rows in self.parts])
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def column(self, name):
+        """Eén kolom (of "seq") over alle delen."""
+        if not self.parts:
+            return np.empty(0, dtype=_DTYPES[name])
+        if name == "seq":
+            return np.concatenate([segment.seq[rows] for segment, rows in self.parts])
+        return np.concatenate([segment.columns.column(name)[rows] for segment, rows in self.parts])
+
+    def rides(self, order=None):
+        """Rit-dicts voor de posities `order` (standaard alles), in die volgorde."""
+        order = np.arange(len(self)) if order is None else np.asarray(order, dtype=np.int64)
+        part_of = np.searchsorted(self._offsets, order, side="right") - 1
+        rides = [None] * len(order)
+        for index, (segment, rows) in enumerate(self.parts):
+            where = np.flatnonzero(part_of == index)
+            if len(where):
+                selected = rows[order[where] - self._offsets[index]]
+                for position, ride in zip(where.tolist(), segment.columns.rows(selected)):
+                    rides[position] = ride
+        return rides
+
+    def rides_by_seq(self):
+        """Alle rit-dicts in seq volgorde (de delen overlappen in seq)."""
+        return self.rides(np.argsort(self.column("seq"), kind="stable"))
+
+
+class RideArchive:
+    """
+    Archiefmap met een LRU cache van geopende segmenten. Segmenten zijn
+    onveranderlijk en dus veilig te delen tussen threads en sessies.
+    """
+
+    def __init__(self, root, cache_size=SEGMENT_CACHE):
+        self.root = root
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def segment(self, name):
+        with self._lock:
+            segment = self._cache.get(name)
+            if segment is not None:
+                self._cache.move_to_end(name)
+                return segment
+        segment = ArchiveSegment(os.path.join(self.root, name))
+        with self._lock:
+            self._cache[name] = segment
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return segment
+
+    def select(self, names, employee_id=None, first_day=None, last_day=None):
+        """ArchiveSelection van de segmenten `names` (uit het register), gefilterd op de predicaten."""
+        parts = []
+        for name in names:
+            segment = self.segment(name)
+            parts.append((segment, segment.rows(employee_id, first_day, last_day)))
+        return ArchiveSelection(parts)
+
+    def write(self, name, columns, seqs):
+        return write_segment(os.path.join(self.root, name), columns, seqs)
+
+    def aggregates(self, names):
+        """
+        (maandtotalen {(employee_id, jaar, maand): bedrag}, rit-punten {(employee_id,
+        datum ISO): punten}) over de segmenten, voor de consistentiecontrole.
+        """
+        months, points = {}, {}
+        for name in names:
+            columns = self.segment(name).columns
+            emp_ids = columns.column("employee_id").astype(np.int64)
+            days = columns.column("day").astype(np.int64)
+            month_numbers = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+            # Groeperen op de kolommen naast elkaar (geen samengestelde int64: ook negatieve ids)
+            keys, inverse = np.unique(np.stack((emp_ids, month_numbers), axis=1), axis=0, return_inverse=True)
+            amounts = np.bincount(inverse.ravel(), weights=columns.column("amount"), minlength=len(keys))
+            for (emp_id, month), amount in zip(keys.tolist(), amounts.tolist()):
+                month_key = (emp_id, 1970 + month // 12, month % 12 + 1)
+                months[month_key] = months.get(month_key, 0.0) + amount
+            return_code = columns.dictionaries["ride_type"].code(RIDE_TYPE_RETURN, MISSING - 1)
+            keys, inverse = np.unique(np.stack((emp_ids, days), axis=1), axis=0, return_inverse=True)
+            weights = 1 + (columns.column("ride_type") == return_code)
+            day_points = np.bincount(inverse.ravel(), weights=weights, minlength=len(keys))
+            iso_days = keys[:, 1].astype("datetime64[D]").astype(str).tolist()
+            for emp_id, iso_day, day_total in zip(keys[:, 0].tolist(), iso_days, day_points.tolist()):
+                point_key = (emp_id, iso_day)
+                points[point_key] = points.get(point_key, 0) + int(day_total)
+        return months, points
+
+    def discard_unregistered(self, registered):
+        """
+        Verwijdert .part bestanden en segmenten die niet in `registered` staan (een
+        onderbroken ronde). Enkel aanroepen onder de schrijflock. Geeft de namen terug.
+        """
+        removed = []
+        for directory, _, files in os.walk(self.root):
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                name = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if file_name.endswith(PARTIAL_SUFFIX) or (file_name.endswith(SEGMENT_SUFFIX) and name not in registered):
+                    os.remove(path)
+                    removed.append(name)
+        return removed
+
+
+if __name__ == "__main__":
+    from storage import DB_PATH, SqliteStorage
+
+    if sys.argv[1:] not in (["archive"], ["status"]):
+        print("Gebruik: python ride_archive.py archive | status")
+        sys.exit(2)
+    storage = SqliteStorage(DB_PATH)
+    if sys.argv[1] == "archive":
+        print(f"{storage.rides.archive_exported()} ritten gearchiveerd in {storage.rides.archive.root}")
+    for year, month, segments, ride_count, amount in storage.rides.archive_status():
+        print(f"{year:04d}-{month:02d}  {segments:>3} segment(en)  {ride_count:>9,} ritten  €{amount:>12,.2f}")
+    storage.close()
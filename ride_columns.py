@@ -0,0 +1,259 @@
+from array import array
+from datetime import date, datetime
+
+import numpy as np
+
+# =============================================================================
+# RIDE COLUMNS (Kolomgebaseerde opslag van ritten in geheugen)
+# =============================================================================
+# Een rit-dict kost al snel 800 bytes (dict, date, floats, strings). Hier staat
+# elke rit als één rij in groeiende NumPy kolommen (54 bytes per rit):
+#   - date als int32 dagen sinds 1970-01-01
+#   - employee_name, trajectory, ride_type en export_timestamp dictionary-encoded
+#     (int codes naar een lijst unieke waarden; een export batch deelt één timestamp)
+#   - optionele velden met een sentinel: MISSING (-1) voor None
+# Rit-dicts worden pas opgebouwd bij het opvragen (rows()); frame() geeft een
+# pandas DataFrame view op dezelfde buffers voor gevectoriseerde aggregaties.
+
+EPOCH = date(1970, 1, 1)
+INITIAL_CAPACITY = 1024
+GROWTH_FACTOR = 1.5
+MISSING = -1
+
+# (kolom, dtype); de volgorde is ook de kolomvolgorde van frame()
+COLUMNS = (
+    ("day", np.int32),
+    ("employee_id", np.int32),
+    ("employee_name", np.int32),
+    ("trajectory", np.int32),
+    ("ride_type", np.int8),  # enkel de gevalideerde rittypes
+    ("distance", np.float64),
+    ("amount", np.float64),
+    ("rate_applied", np.float64),
+    ("processed", np.bool_),
+    ("export_batch_id", np.int32),
+    ("export_timestamp", np.int32),
+    ("config_version", np.int32),
+)
+ENCODED_COLUMNS = ("employee_name", "trajectory", "ride_type", "export_timestamp")
+
+
+def day_number(day):
+    """Datum als aantal dagen sinds 1970-01-01 (de opslag van de date kolom)."""
+    return day.toordinal() - EPOCH.toordinal()
+
+
+def row_view(rows):
+    """NumPy view (zonder kopie) op een array('q') met rijnummers."""
+    return np.frombuffer(rows, dtype=np.int64) if len(rows) else np.empty(0, dtype=np.int64)
+
+
+def row_index():
+    """Lege rijnummer-index (8 bytes per rit, geen Python int per rit)."""
+    return array("q")
+
+
+class Dictionary:
+    """Dictionary encoding van een tekstkolom: waarde <-> int code (None = MISSING)."""
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def encode(self, value):
+        if value is None:
+            return MISSING
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def code(self, value, default=None):
+        """Code van een bestaande waarde (zonder ze toe te voegen)."""
+        return self._codes.get(value, default)
+
+    def decode_many(self, codes):
+        values = self.values
+        return [values[code] if code != MISSING else None for code in codes]
+
+
+class RideColumns:
+    """
+    Groeiende kolommen (capaciteit x GROWTH_FACTOR) met één rij per rit. Het rijnummer
+    is stabiel en dient als ride_id. Kolommen zijn enkel via column() te lezen,
+    want een groei vervangt de onderliggende arrays.
+    """
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self._size = 0
+        self._data = {name: np.zeros(capacity, dtype=dtype) for name, dtype in COLUMNS}
+        self.dictionaries = {name: Dictionary() for name in ENCODED_COLUMNS}
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        """Geheugen van de gebruikte rijen (zonder de dictionaries)."""
+        return sum(column.itemsize for column in self._data.values()) * self._size
+
+    def column(self, name):
+        """View op de gebruikte rijen van één kolom (geldig tot de volgende append)."""
+        return self._data[name][:self._size]
+
+    def _grow(self):
+        capacity = int(len(self._data["day"]) * GROWTH_FACTOR) + 1
+        for name, column in self._data.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._data[name] = grown
+
+    def append(self, ride):
+        """Voegt een rit-dict toe als nieuwe rij; geeft het rijnummer terug."""
+        row = self._size
+        if row == len(self._data["day"]):
+            self._grow()
+        data = self._data
+        encode = self.dictionaries
+        data["day"][row] = day_number(ride["date"])
+        data["employee_id"][row] = ride["employee_id"]
+        data["employee_name"][row] = encode["employee_name"].encode(ride.get("employee_name"))
+        data["trajectory"][row] = encode["trajectory"].encode(ride.get("trajectory"))
+        data["ride_type"][row] = encode["ride_type"].encode(ride.get("ride_type"))
+        data["distance"][row] = ride["distance"]
+        data["amount"][row] = ride["amount"]
+        data["rate_applied"][row] = ride["rate_applied"]
+        data["processed"][row] = ride.get("processed", False)
+        batch_id = ride.get("export_batch_id")
+        data["export_batch_id"][row] = MISSING if batch_id is None else batch_id
+        data["export_timestamp"][row] = encode["export_timestamp"].encode(ride.get("export_timestamp"))
+        version = ride.get("config_version")
+        data["config_version"][row] = MISSING if version is None else version
+        self._size += 1
+        return row
+
+    def set(self, name, rows, value):
+        """Schrijft `value` (scalar of array) in kolom `name` voor de gegeven rijen."""
+        if name in self.dictionaries:
+            value = self.dictionaries[name].encode(value)
+        self._data[name][rows] = value
+
+    # -------------------------------------------------------------------------
+    # Snapshot (zie event_log)
+    # -------------------------------------------------------------------------
+
+    def snapshot(self):
+        """(kolommen, dictionary waarden): kopie van de gebruikte rijen, JSON-baar op de arrays na."""
+        arrays = {name: self.column(name).copy() for name, _ in COLUMNS}
+        values = {name: dictionary.values for name, dictionary in self.dictionaries.items()}
+        values["export_timestamp"] = [stamp.isoformat() for stamp in values["export_timestamp"]]
+        return arrays, values
+
+    @classmethod
+    def from_snapshot(cls, arrays, values):
+        """Kolommen uit een snapshot() (capaciteit = aantal rijen, groeit bij de volgende append)."""
+        size = len(arrays["day"])
+        columns = cls(capacity=max(size, 1))
+        for name, dtype in COLUMNS:
+            columns._data[name][:size] = arrays[name].astype(dtype, copy=False)
+        columns._size = size
+        columns._load_dictionaries(values)
+        return columns
+
+    @classmethod
+    def mapped(cls, arrays, values):
+        """
+        Read-only kolommen rechtstreeks op `arrays` (bv. memory-mapped, zie ride_archive),
+        zonder kopie; `values` zoals in snapshot(). Er kan niets aan toegevoegd worden.
+        """
+        columns = cls(capacity=0)
+        columns._data = dict(arrays)
+        columns._size = len(arrays["day"])
+        columns._load_dictionaries(values)
+        return columns
+
+    def _load_dictionaries(self, values):
+        for name, dictionary in self.dictionaries.items():
+            decode = datetime.fromisoformat if name == "export_timestamp" else None
+            for value in values[name]:
+                dictionary.encode(decode(value) if decode else value)
+
+    # -------------------------------------------------------------------------
+    # Materialisatie
+    # -------------------------------------------------------------------------
+
+    def rows(self, rows):
+        """
+        Rit-dicts voor de gegeven rijnummers (in die volgorde), met dezelfde sleutels
+        als een rit uit SQLite: export velden enkel na export, distance als int als
+        die geheel is (zoals de NUMERIC kolom).
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return []
+        data = self._data
+        decode = self.dictionaries
+        dates = data["day"][rows].astype("datetime64[D]").tolist()
+        distances = [int(km) if km.is_integer() else km for km in data["distance"][rows].tolist()]
+        batch_ids = data["export_batch_id"][rows].tolist()
+        timestamps = decode["export_timestamp"].decode_many(data["export_timestamp"][rows].tolist())
+        columns = zip(
+            dates,
+            data["employee_id"][rows].tolist(),
+            decode["employee_name"].decode_many(data["employee_name"][rows].tolist()),
+            decode["trajectory"].decode_many(data["trajectory"][rows].tolist()),
+            decode["ride_type"].decode_many(data["ride_type"][rows].tolist()),
+            distances,
+            data["amount"][rows].tolist(),
+            data["rate_applied"][rows].tolist(),
+            data["processed"][rows].tolist(),
+            data["config_version"][rows].tolist(),
+            batch_ids,
+            timestamps,
+        )
+        rides = []
+        for ride_date, emp_id, name, trajectory, ride_type, km, amount, rate, processed, version, batch_id, stamp in columns:
+            ride = {
+                "date": ride_date,
+                "employee_id": emp_id,
+                "employee_name": name,
+                "trajectory": trajectory,
+                "ride_type": ride_type,
+                "distance": km,
+                "amount": amount,
+                "rate_applied": rate,
+                "processed": processed,
+                "config_version": None if version == MISSING else version,
+            }
+            if batch_id != MISSING:
+                ride["export_batch_id"] = batch_id
+                ride["export_timestamp"] = stamp
+            rides.append(ride)
+        return rides
+
+    def frame(self, rows=None):
+        """
+        pandas DataFrame view op de ritten (optioneel enkel `rows`). Zonder `rows`
+        delen de numerieke kolommen hun buffer met de store (geen kopie); de
+        gecodeerde tekstkolommen worden Categorical, `date` en `export_timestamp`
+        worden datetime64.
+        Het frame weerspiegelt latere wijzigingen in de store, maar geen nieuwe ritten.
+        """
+        import pandas as pd  # enkel hier: rules.py (via ride_store) blijft pandas-vrij
+
+        columns = {}
+        for name, _ in COLUMNS:
+            values = self.column(name) if rows is None else self._data[name][:self._size][rows]
+            if name == "day":
+                columns["date"] = values.astype("datetime64[D]").astype("datetime64[s]")
+            elif name == "export_timestamp":
+                stamps = self.dictionaries[name].values + [None]  # code -1 (MISSING) = NaT
+                columns[name] = np.array(stamps, dtype="datetime64[us]")[values]
+            elif name in ENCODED_COLUMNS:
+                columns[name] = pd.Categorical.from_codes(values, categories=self.dictionaries[name].values)
+            elif name in ("export_batch_id", "config_version"):
+                columns[name] = pd.arrays.IntegerArray(values, values == MISSING)
+            else:
+                columns[name] = values
+        return pd.DataFrame(columns, copy=False)
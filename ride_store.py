@@ -0,0 +1,458 @@
+import calendar
+from collections import defaultdict
+from datetime import date
+
+import numpy as np
+
+from ride_columns import MISSING, RideColumns, day_number, row_index, row_view
+
+# =============================================================================
+# RIDE STORE (Repository met secundaire indexen)
+# =============================================================================
+
+RIDE_TYPE_SINGLE = "Enkel"
+RIDE_TYPE_RETURN = "Heen-en-Terug"
+# Toegelaten rittypes (zelfde keuzes als het formulier in de UI)
+RIDE_TYPES = (RIDE_TYPE_RETURN, RIDE_TYPE_SINGLE)
+
+# Standaard aantal ritten per chunk bij streaming (export)
+CHUNK_SIZE = 5000
+
+# Tolerantie (in €) waaronder een verschil tussen aggregaat en ritten geen drift is
+DRIFT_TOLERANCE = 0.005
+
+
+def ride_points(ride_type):
+    """
+    Rit-punten voor een rittype (v4.4): Heen-en-Terug=2, Enkel (of onbekend)=1.
+    """
+    return 2 if ride_type == RIDE_TYPE_RETURN else 1
+
+
+def _month_employee_groups(months, employee_ids):
+    """
+    Groepeert rijen op (maand, employee_id), gesorteerd op maand en dan medewerker.
+    Geeft (order, starts) terug: de stabiele sorteervolgorde en de posities in
+    `order` waar een groep begint. Twee aparte sleutels (lexsort) in plaats van één
+    samengestelde int64, zodat ook negatieve ids correct groeperen.
+    """
+    order = np.lexsort((employee_ids, months))
+    months, employee_ids = months[order], employee_ids[order]
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = (months[1:] != months[:-1]) | (employee_ids[1:] != employee_ids[:-1])
+    return order, np.flatnonzero(new_group)
+
+
+def _group_sums(keys, amounts):
+    """{sleutel-tuple: som van amounts} over de sleutelkolommen `keys` (np.unique + bincount)."""
+    if not len(amounts):
+        return {}
+    unique, inverse = np.unique(np.stack(keys, axis=1), axis=0, return_inverse=True)
+    totals = np.bincount(inverse.ravel(), weights=amounts, minlength=len(unique))
+    return {tuple(key): total for key, total in zip(unique.tolist(), totals.tolist())}
+
+
+class RideStore:
+    """
+    Repository voor de transactionele ritten, kolomgebaseerd in geheugen (zie
+    ride_columns.RideColumns): de ritten staan als rijen in NumPy kolommen en
+    rit-dicts worden pas bij het opvragen opgebouwd. Lookups schalen met het
+    aantal ritten van één medewerker dankzij één secundaire index van rijnummers
+    per (employee_id, jaar, maand) (array('q'), 8 bytes per rit). Alle ritten van
+    een medewerker zijn de samengevoegde maanden; ritten van één dag (en de
+    rit-punten per dag) komen uit de maand, gefilterd op de dagkolom.
+
+    Daarnaast worden lopende totalen per medewerker bijgehouden (jaar, maand en
+    nog niet geëxporteerd bedrag), zodat de limiet checks een O(1) lookup zijn
+    in plaats van een herberekening. Een export watermark (alle rijen ervoor zijn
+    verwerkt) beperkt export en markering tot de nieuwe ritten.
+    """
+
+    def __init__(self, rides=None):
+        self._columns = RideColumns()
+        self._by_employee_month = defaultdict(row_index)
+        self._months_by_employee = defaultdict(set)
+        self._versions = defaultdict(int)
+        self._watermark = 0  # rijen [0, watermark) zijn geëxporteerd
+        self._reset_aggregates()
+        for ride in rides or []:
+            self.append(ride)
+
+    def append(self, ride):
+        """Voegt een rit toe (als nieuwe rij) en werkt alle indexen bij."""
+        emp_id = ride["employee_id"]
+        month_key = (ride["date"].year, ride["date"].month)
+        row = self._columns.append(ride)
+        self._by_employee_month[(emp_id,) + month_key].append(row)
+        self._months_by_employee[emp_id].add(month_key)
+        self._versions[emp_id] += 1
+        self._apply_to_aggregates(emp_id, ride["date"], ride["amount"], ride.get("processed", False))
+
+    def append_many(self, rides):
+        """Voegt een reeks ritten toe (bv. bulk import)."""
+        for ride in rides:
+            self.append(ride)
+
+    def submit_ride(self, employee_id, validate, make_ride):
+        """
+        Valideert en bewaart een rit in één stap.
+        validate() geeft (is_valid, msgs, amount) terug, make_ride(amount) bouwt de rit-dict.
+        In-memory (één sessie) is er geen concurrentie; zie SqliteRideStore voor de
+        variant met optimistische versiecontrole per medewerker.
+        """
+        is_valid, msgs, amount = validate()
+        if is_valid:
+            self.append(make_ride(amount))
+        return is_valid, msgs, amount
+
+    def mark_processed(self, batch_id, export_timestamp, upto=None):
+        """
+        Markeert de onverwerkte ritten na de watermark (tot seq `upto`, zie last_seq)
+        als geëxporteerd, werkt de aggregaten bij en schuift de watermark op.
+        Geeft het aantal gemarkeerde ritten terug.
+        """
+        columns = self._columns
+        rows = self._unprocessed_rows(upto)
+        self._watermark = len(columns) if upto is None else max(self._watermark, upto)
+        columns.set("processed", rows, True)
+        columns.set("export_batch_id", rows, batch_id)
+        columns.set("export_timestamp", rows, export_timestamp)
+        emp_ids = columns.column("employee_id")[rows]
+        amounts = columns.column("amount")[rows]
+        for emp_id, amount in zip(emp_ids.tolist(), amounts.tolist()):
+            self._pending_totals[emp_id] -= amount
+        self._pending_count -= len(rows)
+        for emp_id in set(emp_ids.tolist()):
+            self._versions[emp_id] += 1
+        return len(rows)
+
+    def apply_recalculation(self, updates, expected_versions):
+        """
+        Past herberekende bedragen toe. `updates` zijn tuples (ride_id, employee_id,
+        datum, oud bedrag, nieuw bedrag, tarief, config versie). Enkel als de versies
+        van de medewerkers nog gelijk zijn aan `expected_versions` (anders False en
+        wordt niets gewijzigd); de lopende totalen schuiven mee met het verschil.
+        """
+        if any(self._versions.get(emp_id, 0) != version for emp_id, version in expected_versions.items()):
+            return False
+        for ride_id, emp_id, ride_date, old_amount, new_amount, rate, config_version in updates:
+            delta = new_amount - old_amount
+            self._columns.set("amount", ride_id, new_amount)
+            self._columns.set("rate_applied", ride_id, rate)
+            self._columns.set("config_version", ride_id, config_version)
+            self._year_totals[(emp_id, ride_date.year)] += delta
+            self._month_totals[(emp_id, ride_date.year, ride_date.month)] += delta
+            self._pending_totals[emp_id] += delta
+        for emp_id in {update[1] for update in updates}:
+            self._versions[emp_id] += 1
+        return True
+
+    def snapshot(self):
+        """
+        (kolommen, metadata) voor een snapshot (zie event_log): de ritkolommen als
+        NumPy arrays, dictionaries, watermark en versies als JSON-bare metadata.
+        De indexen en lopende totalen worden bij het laden herberekend.
+        """
+        arrays, dictionaries = self._columns.snapshot()
+        return arrays, {
+            "dictionaries": dictionaries,
+            "watermark": self._watermark,
+            "versions": sorted(self._versions.items()),
+        }
+
+    @classmethod
+    def from_snapshot(cls, arrays, meta):
+        """
+        RideStore uit een snapshot(): de maandindex wordt gevectoriseerd opgebouwd
+        (stabiele sortering op (maand, employee_id)), de totalen via een herberekening.
+        """
+        store = cls()
+        columns = store._columns = RideColumns.from_snapshot(arrays, meta["dictionaries"])
+        months = columns.column("day").astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+        emp_ids = columns.column("employee_id")
+        order, starts = _month_employee_groups(months, emp_ids)  # binnen een groep blijft de invoervolgorde
+        firsts = order[starts]
+        for month, emp_id, rows in zip(months[firsts].tolist(), emp_ids[firsts].tolist(), np.split(order, starts[1:])):
+            month_key = (1970 + month // 12, month % 12 + 1)
+            index = store._by_employee_month[(emp_id,) + month_key]
+            index.frombytes(rows.astype(np.int64).tobytes())
+            store._months_by_employee[emp_id].add(month_key)
+        store._watermark = meta["watermark"]
+        store._versions.update((emp_id, version) for emp_id, version in meta["versions"])
+        store._load_aggregates(store._rebuilt_aggregates())
+        return store
+
+    def __iter__(self):
+        for start in range(0, len(self._columns), CHUNK_SIZE):
+            yield from self._columns.rows(np.arange(start, min(start + CHUNK_SIZE, len(self._columns))))
+
+    def __len__(self):
+        return len(self._columns)
+
+    def __bool__(self):
+        return bool(len(self._columns))
+
+    @property
+    def nbytes(self):
+        """Geheugen van de ritkolommen en de rijnummer-index (zonder lopende totalen)."""
+        return self._columns.nbytes + sum(len(rows) * rows.itemsize for rows in self._by_employee_month.values())
+
+    def frame(self, unprocessed=False):
+        """
+        pandas DataFrame van de ritten (zie RideColumns.frame); de index is de ride_id.
+        Zonder filter delen de numerieke kolommen hun geheugen met de store.
+        """
+        if not unprocessed:
+            return self._columns.frame()
+        rows = self._unprocessed_rows()
+        return self._columns.frame(rows).set_axis(rows)
+
+    # -------------------------------------------------------------------------
+    # Index lookups
+    # -------------------------------------------------------------------------
+
+    def _month_rows(self, employee_id, year, month):
+        """Rijnummers van één medewerker in een maand (invoervolgorde)."""
+        rows = self._by_employee_month.get((employee_id, year, month))
+        return row_view(rows if rows is not None else ())
+
+    def _employee_rows(self, employee_id, start_date=None):
+        """Rijnummers van één medewerker (optioneel vanaf de maand van start_date), in invoervolgorde."""
+        months = self._months_by_employee.get(employee_id, ())
+        if start_date is not None:
+            months = [key for key in months if key >= (start_date.year, start_date.month)]
+        if not months:
+            return row_view(())
+        rows = np.concatenate([self._month_rows(employee_id, *key) for key in months])
+        rows.sort()
+        return rows
+
+    def _day_rows(self, employee_id, day):
+        rows = self._month_rows(employee_id, day.year, day.month)
+        return rows[self._columns.column("day")[rows] == day_number(day)]
+
+    def for_employee(self, employee_id):
+        """Alle ritten van één medewerker (in invoervolgorde)."""
+        return self._columns.rows(self._employee_rows(employee_id))
+
+    def for_employee_on(self, employee_id, day):
+        """Ritten van één medewerker op een specifieke dag."""
+        return self._columns.rows(self._day_rows(employee_id, day))
+
+    def for_month(self, year, month):
+        """Alle ritten van alle medewerkers in een maand (gevectoriseerde scan van de dagkolom)."""
+        start, end = date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+        days = self._columns.column("day")
+        return self._columns.rows(np.flatnonzero((days >= day_number(start)) & (days <= day_number(end))))
+
+    def for_employee_month(self, employee_id, year, month):
+        """Ritten van één medewerker in een maand."""
+        return self._columns.rows(self._month_rows(employee_id, year, month))
+
+    def last_seq(self):
+        """Aantal ritten: rij i heeft seq i + 1 (de bovengrens van een export batch)."""
+        return len(self._columns)
+
+    def export_watermark(self):
+        """Hoogste seq die in een export batch zat (0 zonder exports)."""
+        return self._watermark
+
+    def _unprocessed_rows(self, upto=None):
+        processed = self._columns.column("processed")[self._watermark:upto]
+        return self._watermark + np.flatnonzero(~processed)
+
+    def iter_unprocessed(self, chunk_size=CHUNK_SIZE, upto=None):
+        """
+        Streamt de nog niet geëxporteerde ritten (na de watermark, tot en met seq
+        `upto`) in chunks (lijsten van rit-dicts).
+        """
+        rows = self._unprocessed_rows(upto)
+        for start in range(0, len(rows), chunk_size):
+            yield self._columns.rows(rows[start:start + chunk_size])
+
+    def pending_groups(self, upto=None):
+        """
+        Totalen per (employee_id, jaar, maand) van de onverwerkte ritten na de watermark
+        (tot en met seq `upto`), gesorteerd op maand en medewerker: tuples
+        (employee_id, jaar, maand, aantal, km, bedrag, eerste datum, laatste datum).
+        Eén gevectoriseerde groepering (np.unique + bincount) over de kolommen.
+        """
+        rows = self._unprocessed_rows(upto)
+        if not len(rows):
+            return []
+        columns = self._columns
+        days = columns.column("day")[rows]
+        months = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)  # maanden sinds 1970-01
+        emp_ids = columns.column("employee_id")[rows]
+        order, starts = _month_employee_groups(months, emp_ids)
+        inverse = np.empty(len(rows), dtype=np.intp)
+        inverse[order] = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(order))))
+        counts = np.bincount(inverse, minlength=len(starts))
+        distances = np.bincount(inverse, weights=columns.column("distance")[rows], minlength=len(starts))
+        amounts = np.bincount(inverse, weights=columns.column("amount")[rows], minlength=len(starts))
+        first = np.full(len(starts), np.iinfo(np.int32).max, dtype=np.int32)
+        last = np.full(len(starts), np.iinfo(np.int32).min, dtype=np.int32)
+        np.minimum.at(first, inverse, days)
+        np.maximum.at(last, inverse, days)
+        firsts = order[starts]
+        return [
+            (emp_id, 1970 + month // 12, month % 12 + 1, count, distance, amount, first_day, last_day)
+            for month, emp_id, count, distance, amount, first_day, last_day in zip(
+                months[firsts].tolist(), emp_ids[firsts].tolist(), counts.tolist(), distances.tolist(), amounts.tolist(),
+                first.astype("datetime64[D]").tolist(), last.astype("datetime64[D]").tolist(),
+            )
+        ]
+
+    def months_for_employee(self, employee_id):
+        """Gesorteerde lijst van (jaar, maand) waarin de medewerker ritten heeft."""
+        return sorted(self._months_by_employee.get(employee_id, ()))
+
+    def employees_with_rides(self, year, month):
+        """Set van employee_ids met minstens één rit in de maand (één pass over de maandindex)."""
+        month_key = (year, month)
+        return {emp_id for emp_id, months in self._months_by_employee.items() if month_key in months}
+
+    def unprocessed_for_employee(self, employee_id, start_date=None):
+        """
+        (ride_id, rit) van de nog niet geëxporteerde ritten van één medewerker vanaf
+        start_date, in datumvolgorde (bij gelijke datum in invoervolgorde).
+        """
+        rows = self._employee_rows(employee_id, start_date)
+        days = self._columns.column("day")[rows]
+        keep = ~self._columns.column("processed")[rows]
+        if start_date is not None:
+            keep &= days >= day_number(start_date)
+        rows, days = rows[keep], days[keep]
+        rows = rows[np.lexsort((rows, days))]
+        return list(zip(rows.tolist(), self._columns.rows(rows)))
+
+    def _history_rows(self, employee_id, year=None, month=None):
+        if year is None:
+            return self._employee_rows(employee_id)
+        return self._month_rows(employee_id, year, month)
+
+    def history(self, employee_id, year=None, month=None, offset=0, limit=None):
+        """
+        Ritten van één medewerker (optioneel één maand), nieuwste eerst, gepagineerd.
+        Bij gelijke datum komt de laatst ingevoerde rit eerst.
+        """
+        rows = self._history_rows(employee_id, year, month)
+        rows = rows[np.lexsort((-rows, -self._columns.column("day")[rows].astype(np.int64)))]
+        return self._columns.rows(rows[offset:None if limit is None else offset + limit])
+
+    def history_summary(self, employee_id, year=None, month=None):
+        """(aantal ritten, totaal bedrag) van één medewerker (optioneel één maand)."""
+        rows = self._history_rows(employee_id, year, month)
+        return len(rows), float(self._columns.column("amount")[rows].sum())
+
+    def version(self, employee_id):
+        """Versie van de ritten van één medewerker; verhoogt bij elke toevoeging en export."""
+        return self._versions.get(employee_id, 0)
+
+    # -------------------------------------------------------------------------
+    # Afgeleide waarden
+    # -------------------------------------------------------------------------
+
+    def year_total(self, employee_id, year):
+        """Lopend jaartotaal van één medewerker (O(1))."""
+        return self._year_totals.get((employee_id, year), 0.0)
+
+    def month_total(self, employee_id, year, month):
+        """Lopend maandtotaal van één medewerker (O(1))."""
+        return self._month_totals.get((employee_id, year, month), 0.0)
+
+    def pending_total(self, employee_id):
+        """Bedrag van de nog niet geëxporteerde ritten van één medewerker."""
+        return self._pending_totals.get(employee_id, 0.0)
+
+    def pending_summary(self):
+        """(aantal, totaal bedrag) van alle nog niet geëxporteerde ritten."""
+        return self._pending_count, sum(self._pending_totals.values())
+
+    def period_total(self, employee_id, start_date, end_date):
+        """
+        Som van de bedragen van één medewerker tussen start_date en end_date (inclusief).
+        Volledige kalenderjaren en -maanden komen uit de lopende totalen.
+        """
+        if start_date.day == 1 and end_date.year == start_date.year:
+            if start_date.month == 1 and end_date == date(end_date.year, 12, 31):
+                return self.year_total(employee_id, start_date.year)
+            last_day = calendar.monthrange(start_date.year, start_date.month)[1]
+            if end_date == date(start_date.year, start_date.month, last_day):
+                return self.month_total(employee_id, start_date.year, start_date.month)
+        rows = self._employee_rows(employee_id, start_date)
+        days = self._columns.column("day")[rows]
+        in_period = (days >= day_number(start_date)) & (days <= day_number(end_date))
+        return float(self._columns.column("amount")[rows[in_period]].sum())
+
+    def day_points(self, employee_id, day):
+        """Som van de rit-punten van één medewerker op een dag (binnen de maandindex)."""
+        ride_types = self._columns.column("ride_type")[self._day_rows(employee_id, day)]
+        return_code = self._columns.dictionaries["ride_type"].code(RIDE_TYPE_RETURN, MISSING - 1)
+        return len(ride_types) + int((ride_types == return_code).sum())  # zoals ride_points: 2 of 1
+
+    # -------------------------------------------------------------------------
+    # Lopende totalen (aggregaten)
+    # -------------------------------------------------------------------------
+
+    def _reset_aggregates(self):
+        self._year_totals = defaultdict(float)
+        self._month_totals = defaultdict(float)
+        self._pending_totals = defaultdict(float)
+        self._pending_count = 0
+
+    def _apply_to_aggregates(self, emp_id, ride_date, amount, processed):
+        self._year_totals[(emp_id, ride_date.year)] += amount
+        self._month_totals[(emp_id, ride_date.year, ride_date.month)] += amount
+        if not processed:
+            self._pending_totals[emp_id] += amount
+            self._pending_count += 1
+
+    def _rebuilt_aggregates(self):
+        """Jaar-, maand- en pending totalen gevectoriseerd herberekend uit de kolommen."""
+        columns = self._columns
+        emp_ids = columns.column("employee_id")
+        amounts = columns.column("amount")
+        months = columns.column("day").astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+        years = months // 12 + 1970
+        pending = ~columns.column("processed")
+        return {
+            "year": _group_sums((emp_ids, years), amounts),
+            "month": _group_sums((emp_ids, years, months % 12 + 1), amounts),
+            "pending": {key[0]: total for key, total in _group_sums((emp_ids[pending],), amounts[pending]).items()},
+        }
+
+    def check_consistency(self, repair=False):
+        """
+        Herberekent alle aggregaten vanuit de ritkolommen en vergelijkt ze met de
+        lopende totalen. Geeft een lijst van drift-records terug:
+        (aggregaat, sleutel, bijgehouden waarde, verwachte waarde).
+        Met repair=True worden de aggregaten vervangen door de herberekende waarden.
+        Rit-punten per dag worden niet bijgehouden maar telkens uit de kolommen
+        gelezen, en kunnen dus niet afwijken.
+        """
+        current = {
+            "year": self._year_totals,
+            "month": self._month_totals,
+            "pending": self._pending_totals,
+        }
+        rebuilt = self._rebuilt_aggregates()
+
+        drift = []
+        for name, expected_values in rebuilt.items():
+            stored_values = current[name]
+            for key in set(stored_values) | set(expected_values):
+                stored = stored_values.get(key, 0)
+                expected = expected_values.get(key, 0)
+                if abs(stored - expected) > DRIFT_TOLERANCE:
+                    drift.append((name, key, stored, expected))
+
+        if repair:
+            self._load_aggregates(rebuilt)
+        return drift
+
+    def _load_aggregates(self, rebuilt):
+        self._year_totals = defaultdict(float, rebuilt["year"])
+        self._month_totals = defaultdict(float, rebuilt["month"])
+        self._pending_totals = defaultdict(float, rebuilt["pending"])
+        self._pending_count = int((~self._columns.column("processed")).sum())
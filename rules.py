@@ -0,0 +1,219 @@
+import calendar
+from datetime import date
+
+import metrics
+from ride_store import RIDE_TYPE_RETURN, ride_points
+
+# =============================================================================
+# RULES ENGINE (Business Logic zonder Streamlit)
+# =============================================================================
+# De fiscale regels van een ritregistratie, met expliciete inputs: de config
+# snapshots (ConfigHistory), een ride store, de vergrendelde export periodes, de deadline
+# uitzonderingen en een klok. Deze module importeert geen streamlit, pandas of
+# dateutil, zodat de UI, de bulk import en workers/API processen dezelfde regels
+# gebruiken (elk proces bouwt zijn eigen RulesEngine op zijn eigen storage).
+
+MSG_FUTURE = "❌ Je kan geen ritten in de toekomst registreren."
+MSG_EXPORTED = "❌ Deze maand is al geëxporteerd en kan niet meer gewijzigd worden."
+MSG_WINDOW = "❌ Deze datum kan niet meer worden ingevoerd (alleen huidige + vorige maand tot {deadline})"
+MSG_EXCEPTION = "ℹ️ Uitzondering actief: je mag ritten tot {expires} invoeren"
+MSG_PREVIOUS_MONTH = "ℹ️ Let op: je corrigeert een rit uit de vorige maand (deadline: {deadline})"
+MSG_DAY_LIMIT = "❌ Daglimiet overschreden: je hebt al {points}/2 rit-punten vandaag. "
+MSG_LIMIT_CAPPED = (
+    "⚠️ {label} bereikt! Slechts {km:.1f}km van je rit wordt vergoed (€{allowed:.2f} van €{original:.2f})"
+)
+MSG_LIMIT_EXHAUSTED = "❌ {adjective} limiet (€{limit:.2f}) volledig bereikt. Geen vergoeding mogelijk."
+MSG_LIMIT_BLOCKED = "❌ {adjective} limiet (€{limit:.2f}) overschreden!"
+MSG_NL_COMPANY_FREE = "ℹ️ Bedrijfsfiets (NL) = €0 vergoeding."
+MSG_NL_COMPANY_TAXED = "⚠️ Bedrijfsfiets (NL) = €{rate:.2f}/km (BELASTBAAR inkomen)."
+MSG_VALID = "✅ Rit gevalideerd: €{amount:.2f} voor {km}km"
+
+# Redenen (metrics label) per verdict; de weigerende regel zet zijn eigen reden
+REASON_OK = "ok"
+REASON_CAPPED = "limit_capped"
+REASON_FUTURE = "future"
+REASON_EXPORTED = "exported"
+REASON_WINDOW = "window"
+REASON_DAY_LIMIT = "day_limit"
+REASON_LIMIT_EXHAUSTED = "limit_exhausted"
+REASON_LIMIT_BLOCKED = "limit_blocked"
+
+# Per BE limiet type (zie RateRule.limit_type): (label, bijvoeglijk naamwoord)
+LIMIT_LABELS = {
+    "MONTHLY": ("Maandlimiet", "Maandelijkse"),
+    "YEARLY": ("Jaarlimiet", "Jaarlijkse"),
+}
+
+
+def record_validation(is_valid, reason):
+    """
+    Telt één validatie: accepted ("ok"), capped ("limit_capped", CAP afkapping)
+    of rejected met de reden van de weigerende regel.
+    """
+    if not metrics.enabled():
+        return
+    if not is_valid:
+        metrics.count("validations", outcome="rejected", reason=reason)
+    elif reason == REASON_CAPPED:
+        metrics.count("validations", outcome="capped", reason=reason)
+    else:
+        metrics.count("validations", outcome="accepted", reason=reason)
+
+
+def month_bounds(day):
+    """Eerste en laatste dag van de maand van `day`."""
+    return date(day.year, day.month, 1), date(day.year, day.month, calendar.monthrange(day.year, day.month)[1])
+
+
+def year_bounds(day):
+    """Eerste en laatste dag van het jaar van `day`."""
+    return date(day.year, 1, 1), date(day.year, 12, 31)
+
+
+def submission_window(today, deadline_day):
+    """
+    Tijdvenster voor ritregistratie: (start huidige maand, start vorige maand,
+    deadline voor de vorige maand).
+    """
+    current_month_start = date(today.year, today.month, 1)
+    if today.month == 1:
+        previous_month_start = date(today.year - 1, 12, 1)
+    else:
+        previous_month_start = date(today.year, today.month - 1, 1)
+    return current_month_start, previous_month_start, date(today.year, today.month, deadline_day)
+
+
+class RulesEngine:
+    """
+    Validatie van ritten tegen de config snapshots (ConfigHistory), een ride store,
+    de export locks (ExportLocks) en de deadline uitzonderingen `{employee_id: vervaldatum}`.
+    Tarief, limiet en rit-punten komen uit de snapshot die geldt op de ritdatum;
+    de invoerdeadline uit de snapshot van vandaag.
+    `clock` geeft de datum van vandaag terug (standaard date.today), zodat de
+    regels ook reproduceerbaar buiten de UI kunnen draaien.
+    """
+
+    def __init__(self, configs, rides, export_locks, deadline_exceptions, clock=date.today):
+        self.configs = configs
+        self.rides = rides
+        self.export_locks = export_locks
+        self.deadline_exceptions = deadline_exceptions
+        self.clock = clock
+
+    @property
+    def config(self):
+        """Configuratie (read-only mapping) die vandaag geldt."""
+        return self.configs.at(self.clock()).values
+
+    def rule_for(self, employee, day):
+        """Tarief, limiet en config versie voor een medewerker op een ritdatum (RateRule)."""
+        return self.configs.resolve(employee["country"], employee["bike_type"], day)
+
+    def period_total(self, employee_id, start_date, end_date):
+        """
+        Berekent het totaal bedrag voor een specifieke periode.
+        Volledige maanden/jaren zijn een O(1) lookup in de lopende totalen van de ride store.
+        """
+        return self.rides.period_total(employee_id, start_date, end_date)
+
+    def is_month_exported(self, date_obj):
+        """Controleert of een datum in een geëxporteerde (read-only) periode valt."""
+        return self.export_locks.is_locked(date_obj)
+
+    def active_exception(self, employee_id, today=None):
+        """Vervaldatum van een actieve deadline uitzondering, of None."""
+        expires = self.deadline_exceptions.get(employee_id)
+        if expires is not None and (today or self.clock()) <= expires:
+            return expires
+        return None
+
+    def validate_ride(self, employee, date_obj, trajectory_name, ride_type):
+        """
+        Valideert een rit tegen de huidige configuratie regels.
+        Geeft (is_valid, berichten, bedrag) terug. Ondersteunt maand/jaar limieten,
+        historische correcties, export locking en enkel/heen-en-terug ritten.
+        """
+        is_valid, msgs, amount, reason = self._validate_ride(employee, date_obj, trajectory_name, ride_type)
+        record_validation(is_valid, reason)
+        return is_valid, msgs, amount
+
+    def _validate_ride(self, employee, date_obj, trajectory_name, ride_type):
+        """Zoals validate_ride, met de reden (REASON_*) van het verdict als vierde element."""
+        msgs = []
+        today = self.clock()
+        rule = self.rule_for(employee, date_obj)
+
+        # Haal vaste afstand op uit Master Data (Niet user input!)
+        distance = employee["trajectories"][trajectory_name]
+
+        # 0. Toekomst Check (v4.1)
+        if date_obj > today:
+            return False, [MSG_FUTURE], 0.0, REASON_FUTURE
+
+        # 1. Export Lock Check
+        if self.is_month_exported(date_obj):
+            return False, [MSG_EXPORTED], 0.0, REASON_EXPORTED
+
+        # 2. Tijdvenster Validatie (Huidige maand + Vorige maand tot deadline)
+        current_month_start, previous_month_start, deadline_previous_month = submission_window(
+            today, self.configs.at(today).values["DEADLINE_DAY"]
+        )
+
+        # v4.3: Deadline uitzondering per medewerker
+        exception_date = self.active_exception(employee["id"], today)
+        if exception_date is not None:
+            msgs.append(MSG_EXCEPTION.format(expires=exception_date))
+
+        # - Huidige maand: altijd toegestaan
+        # - Vorige maand: alleen tot deadline van huidige maand (tenzij exception actief)
+        # - Ouder dan vorige maand: niet toegestaan
+        if date_obj < current_month_start:
+            if date_obj >= previous_month_start and (today <= deadline_previous_month or exception_date is not None):
+                msgs.append(MSG_PREVIOUS_MONTH.format(deadline=deadline_previous_month))
+            else:
+                return False, [MSG_WINDOW.format(deadline=deadline_previous_month)], 0.0, REASON_WINDOW
+
+        # 3. Daglimiet Check - Rit-Punten Systeem (v4.4): Enkel=1 punt, Heen-en-Terug=2 punten
+        current_points = self.rides.day_points(employee["id"], date_obj)
+        if current_points + ride_points(ride_type) > rule.max_ride_points:
+            return False, [MSG_DAY_LIMIT.format(points=current_points)], 0.0, REASON_DAY_LIMIT
+
+        # 4. Berekening (Enkel/Heen-en-Terug, v4.1)
+        total_km = distance * (2 if ride_type == RIDE_TYPE_RETURN else 1)
+        amount = 0.0
+        reason = REASON_OK
+
+        if employee["country"] == "BE":
+            amount = total_km * rule.rate
+
+            # Fiscale Limiet Check (maand of jaar, BLOCK of CAP)
+            label, adjective = LIMIT_LABELS[rule.limit_type]
+            start, end = month_bounds(date_obj) if rule.limit_type == "MONTHLY" else year_bounds(date_obj)
+            period_total = self.period_total(employee["id"], start, end)
+            limit = rule.limit
+
+            if (period_total + amount) > limit:
+                if rule.enforce_mode != "CAP":
+                    msg = MSG_LIMIT_BLOCKED.format(adjective=adjective, limit=limit)
+                    return False, [msg], 0.0, REASON_LIMIT_BLOCKED
+                # Afkap-logica: vergoed gedeeltelijk tot limiet
+                allowed_amount = max(0, limit - period_total)
+                if not allowed_amount > 0:
+                    msg = MSG_LIMIT_EXHAUSTED.format(adjective=adjective, limit=limit)
+                    return False, [msg], 0.0, REASON_LIMIT_EXHAUSTED
+                allowed_km = allowed_amount / rule.rate if rule.rate > 0 else 0
+                msgs.append(MSG_LIMIT_CAPPED.format(label=label, km=allowed_km, allowed=allowed_amount, original=amount))
+                amount = allowed_amount
+                reason = REASON_CAPPED
+
+        elif employee["country"] == "NL":
+            # v4.3: Bedrijfsfiets kan een configureerbaar tarief hebben (wel belastbaar)
+            amount = total_km * rule.rate
+            if employee["bike_type"] == "company":
+                if rule.rate == 0.0:
+                    msgs.append(MSG_NL_COMPANY_FREE)
+                else:
+                    msgs.append(MSG_NL_COMPANY_TAXED.format(rate=rule.rate))
+
+        msgs.append(MSG_VALID.format(amount=amount, km=total_km))
+        return True, msgs, amount, reason
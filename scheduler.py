@@ -0,0 +1,260 @@
+import heapq
+import itertools
+import json
+import os
+import sys
+import threading
+import traceback
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+
+import metrics
+
+# =============================================================================
+# SCHEDULER (Min-heap van tijdstippen: vervallen uitzonderingen, herinneringen)
+# =============================================================================
+# Eén daemon thread per proces slaapt tot het eerstvolgende tijdstip in de heap
+# en voert dan alle vervallen jobs uit. Deadline uitzonderingen worden zo op hun
+# vervaldag eager verwijderd (niet meer als neveneffect van het HR scherm), en de
+# herinneringen voor de invoerdeadline worden één keer per dag in één pass
+# berekend en via een sink verstuurd.
+#
+# Meerdere processen (Streamlit replicas, cron) mogen dezelfde jobs draaien:
+# een uitzondering wordt enkel verwijderd als ze niet intussen verlengd werd, en
+# storage.claim_reminders geeft elke medewerker één herinnering per periode.
+
+# Herinneren vanaf zoveel dagen vóór de deadline (zelfde venster als het dashboard)
+REMINDER_DAYS = 5
+# Tijdstip van de dagelijkse herinneringsjob
+REMINDER_TIME = time(8, 0)
+# Lokaal bestand van de FileSink (stand-in voor SMTP)
+REMINDER_LOG = os.environ.get("FIETSVERGOEDING_REMINDER_LOG", "reminders.jsonl")
+# Langste slaap van de scheduler thread, zodat een verzette klok snel opgemerkt wordt
+MAX_SLEEP = 60.0  # seconden
+
+# Herinnering voor één medewerker; `period` is de maand waarvoor ritten ontbreken (YYYY-MM)
+Notification = namedtuple("Notification", "employee_id name period deadline days_left message")
+
+
+class Scheduler:
+    """
+    Min-heap van (tijdstip, volgnummer, job, args). `schedule` is O(log n),
+    `run_pending` voert alle jobs uit waarvan het tijdstip verstreken is. Een
+    job die faalt wordt gelogd en stopt de scheduler niet.
+    `clock` geeft het huidige tijdstip terug (standaard datetime.now).
+    """
+
+    def __init__(self, clock=datetime.now):
+        self.clock = clock
+        self._heap = []
+        self._seq = itertools.count()  # gelijke tijdstippen in volgorde van inplannen
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, when, job, *args):
+        """Plant job(*args) in op `when` (datetime); een tijdstip in het verleden loopt meteen."""
+        with self._cond:
+            heapq.heappush(self._heap, (when, next(self._seq), job, args))
+            self._cond.notify()
+
+    def next_due(self):
+        """Tijdstip van de eerstvolgende job, of None."""
+        with self._cond:
+            return self._heap[0][0] if self._heap else None
+
+    def run_pending(self, now=None):
+        """Voert alle vervallen jobs uit (buiten de lock); geeft het aantal terug."""
+        now = now or self.clock()
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+        for _, _, job, args in due:
+            try:
+                job(*args)
+            except Exception:
+                metrics.count("scheduler_job_errors", job=job.__name__)
+                traceback.print_exc()
+        return len(due)
+
+    def start(self):
+        """Start de daemon thread (één keer)."""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._heap and self._heap[0][0] <= self.clock():
+                        break
+                    wait = MAX_SLEEP
+                    if self._heap:
+                        wait = min(max((self._heap[0][0] - self.clock()).total_seconds(), 0.0), MAX_SLEEP)
+                    self._cond.wait(wait)
+                if self._stopped:
+                    return
+            self.run_pending()
+
+
+# =============================================================================
+# DEADLINE JOBS (Uitzonderingen laten vervallen, herinneringen versturen)
+# =============================================================================
+
+def deadline_window(config, today):
+    """
+    (deadline, dagen resterend) als `today` binnen REMINDER_DAYS vóór de invoerdeadline
+    voor ritten van de vorige maand valt, anders None.
+    """
+    deadline = date(today.year, today.month, config["DEADLINE_DAY"])
+    days_left = (deadline - today).days
+    if 0 < days_left <= REMINDER_DAYS:
+        return deadline, days_left
+    return None
+
+
+def expiry_moment(expires):
+    """Tijdstip waarop een uitzondering tot en met `expires` vervalt (middernacht erna)."""
+    return datetime.combine(expires + timedelta(days=1), time.min)
+
+
+def collect_reminders(state, rides, today):
+    """
+    Eén pass over de master data: elke medewerker zonder ritten in de vorige maand,
+    als `today` in het herinneringsvenster valt. `state` is een StateSnapshot.
+    """
+    window = deadline_window(state.config_history.at(today).values, today)
+    if window is None:
+        return []
+    deadline, days_left = window
+    previous = today.replace(day=1) - timedelta(days=1)
+    submitted = rides.employees_with_rides(previous.year, previous.month)
+    period = f"{previous.year}-{previous.month:02d}"
+    return [
+        Notification(
+            employee["id"],
+            employee["name"],
+            period,
+            deadline,
+            days_left,
+            f"Nog {days_left} dag(en) tot de deadline ({deadline}): je hebt nog geen ritten voor {period} ingevoerd.",
+        )
+        for employee in state.employees.values()
+        if employee["id"] not in submitted
+    ]
+
+
+class FileSink:
+    """
+    Notificatie sink die elke herinnering als JSON regel naar een lokaal bestand
+    schrijft (stand-in voor SMTP). Een sink is elk object met send(notifications).
+    """
+
+    def __init__(self, path=REMINDER_LOG):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, notifications):
+        lines = [
+            json.dumps(dict(notification._asdict(), deadline=notification.deadline.isoformat()), ensure_ascii=False)
+            for notification in notifications
+        ]
+        if not lines:
+            return
+        with self._lock, open(self.path, "a", encoding="utf-8") as fileobj:
+            fileobj.write("\n".join(lines) + "\n")
+
+
+class DeadlineJobs:
+    """
+    Plant de vervaldata van de deadline uitzonderingen en de dagelijkse
+    herinneringsjob in op een Scheduler, bovenop de gedeelde state (SharedState).
+    """
+
+    def __init__(self, shared, sink, scheduler=None):
+        self.shared = shared
+        self.storage = shared.storage
+        self.sink = sink
+        self.scheduler = Scheduler() if scheduler is None else scheduler
+        self._expiries = {}  # employee_id -> ingeplande vervaldatum
+        self._version = None
+        self._lock = threading.Lock()
+
+    def sync(self, state):
+        """
+        Plant nieuwe of gewijzigde vervaldata van een snapshot in; een oude entry in
+        de heap wordt bij het uitvoeren overgeslagen. Niets te doen als de versie gelijk bleef.
+        """
+        if state.version == self._version:
+            return
+        with self._lock:
+            for emp_id, expires in state.deadline_exceptions.items():
+                if self._expiries.get(emp_id) != expires:
+                    self._expiries[emp_id] = expires
+                    self.scheduler.schedule(expiry_moment(expires), self._expire, emp_id, expires)
+            self._version = state.version
+
+    def prime(self):
+        """Plant de vervaldata van de huidige state en meteen een herinneringsronde in."""
+        self.sync(self.shared.current())
+        self.scheduler.schedule(self.scheduler.clock(), self._remind)
+
+    def start(self):
+        self.prime()
+        self.scheduler.start()
+
+    def _expire(self, emp_id, expires):
+        with self._lock:
+            if self._expiries.get(emp_id) != expires:
+                return  # intussen verlengd: de nieuwe vervaldatum staat al in de heap
+            del self._expiries[emp_id]
+        if self.storage.delete_deadline_exception(emp_id, expires=expires):
+            metrics.count("deadline_exceptions_expired")
+
+    def _remind(self):
+        today = self.scheduler.clock().date()
+        try:
+            self.send_reminders(today)
+        finally:
+            self.scheduler.schedule(datetime.combine(today + timedelta(days=1), REMINDER_TIME), self._remind)
+
+    def send_reminders(self, today):
+        """Berekent en verstuurt de herinneringen van `today`; geeft het aantal verstuurde terug."""
+        with metrics.span("deadline_reminders"):
+            notifications = collect_reminders(self.shared.current(), self.storage.rides, today)
+            if not notifications:
+                return 0
+            claimed = set(self.storage.claim_reminders(notifications[0].period, [n.employee_id for n in notifications]))
+            notifications = [notification for notification in notifications if notification.employee_id in claimed]
+            self.sink.send(notifications)
+        metrics.count("deadline_reminders_sent", len(notifications))
+        return len(notifications)
+
+
+if __name__ == "__main__":
+    from shared_state import SharedState
+    from storage import DB_PATH, SqliteStorage
+
+    # Voor cron of een proces zonder UI: vervallen uitzonderingen en herinneringen van vandaag, dan stoppen
+    if sys.argv[1:] != ["run"]:
+        print("Gebruik: python scheduler.py run")
+        sys.exit(2)
+    storage = SqliteStorage(DB_PATH)
+    jobs = DeadlineJobs(SharedState(storage), FileSink())
+    jobs.prime()
+    pending = len(jobs.scheduler)
+    jobs.scheduler.run_pending()
+    print(f"{pending - len(jobs.scheduler)} job(s) uitgevoerd, herinneringen in {jobs.sink.path}")
+    storage.close()
@@ -0,0 +1,207 @@
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import namedtuple
+from collections.abc import Mapping
+
+import numpy as np
+
+from config_snapshots import ConfigHistory
+from employees import EmployeeIndex
+from event_log import master_from_json, master_to_json
+from export_locks import ExportLocks
+from rules import RulesEngine
+
+# =============================================================================
+# SHARED STATE (Eén read-mostly toestand per proces, gedeeld over alle sessies)
+# =============================================================================
+# Config snapshots, master data, export geschiedenis, export locks en deadline
+# uitzonderingen worden één keer per proces geladen en door alle sessies gedeeld;
+# de ritten zitten al in de gedeelde SQLite storage. Een sessie houdt enkel een
+# referentie naar de huidige snapshot, geen eigen kopie.
+#
+# Copy-on-write: een snapshot wordt nooit gewijzigd. Een wijziging gaat naar de
+# storage (en dus de event log); de eerstvolgende run ziet een hogere
+# `storage.state_version()` en bouwt een nieuwe snapshot, terwijl lopende runs
+# hun oude snapshot blijven gebruiken.
+#
+# Startup snapshot: de brondata van een snapshot (config, master data, exports,
+# uitzonderingen) wordt ook als één gecomprimeerde JSON blob in de database
+# bewaard, per state versie. Een koud proces laadt die in één lookup in plaats van
+# de tabellen rij per rij; `python shared_state.py precompute` maakt hem vooraf
+# aan (bv. bij een deploy), anders doet het eerste proces na een wijziging dat.
+
+# Een sessie telt mee in het geheugenrapport als ze zo recent nog een run had
+SESSION_WINDOW = 15 * 60  # seconden
+# De eigen state van een sessie wordt bij de eerste run en daarna om de zoveel runs
+# gemeten (deep_size is O(session state), te duur voor elke rerun)
+SESSION_SAMPLE_RUNS = 25
+# Geheugenbudget voor gedeelde toestand + sessies samen
+MEMORY_BUDGET = int(os.environ.get("FIETSVERGOEDING_MEMORY_BUDGET_MB", "256")) * 1024 * 1024
+
+# Onveranderlijke toestand op `version` (seq van het laatste niet-rit event)
+StateSnapshot = namedtuple(
+    "StateSnapshot",
+    "version config_history employees employee_index export_history export_locks deadline_exceptions rules",
+)
+
+# Geheugenrapport in bytes; `unshared` is wat elke sessie met een eigen kopie zou kosten
+MemoryReport = namedtuple("MemoryReport", "shared sessions session_bytes unshared budget")
+
+
+def deep_size(obj, seen=None, exclude=frozenset()):
+    """
+    Geschatte geheugengrootte van een object en alles wat het bevat (bytes).
+    Objecten waarvan de id in `exclude` zit (bv. de gedeelde snapshot) tellen
+    niet mee; `seen` vermijdt dubbel tellen over meerdere aanroepen heen.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen or id(obj) in exclude:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if hasattr(obj, "memory_usage") and hasattr(obj, "columns"):  # pandas DataFrame
+        return int(obj.memory_usage(index=True).sum())
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float)):
+        return size
+    if isinstance(obj, Mapping):
+        return size + sum(deep_size(key, seen, exclude) + deep_size(value, seen, exclude) for key, value in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(deep_size(item, seen, exclude) for item in obj)
+    if hasattr(obj, "__dict__"):
+        size += deep_size(vars(obj), seen, exclude)
+    for slot in getattr(type(obj), "__slots__", ()):
+        if hasattr(obj, slot):
+            size += deep_size(getattr(obj, slot), seen, exclude)
+    return size
+
+
+def encode_startup_state(config_history, employees, export_history, deadline_exceptions):
+    """Startup snapshot als bytes (zlib gecomprimeerde JSON, zelfde formaat als de event log snapshots)."""
+    meta = master_to_json(config_history, employees, deadline_exceptions, export_history)
+    return zlib.compress(json.dumps(meta, separators=(",", ":")).encode("utf-8"), 1)
+
+
+def decode_startup_state(blob):
+    """(config_history, employees, export_history, deadline_exceptions) uit encode_startup_state."""
+    configs, employees, deadline_exceptions, export_history = master_from_json(
+        json.loads(zlib.decompress(blob).decode("utf-8"))
+    )
+    return ConfigHistory(configs.values()), employees, export_history, deadline_exceptions
+
+
+class SharedState:
+    """
+    Procesbrede toestand bovenop een storage. `current()` geeft de snapshot die
+    overeenkomt met de storage versie en herlaadt enkel als die veranderd is.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.reloads = 0
+        self._snapshot = None
+        self._shared = (None, 0, frozenset())  # (versie, bytes, id's) van de gemeten snapshot
+        self._lock = threading.Lock()
+        self._sessions = {}  # session id -> (laatste run, aantal runs, gemeten bytes in de session state)
+
+    def current(self):
+        """Huidige snapshot; één index lookup als er niets gewijzigd is."""
+        version = self.storage.state_version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = self._load(version)
+                self.reloads += 1
+            return self._snapshot
+
+    def _load(self, version):
+        blob = self.storage.load_startup_state(version)
+        if blob is not None:
+            config_history, employees, export_history, deadline_exceptions = decode_startup_state(blob)
+        else:
+            # Wijzigingen tijdens het laden krijgen een hogere versie: de volgende run herlaadt opnieuw
+            config_history = self.storage.load_config_history()
+            employees = self.storage.load_employees()
+            export_history = self.storage.load_export_history()
+            deadline_exceptions = self.storage.load_deadline_exceptions()
+            self.storage.save_startup_state(
+                version, encode_startup_state(config_history, employees, export_history, deadline_exceptions)
+            )
+        export_locks = ExportLocks(export_history)
+        return StateSnapshot(
+            version,
+            config_history,
+            employees,
+            EmployeeIndex(employees),
+            export_history,
+            export_locks,
+            deadline_exceptions,
+            RulesEngine(config_history, self.storage.rides, export_locks, deadline_exceptions),
+        )
+
+    # -------------------------------------------------------------------------
+    # Geheugenrapport
+    # -------------------------------------------------------------------------
+
+    def _shared_size(self):
+        """(bytes, id's) van de huidige snapshot, één keer gemeten per versie."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return 0, frozenset()
+        version, size, ids = self._shared
+        if version != snapshot.version:
+            # De ritten (storage) horen niet bij de snapshot: enkel een referentie
+            seen = {id(self.storage), id(self.storage.rides)}
+            size = deep_size(snapshot, seen)
+            ids = frozenset(seen)
+            self._shared = (snapshot.version, size, ids)
+        return size, ids
+
+    def track_session(self, session_id, session_state):
+        """
+        Registreert de run van een sessie; de grootte van haar eigen (niet gedeelde)
+        state wordt enkel om de SESSION_SAMPLE_RUNS runs opnieuw gemeten.
+        """
+        _, runs, own_bytes = self._sessions.get(session_id, (None, 0, 0))
+        if runs % SESSION_SAMPLE_RUNS == 0:
+            _, shared_ids = self._shared_size()
+            seen = set()
+            own_bytes = sum(deep_size(value, seen, shared_ids) for value in session_state.values())
+        self._sessions[session_id] = (time.monotonic(), runs + 1, own_bytes)
+
+    def memory_report(self):
+        """MemoryReport van de gedeelde snapshot en de recent actieve sessies."""
+        cutoff = time.monotonic() - SESSION_WINDOW
+        for session_id, (seen_at, _, _) in list(self._sessions.items()):
+            if seen_at < cutoff:
+                self._sessions.pop(session_id, None)
+        session_bytes = [own_bytes for _, _, own_bytes in self._sessions.values()]
+        shared, _ = self._shared_size()
+        return MemoryReport(
+            shared, len(session_bytes), sum(session_bytes), shared * max(len(session_bytes), 1), MEMORY_BUDGET
+        )
+
+
+if __name__ == "__main__":
+    from storage import DB_PATH, SqliteStorage
+
+    if sys.argv[1:] != ["precompute"]:
+        print("Gebruik: python shared_state.py precompute")
+        sys.exit(2)
+    storage = SqliteStorage(DB_PATH)
+    version = storage.state_version()
+    storage.save_startup_state(version, encode_startup_state(
+        storage.load_config_history(),
+        storage.load_employees(),
+        storage.load_export_history(),
+        storage.load_deadline_exceptions(),
+    ))
+    print(f"Startup snapshot voor state versie {version}")
+    storage.close()
@@ -0,0 +1,1342 @@
+import calendar
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import numpy as np
+
+import event_log
+from config_snapshots import ConfigHistory, make_snapshot
+from employees import DEFAULT_ENTITY
+from event_log import (
+    EVENT_CONFIG_CHANGED,
+    EVENT_EMPLOYEE_SAVED,
+    EVENT_EXCEPTION_GRANTED,
+    EVENT_EXCEPTION_REMOVED,
+    EVENT_RIDE_SUBMITTED,
+    EVENT_RIDES_ARCHIVED,
+    EVENT_RIDES_EXPORTED,
+    EVENT_RIDES_RECALCULATED,
+    Event,
+)
+from ride_archive import ARCHIVE_CHUNK, RideArchive, archive_dir_for, segment_name
+from ride_columns import RideColumns, day_number
+from ride_store import CHUNK_SIZE, DRIFT_TOLERANCE, ride_points
+from rules import MSG_EXPORTED
+
+# =============================================================================
+# PERSISTENTE STORAGE (SQLite in WAL mode)
+# =============================================================================
+# Eén lokaal SQLite bestand, gedeeld door alle Streamlit sessies van het proces.
+# WAL mode laat lezers nooit wachten op schrijvers. Schrijfacties voor ritten
+# gebruiken optimistische versiecontrole per medewerker in plaats van een
+# globale lock: twee medewerkers kunnen elkaar nooit blokkeren, twee gelijktijdige
+# ritten van dezelfde medewerker worden na elkaar opnieuw gevalideerd.
+#
+# Alle SQL staat als constante strings in deze module; sqlite3 houdt per
+# connectie een cache van gecompileerde (prepared) statements bij op basis van
+# de SQL tekst, zodat hot paths nooit opnieuw geparsed worden.
+
+DB_PATH = os.environ.get("FIETSVERGOEDING_DB", "fietsvergoeding.db")
+POOL_SIZE = 8
+MAX_SUBMIT_RETRIES = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS config_versions (
+    version INTEGER PRIMARY KEY,
+    effective_from TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    config TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS employees (
+    id INTEGER PRIMARY KEY,
+    account_key TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    country TEXT NOT NULL,
+    bike_type TEXT NOT NULL,
+    current_year_total REAL NOT NULL DEFAULT 0,
+    trajectories TEXT NOT NULL,
+    entity TEXT
+);
+
+CREATE TABLE IF NOT EXISTS rides (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT NOT NULL,
+    employee_id INTEGER NOT NULL,
+    employee_name TEXT NOT NULL,
+    trajectory TEXT NOT NULL,
+    ride_type TEXT,
+    distance NUMERIC NOT NULL,
+    amount REAL NOT NULL,
+    rate_applied REAL NOT NULL,
+    processed INTEGER NOT NULL DEFAULT 0,
+    export_batch_id INTEGER,
+    export_timestamp TEXT,
+    config_version INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_rides_employee_date ON rides (employee_id, date);
+CREATE INDEX IF NOT EXISTS idx_rides_date ON rides (date);
+CREATE INDEX IF NOT EXISTS idx_rides_unprocessed ON rides (employee_id) WHERE processed = 0;
+
+CREATE TABLE IF NOT EXISTS ride_month_totals (
+    employee_id INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (employee_id, year, month)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS ride_day_points (
+    employee_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    PRIMARY KEY (employee_id, date)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS ride_versions (
+    employee_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS export_history (
+    batch_id INTEGER PRIMARY KEY,
+    export_date TEXT NOT NULL,
+    period_start TEXT NOT NULL,
+    period_end TEXT NOT NULL,
+    ride_count INTEGER NOT NULL,
+    total_amount REAL NOT NULL,
+    last_seq INTEGER,
+    file_name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS deadline_exceptions (
+    employee_id INTEGER PRIMARY KEY,
+    expires TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    recorded_at TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    employee_id INTEGER,
+    ref INTEGER,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_employee ON events (employee_id, seq) WHERE employee_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_events_kind ON events (kind, seq) WHERE kind <> 'ride_submitted';
+
+CREATE TABLE IF NOT EXISTS event_snapshots (
+    event_seq INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    state BLOB NOT NULL
+);
+
+-- Register van de gearchiveerde ritten (zie ride_archive.py): één segmentbestand
+-- per (jaar, maand) per archiveringsronde (after_seq, upto_seq]
+CREATE TABLE IF NOT EXISTS ride_archive (
+    segment TEXT PRIMARY KEY,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    after_seq INTEGER NOT NULL,
+    upto_seq INTEGER NOT NULL,
+    ride_count INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ride_archive_month ON ride_archive (year, month);
+
+CREATE TABLE IF NOT EXISTS reminders_sent (
+    employee_id INTEGER NOT NULL,
+    period TEXT NOT NULL,
+    sent_at TEXT NOT NULL,
+    PRIMARY KEY (employee_id, period)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS startup_state (
+    version INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    state BLOB NOT NULL
+);
+"""
+
+_RIDE_COLUMNS = (
+    "date, employee_id, employee_name, trajectory, ride_type, distance, amount, "
+    "rate_applied, processed, export_batch_id, export_timestamp, config_version"
+)
+
+_SQL_INSERT_RIDE = (
+    f"INSERT INTO rides ({_RIDE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+_SQL_ADD_MONTH_TOTAL = (
+    "INSERT INTO ride_month_totals (employee_id, year, month, amount) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (employee_id, year, month) DO UPDATE SET amount = amount + excluded.amount"
+)
+_SQL_ADD_DAY_POINTS = (
+    "INSERT INTO ride_day_points (employee_id, date, points) VALUES (?, ?, ?) "
+    "ON CONFLICT (employee_id, date) DO UPDATE SET points = points + excluded.points"
+)
+_SQL_GET_VERSION = "SELECT version FROM ride_versions WHERE employee_id = ?"
+_SQL_BUMP_VERSION = (
+    "INSERT INTO ride_versions (employee_id, version) VALUES (?, 1) "
+    "ON CONFLICT (employee_id) DO UPDATE SET version = version + 1"
+)
+_SQL_BUMP_VERSION_IF = (
+    "INSERT INTO ride_versions (employee_id, version) VALUES (?, 1) "
+    "ON CONFLICT (employee_id) DO UPDATE SET version = version + 1 WHERE version = ?"
+)
+# Valt een datum in een geëxporteerde periode (zelfde regel als ExportLocks.is_locked)
+_SQL_DATE_EXPORTED = "SELECT 1 FROM export_history WHERE period_start <= ?1 AND period_end >= ?1 LIMIT 1"
+
+# Export watermark: alle ritten met seq <= de hoogste last_seq van de export
+# geschiedenis zijn verwerkt. Onverwerkte ritten zoeken begint dus na de
+# watermark (range op de primary key) in plaats van over de volledige historiek.
+_SQL_WATERMARK = "(SELECT COALESCE(MAX(last_seq), 0) FROM export_history)"
+_MAX_SEQ = 2 ** 63 - 1
+
+_SQL_BUMP_PENDING_VERSIONS = (
+    "UPDATE ride_versions SET version = version + 1 WHERE employee_id IN ("
+    f"SELECT DISTINCT employee_id FROM rides WHERE seq > {_SQL_WATERMARK} AND seq <= ? AND processed = 0)"
+)
+
+_SQL_ALL_RIDES = f"SELECT {_RIDE_COLUMNS} FROM rides ORDER BY seq"
+# Ritten in de tabel plus de gearchiveerde (zie ride_archive.py)
+_SQL_COUNT_RIDES = "SELECT (SELECT COUNT(*) FROM rides) + (SELECT COALESCE(SUM(ride_count), 0) FROM ride_archive)"
+_SQL_ANY_RIDE = "SELECT EXISTS (SELECT 1 FROM rides) OR EXISTS (SELECT 1 FROM ride_archive)"
+_SQL_EMPLOYEE_RIDES = f"SELECT {_RIDE_COLUMNS} FROM rides WHERE employee_id = ? ORDER BY seq"
+_SQL_EMPLOYEE_DAY_RIDES = (
+    f"SELECT {_RIDE_COLUMNS} FROM rides WHERE employee_id = ? AND date = ? ORDER BY seq"
+)
+_SQL_EMPLOYEE_PERIOD_RIDES = (
+    f"SELECT {_RIDE_COLUMNS} FROM rides WHERE employee_id = ? AND date >= ? AND date <= ? ORDER BY seq"
+)
+_SQL_EMPLOYEE_HISTORY = (
+    f"SELECT {_RIDE_COLUMNS} FROM rides WHERE employee_id = ? AND date >= ? AND date <= ? "
+    "ORDER BY date DESC, seq DESC LIMIT ? OFFSET ?"
+)
+_SQL_EMPLOYEE_HISTORY_SUMMARY = (
+    "SELECT COUNT(*), COALESCE(SUM(amount), 0.0) FROM rides WHERE employee_id = ? AND date >= ? AND date <= ?"
+)
+_SQL_PERIOD_RIDES = f"SELECT {_RIDE_COLUMNS} FROM rides WHERE date >= ? AND date <= ? ORDER BY seq"
+_SQL_EMPLOYEE_MONTHS = (
+    "SELECT year, month FROM ride_month_totals WHERE employee_id = ? ORDER BY year, month"
+)
+_SQL_MONTH_EMPLOYEES = "SELECT employee_id FROM ride_month_totals WHERE year = ? AND month = ?"
+_SQL_YEAR_TOTAL = (
+    "SELECT COALESCE(SUM(amount), 0.0) FROM ride_month_totals WHERE employee_id = ? AND year = ?"
+)
+_SQL_MONTH_TOTAL = (
+    "SELECT amount FROM ride_month_totals WHERE employee_id = ? AND year = ? AND month = ?"
+)
+_SQL_PERIOD_TOTAL = (
+    "SELECT COALESCE(SUM(amount), 0.0) FROM rides WHERE employee_id = ? AND date >= ? AND date <= ?"
+)
+_SQL_PENDING_TOTAL = (
+    "SELECT COALESCE(SUM(amount), 0.0) FROM rides WHERE employee_id = ? AND processed = 0"
+)
+_SQL_EMPLOYEE_UNPROCESSED_FROM = (
+    f"SELECT seq, {_RIDE_COLUMNS} FROM rides WHERE employee_id = ? AND processed = 0 AND date >= ? "
+    "ORDER BY date, seq"
+)
+_SQL_UPDATE_RIDE_AMOUNT = (
+    "UPDATE rides SET amount = ?, rate_applied = ?, config_version = ? WHERE seq = ? AND processed = 0"
+)
+_SQL_UNPROCESSED_RIDES = (
+    f"SELECT {_RIDE_COLUMNS} FROM rides WHERE seq > {_SQL_WATERMARK} AND seq <= ? AND processed = 0 ORDER BY seq"
+)
+_SQL_PENDING_SUMMARY = (
+    f"SELECT COUNT(*), COALESCE(SUM(amount), 0.0) FROM rides WHERE seq > {_SQL_WATERMARK} AND processed = 0"
+)
+# Laatst toegekende seq (AUTOINCREMENT), ook als de recentste ritten gearchiveerd zijn
+_SQL_LAST_SEQ = "SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'rides'), 0)"
+_SQL_PENDING_GROUPS = (
+    "SELECT employee_id, CAST(substr(date, 1, 4) AS INTEGER) AS year, CAST(substr(date, 6, 2) AS INTEGER) AS month, "
+    "COUNT(*), SUM(distance), SUM(amount), MIN(date), MAX(date) "
+    f"FROM rides WHERE seq > {_SQL_WATERMARK} AND seq <= ? AND processed = 0 "
+    "GROUP BY employee_id, year, month ORDER BY year, month, employee_id"
+)
+# Eén shard van een gepartitioneerde export (gelezen door een worker proces)
+_SQL_SHARD_RIDES = (
+    f"SELECT {_RIDE_COLUMNS} FROM rides WHERE seq > ? AND seq <= ? AND processed = 0 "
+    "AND employee_id IN (SELECT value FROM json_each(?)) AND date >= ? AND date <= ? ORDER BY seq"
+)
+_SQL_EXPORT_WATERMARK = f"SELECT {_SQL_WATERMARK}"
+_SQL_DAY_POINTS = "SELECT points FROM ride_day_points WHERE employee_id = ? AND date = ?"
+_SQL_MARK_PROCESSED = (
+    "UPDATE rides SET processed = 1, export_batch_id = ?, export_timestamp = ? "
+    f"WHERE seq > {_SQL_WATERMARK} AND seq <= ? AND processed = 0"
+)
+
+# Archief: partities (jaar, maand) tussen twee maanden, in de volgorde van de rondes
+_SQL_ARCHIVE_SEGMENTS = (
+    "SELECT segment FROM ride_archive WHERE (year, month) >= (?, ?) AND (year, month) <= (?, ?) "
+    "ORDER BY after_seq, year, month"
+)
+_SQL_ALL_ARCHIVE_SEGMENTS = "SELECT segment FROM ride_archive"
+# Volgende ronde: na het gearchiveerde bereik, tot vóór de eerste onverwerkte rit
+_SQL_ARCHIVE_RANGE = (
+    "SELECT (SELECT COALESCE(MAX(upto_seq), 0) FROM ride_archive), "
+    "COALESCE((SELECT MIN(seq) FROM rides WHERE processed = 0) - 1, "
+    "(SELECT seq FROM sqlite_sequence WHERE name = 'rides'), 0)"
+)
+_SQL_ARCHIVE_CANDIDATES = (
+    f"SELECT seq, {_RIDE_COLUMNS} FROM rides WHERE seq > ? AND seq <= ? AND processed = 1 "
+    "ORDER BY substr(date, 1, 7), employee_id, seq"
+)
+_SQL_PUT_ARCHIVE_SEGMENT = (
+    "INSERT INTO ride_archive (segment, year, month, after_seq, upto_seq, ride_count, amount, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+_SQL_DELETE_ARCHIVED = "DELETE FROM rides WHERE seq > ? AND seq <= ? AND processed = 1"
+_SQL_ARCHIVE_STATUS = (
+    "SELECT year, month, COUNT(*), SUM(ride_count), SUM(amount) FROM ride_archive GROUP BY year, month ORDER BY year, month"
+)
+
+_SQL_REBUILD_MONTH_TOTALS = (
+    "SELECT employee_id, CAST(substr(date, 1, 4) AS INTEGER), CAST(substr(date, 6, 2) AS INTEGER), "
+    "SUM(amount) FROM rides GROUP BY 1, 2, 3"
+)
+_SQL_REBUILD_DAY_POINTS = (
+    "SELECT employee_id, date, SUM(CASE WHEN ride_type = 'Heen-en-Terug' THEN 2 ELSE 1 END) "
+    "FROM rides GROUP BY 1, 2"
+)
+
+_SQL_GET_CONFIG_VERSIONS = "SELECT version, effective_from, config FROM config_versions ORDER BY version"
+_SQL_PUT_CONFIG_VERSION = (
+    "INSERT INTO config_versions (version, effective_from, created_at, config) "
+    "SELECT COALESCE(MAX(version), 0) + 1, ?, ?, ? FROM config_versions RETURNING version"
+)
+# Migratie van bestaande databases naar het huidige schema
+_SQL_RIDE_TABLE_INFO = "PRAGMA table_info(rides)"
+_SQL_ADD_RIDE_CONFIG_VERSION = "ALTER TABLE rides ADD COLUMN config_version INTEGER"
+_SQL_EXPORT_TABLE_INFO = "PRAGMA table_info(export_history)"
+_SQL_EMPLOYEE_TABLE_INFO = "PRAGMA table_info(employees)"
+_SQL_ADD_EMPLOYEE_ENTITY = "ALTER TABLE employees ADD COLUMN entity TEXT"
+_SQL_ADD_EXPORT_COLUMNS = (
+    "ALTER TABLE export_history ADD COLUMN last_seq INTEGER",
+    "ALTER TABLE export_history ADD COLUMN file_name TEXT",
+)
+_SQL_GET_EMPLOYEES = (
+    "SELECT account_key, id, name, country, bike_type, current_year_total, trajectories, entity "
+    "FROM employees ORDER BY rowid"
+)
+_SQL_PUT_EMPLOYEE = (
+    "INSERT INTO employees (id, account_key, name, country, bike_type, current_year_total, trajectories, entity) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+    "account_key = excluded.account_key, name = excluded.name, country = excluded.country, "
+    "bike_type = excluded.bike_type, current_year_total = excluded.current_year_total, "
+    "trajectories = excluded.trajectories, entity = excluded.entity"
+)
+_SQL_GET_EXPORTS = (
+    "SELECT batch_id, export_date, period_start, period_end, ride_count, total_amount, last_seq, file_name "
+    "FROM export_history ORDER BY batch_id"
+)
+_SQL_NEXT_BATCH_ID = "SELECT COALESCE(MAX(batch_id), 0) + 1 FROM export_history"
+_SQL_PUT_EXPORT = (
+    "INSERT INTO export_history "
+    "(batch_id, export_date, period_start, period_end, ride_count, total_amount, last_seq, file_name) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+_SQL_GET_EXCEPTIONS = "SELECT employee_id, expires FROM deadline_exceptions"
+_SQL_PUT_EXCEPTION = (
+    "INSERT INTO deadline_exceptions (employee_id, expires) VALUES (?, ?) "
+    "ON CONFLICT (employee_id) DO UPDATE SET expires = excluded.expires"
+)
+_SQL_DELETE_EXCEPTION = "DELETE FROM deadline_exceptions WHERE employee_id = ? RETURNING expires"
+# Enkel als de uitzondering intussen niet verlengd werd (vervallen via de scheduler)
+_SQL_DELETE_EXCEPTION_IF = (
+    "DELETE FROM deadline_exceptions WHERE employee_id = ? AND expires = ? RETURNING expires"
+)
+_SQL_CLAIM_REMINDER = "INSERT OR IGNORE INTO reminders_sent (employee_id, period, sent_at) VALUES (?, ?, ?)"
+
+# Event log (zie event_log.py): append-only, nooit UPDATE of DELETE
+_EVENT_COLUMNS = "seq, recorded_at, kind, employee_id, ref, payload"
+_SQL_APPEND_EVENT = "INSERT INTO events (recorded_at, kind, employee_id, ref, payload) VALUES (?, ?, ?, ?, ?)"
+_SQL_LAST_EVENT_SEQ = "SELECT COALESCE(MAX(seq), 0) FROM events"
+# Versie van config, master data, exports en uitzonderingen: elk event behalve een
+# ingediende rit. INDEXED BY: enkel de partiële index, niet de PK terug scannen.
+_SQL_STATE_VERSION = (
+    "SELECT COALESCE(MAX(seq), 0) FROM events INDEXED BY idx_events_kind WHERE kind <> 'ride_submitted'"
+)
+_SQL_EVENT_SEQ_AT = "SELECT COALESCE(MAX(seq), 0) FROM events WHERE recorded_at <= ?"
+# Wijzigingen aan onverwerkte ritten buiten nieuwe indieningen (zie run_export)
+_SQL_PENDING_RIDES_CHANGED = (
+    f"SELECT EXISTS (SELECT 1 FROM events WHERE kind IN ('{EVENT_RIDES_EXPORTED}', '{EVENT_RIDES_RECALCULATED}') "
+    f"AND kind <> '{EVENT_RIDE_SUBMITTED}' AND seq > ?)"
+)
+_SQL_EVENTS_RANGE = f"SELECT {_EVENT_COLUMNS} FROM events WHERE seq > ? AND seq <= ? ORDER BY seq"
+_SQL_EMPLOYEE_EVENTS = (
+    f"SELECT {_EVENT_COLUMNS} FROM events WHERE employee_id = ? AND seq > ? AND seq <= ? "
+    "AND (? IS NULL OR kind = ?) ORDER BY seq DESC LIMIT ?"
+)
+# Ritten zijn de overgrote meerderheid van de events en zitten niet in de (partiële)
+# index op kind: die worden van achter naar voor op de primary key gezocht
+_SQL_KIND_EVENTS = (
+    f"SELECT {_EVENT_COLUMNS} FROM events WHERE kind = ? AND kind <> '{EVENT_RIDE_SUBMITTED}' "
+    "AND seq > ? AND seq <= ? ORDER BY seq DESC LIMIT ?"
+)
+_SQL_RIDE_EVENTS = (
+    f"SELECT {_EVENT_COLUMNS} FROM events WHERE kind = '{EVENT_RIDE_SUBMITTED}' "
+    "AND seq > ? AND seq <= ? ORDER BY seq DESC LIMIT ?"
+)
+_SQL_RECENT_EVENTS = f"SELECT {_EVENT_COLUMNS} FROM events WHERE seq > ? AND seq <= ? ORDER BY seq DESC LIMIT ?"
+_SQL_LATEST_SNAPSHOT = (
+    "SELECT event_seq, state FROM event_snapshots WHERE event_seq <= ? ORDER BY event_seq DESC LIMIT 1"
+)
+_SQL_PUT_SNAPSHOT = (
+    "INSERT INTO event_snapshots (event_seq, created_at, state) VALUES (?, ?, ?) "
+    "ON CONFLICT (event_seq) DO NOTHING"
+)
+# De oudste snapshot blijft altijd: bij een database van vóór de event log is dat
+# de basis waarop de eerste events volgen
+_SQL_PRUNE_SNAPSHOTS = (
+    "DELETE FROM event_snapshots WHERE event_seq > (SELECT MIN(event_seq) FROM event_snapshots) "
+    "AND event_seq NOT IN (SELECT event_seq FROM event_snapshots ORDER BY event_seq DESC LIMIT ?)"
+)
+# Eén voorberekende startup snapshot (zie shared_state.py), enkel voor de huidige state versie
+_SQL_GET_STARTUP_STATE = "SELECT state FROM startup_state WHERE version = ?"
+_SQL_PUT_STARTUP_STATE = "INSERT OR REPLACE INTO startup_state (version, created_at, state) VALUES (?, ?, ?)"
+_SQL_PRUNE_STARTUP_STATE = "DELETE FROM startup_state WHERE version <> ?"
+_SQL_EVENT_LOG_EMPTY = (
+    "SELECT NOT EXISTS (SELECT 1 FROM events) AND NOT EXISTS (SELECT 1 FROM event_snapshots) "
+    "AND (EXISTS (SELECT 1 FROM rides) OR EXISTS (SELECT 1 FROM config_versions))"
+)
+
+
+def _ride_params(ride):
+    export_timestamp = ride.get("export_timestamp")
+    return (
+        ride["date"].isoformat(),
+        ride["employee_id"],
+        ride["employee_name"],
+        ride["trajectory"],
+        ride.get("ride_type"),
+        ride["distance"],
+        ride["amount"],
+        ride["rate_applied"],
+        int(bool(ride.get("processed", False))),
+        ride.get("export_batch_id"),
+        export_timestamp.isoformat() if export_timestamp else None,
+        ride.get("config_version"),
+    )
+
+
+def _row_to_ride(row):
+    ride = {
+        "date": date.fromisoformat(row[0]),
+        "employee_id": row[1],
+        "employee_name": row[2],
+        "trajectory": row[3],
+        "ride_type": row[4],
+        "distance": row[5],
+        "amount": row[6],
+        "rate_applied": row[7],
+        "processed": bool(row[8]),
+        "config_version": row[11],
+    }
+    if row[9] is not None:
+        ride["export_batch_id"] = row[9]
+        ride["export_timestamp"] = datetime.fromisoformat(row[10])
+    return ride
+
+
+def _export_params(entry):
+    return (
+        entry["batch_id"],
+        entry["export_date"].isoformat(),
+        entry["period_start"].isoformat(),
+        entry["period_end"].isoformat(),
+        entry["ride_count"],
+        entry["total_amount"],
+        entry.get("last_seq"),
+        entry.get("file_name"),
+    )
+
+
+def _row_to_export(row):
+    return {
+        "batch_id": row[0],
+        "export_date": datetime.fromisoformat(row[1]),
+        "period_start": date.fromisoformat(row[2]),
+        "period_end": date.fromisoformat(row[3]),
+        "ride_count": row[4],
+        "total_amount": row[5],
+        "last_seq": row[6],
+        "file_name": row[7],
+    }
+
+
+def _employee_params(employee):
+    return (
+        employee["id"],
+        employee["name"],
+        employee["country"],
+        employee["bike_type"],
+        employee.get("current_year_total", 0.0),
+        json.dumps(employee["trajectories"]),
+        employee.get("entity") or DEFAULT_ENTITY,
+    )
+
+
+def _row_to_employee(row):
+    return {
+        "id": row[0],
+        "name": row[1],
+        "country": row[2],
+        "bike_type": row[3],
+        "current_year_total": row[4],
+        "trajectories": json.loads(row[5]),
+        "entity": row[6] or DEFAULT_ENTITY,
+    }
+
+
+def _event_row(kind, employee_id, ref, payload):
+    """Parameters van _SQL_APPEND_EVENT (payload als compacte JSON)."""
+    return (datetime.now().isoformat(), kind, employee_id, ref, json.dumps(payload, separators=(",", ":")))
+
+
+def _row_to_event(row):
+    """Event met gedecodeerde payload (zelfde vorm als de live tabellen teruggeven)."""
+    seq, recorded_at, kind, employee_id, ref, payload = row
+    payload = json.loads(payload)
+    if kind == EVENT_RIDE_SUBMITTED:
+        payload = _row_to_ride(payload)
+    elif kind == EVENT_RIDES_EXPORTED:
+        payload = _row_to_export(payload)
+    elif kind == EVENT_RIDES_RECALCULATED:
+        payload = [
+            (ride_seq, emp_id, date.fromisoformat(ride_date), old_amount, new_amount, rate, config_version)
+            for ride_seq, emp_id, ride_date, old_amount, new_amount, rate, config_version in payload
+        ]
+    elif kind == EVENT_CONFIG_CHANGED:
+        payload = make_snapshot(ref, date.fromisoformat(payload[0]), payload[1])
+    elif kind == EVENT_EMPLOYEE_SAVED:
+        payload = (payload[0], _row_to_employee(payload[1:]))
+    elif kind in (EVENT_EXCEPTION_GRANTED, EVENT_EXCEPTION_REMOVED):
+        payload = date.fromisoformat(payload) if payload else None
+    return Event(seq, datetime.fromisoformat(recorded_at), kind, employee_id, ref, payload)
+
+
+def _month_bounds(year, month):
+    """Eerste en laatste dag van een maand als ISO strings."""
+    last_day = calendar.monthrange(year, month)[1]
+    return date(year, month, 1).isoformat(), date(year, month, last_day).isoformat()
+
+
+def _history_bounds(year, month):
+    """ISO datumgrenzen voor de historiek: één maand, of alles."""
+    if year is None:
+        return date.min.isoformat(), date.max.isoformat()
+    return _month_bounds(year, month)
+
+
+def _history_days(year, month):
+    """Datumgrenzen voor de historiek in het archief: één maand, of alles (None, None)."""
+    if year is None:
+        return None, None
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _merge_history(rides, archived, offset, limit):
+    """
+    Eén historiek-pagina (nieuwste eerst) uit de ritten van de tabel (al in die
+    volgorde) en een ArchiveSelection. Bij gelijke datum komt een rit uit de tabel
+    eerst: die heeft altijd een hogere seq dan een gearchiveerde rit.
+    """
+    days = np.concatenate([
+        np.array([day_number(ride["date"]) for ride in rides], dtype=np.int64),
+        archived.column("day").astype(np.int64),
+    ])
+    ranks = np.concatenate([_MAX_SEQ - np.arange(len(rides), dtype=np.int64), archived.column("seq")])
+    page = np.lexsort((-ranks, -days))[offset:None if limit is None else offset + limit]
+    archived_rides = iter(archived.rides(page[page >= len(rides)] - len(rides)))
+    return [rides[position] if position < len(rides) else next(archived_rides) for position in page.tolist()]
+
+
+class ConnectionPool:
+    """
+    Begrensde pool van SQLite connecties (WAL mode), veilig te delen tussen threads.
+    Binnen transaction() wordt de connectie aan de huidige thread gebonden, zodat
+    ook leesacties in die thread dezelfde transactie zien.
+    """
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=30.0,
+            isolation_level=None,  # expliciete BEGIN/COMMIT
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA busy_timeout = 30000")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        bound = getattr(self._local, "conn", None)
+        if bound is not None:
+            yield bound
+            return
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            finally:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Schrijftransactie (BEGIN IMMEDIATE: neemt direct de schrijfrechten, zodat
+        er geen lock-upgrade conflicten ontstaan). Lezers blijven doorwerken dankzij WAL.
+        """
+        if getattr(self._local, "conn", None) is not None:
+            yield self._local.conn
+            return
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._local.conn = conn
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+            finally:
+                self._local.conn = None
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Leestransactie (BEGIN zonder schrijfrechten) gebonden aan de huidige thread:
+        alle leesacties in die thread zien dezelfde snapshot, terwijl andere
+        connecties blijven schrijven (WAL). Niet schrijven binnen een snapshot.
+        """
+        if getattr(self._local, "conn", None) is not None:
+            yield self._local.conn
+            return
+        with self.connection() as conn:
+            conn.execute("BEGIN")
+            self._local.conn = conn
+            try:
+                yield conn
+            finally:
+                self._local.conn = None
+                conn.execute("COMMIT")
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class SqliteRideStore:
+    """
+    RideStore implementatie bovenop SQLite, met dezelfde interface als
+    ride_store.RideStore. Lookups gaan via de index op (employee_id, date);
+    maandtotalen en rit-punten per dag zitten in aparte aggregaat-tabellen die
+    in dezelfde transactie als de rit worden bijgewerkt.
+
+    Geëxporteerde ritten verhuizen met archive_exported() naar het archief
+    (`archive`, zie ride_archive.py). Opvragingen over alle ritten voegen de
+    tabel en de gearchiveerde partities samen; de aggregaat-tabellen blijven
+    ongewijzigd, zodat jaar- en maandtotalen (BE limiet) het archief meetellen.
+    """
+
+    def __init__(self, pool, archive):
+        self._pool = pool
+        self.archive = archive
+
+    def _query(self, sql, params=()):
+        with self._pool.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def _scalar(self, sql, params=(), default=None):
+        with self._pool.connection() as conn:
+            row = conn.execute(sql, params).fetchone()
+        return row[0] if row is not None else default
+
+    @contextmanager
+    def _reading(self):
+        """
+        Connectie met één leestransactie: het archiefregister en de rides tabel
+        worden op hetzelfde moment gelezen, zodat een gelijktijdige archiveringsronde
+        geen ritten laat verdwijnen of dubbel laat tellen.
+        """
+        with self._pool.connection() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            finally:
+                conn.execute("COMMIT")
+
+    def _archived(self, conn, employee_id=None, first_day=None, last_day=None):
+        """ArchiveSelection van de gearchiveerde ritten, enkel uit de partities tussen first_day en last_day."""
+        first, last = first_day or date.min, last_day or date.max
+        names = [row[0] for row in conn.execute(_SQL_ARCHIVE_SEGMENTS, (first.year, first.month, last.year, last.month))]
+        return self.archive.select(names, employee_id, first_day, last_day)
+
+    def _insert(self, conn, ride):
+        params = _ride_params(ride)
+        seq = conn.execute(_SQL_INSERT_RIDE, params).lastrowid
+        conn.execute(_SQL_APPEND_EVENT, _event_row(EVENT_RIDE_SUBMITTED, ride["employee_id"], seq, params))
+        conn.execute(
+            _SQL_ADD_MONTH_TOTAL,
+            (ride["employee_id"], ride["date"].year, ride["date"].month, ride["amount"]),
+        )
+        conn.execute(
+            _SQL_ADD_DAY_POINTS,
+            (ride["employee_id"], ride["date"].isoformat(), ride_points(ride.get("ride_type"))),
+        )
+
+    def append(self, ride):
+        """Voegt een rit toe zonder validatie (bv. migratie) en verhoogt de versie van de medewerker."""
+        with self._pool.transaction() as conn:
+            conn.execute(_SQL_BUMP_VERSION, (ride["employee_id"],))
+            self._insert(conn, ride)
+
+    def append_many(self, rides):
+        """
+        Voegt een reeks (al gevalideerde) ritten toe in één transactie, met executemany.
+        Verhoogt de versie van elke betrokken medewerker, zodat een gelijktijdige
+        submit_ride van diezelfde medewerker opnieuw valideert.
+        """
+        if not rides:
+            return
+        params = [_ride_params(ride) for ride in rides]
+        with self._pool.transaction() as conn:
+            conn.executemany(_SQL_BUMP_VERSION, [(emp_id,) for emp_id in {ride["employee_id"] for ride in rides}])
+            first_seq = conn.execute(_SQL_LAST_SEQ).fetchone()[0] + 1
+            conn.executemany(_SQL_INSERT_RIDE, params)
+            conn.executemany(_SQL_APPEND_EVENT, [
+                _event_row(EVENT_RIDE_SUBMITTED, ride_params[1], seq, ride_params)
+                for seq, ride_params in enumerate(params, first_seq)
+            ])
+            conn.executemany(_SQL_ADD_MONTH_TOTAL, [
+                (ride["employee_id"], ride["date"].year, ride["date"].month, ride["amount"]) for ride in rides
+            ])
+            conn.executemany(_SQL_ADD_DAY_POINTS, [
+                (ride["employee_id"], ride["date"].isoformat(), ride_points(ride.get("ride_type"))) for ride in rides
+            ])
+
+    def submit_ride(self, employee_id, validate, make_ride):
+        """
+        Valideert en bewaart een rit met optimistische versiecontrole per medewerker.
+        validate() draait buiten een transactie; de rit wordt enkel bewaard als
+        sindsdien geen andere rit van dezelfde medewerker werd vastgelegd, anders
+        wordt opnieuw gevalideerd met de verse totalen (BE limiet, rit-punten).
+        Een export raakt die versie niet voor medewerkers zonder openstaande ritten,
+        dus de export lock van de ritdatum wordt in de schrijftransactie opnieuw
+        gecontroleerd: een intussen geëxporteerde periode weigert de rit.
+        """
+        for _ in range(MAX_SUBMIT_RETRIES):
+            version = self._scalar(_SQL_GET_VERSION, (employee_id,), default=0)
+            is_valid, msgs, amount = validate()
+            if not is_valid:
+                return is_valid, msgs, amount
+            ride = make_ride(amount)
+            with self._pool.transaction() as conn:
+                if conn.execute(_SQL_DATE_EXPORTED, (ride["date"].isoformat(),)).fetchone():
+                    return False, [MSG_EXPORTED], 0.0
+                if conn.execute(_SQL_BUMP_VERSION_IF, (employee_id, version)).rowcount == 1:
+                    self._insert(conn, ride)
+                    return is_valid, msgs, amount
+        return False, ["❌ Je rit kon niet worden opgeslagen door gelijktijdige wijzigingen. Probeer opnieuw."], 0.0
+
+    def __iter__(self):
+        with self._reading() as conn:
+            archived = self._archived(conn)
+            rides = [_row_to_ride(row) for row in conn.execute(_SQL_ALL_RIDES)]
+        return iter(archived.rides_by_seq() + rides)
+
+    def __len__(self):
+        return self._scalar(_SQL_COUNT_RIDES)
+
+    def __bool__(self):
+        return bool(self._scalar(_SQL_ANY_RIDE))
+
+    # -------------------------------------------------------------------------
+    # Index lookups
+    # -------------------------------------------------------------------------
+
+    def for_employee(self, employee_id):
+        with self._reading() as conn:
+            archived = self._archived(conn, employee_id)
+            rides = [_row_to_ride(row) for row in conn.execute(_SQL_EMPLOYEE_RIDES, (employee_id,))]
+        return archived.rides_by_seq() + rides
+
+    def for_employee_on(self, employee_id, day):
+        with self._reading() as conn:
+            archived = self._archived(conn, employee_id, day, day)
+            rides = [_row_to_ride(row) for row in conn.execute(_SQL_EMPLOYEE_DAY_RIDES, (employee_id, day.isoformat()))]
+        return archived.rides_by_seq() + rides
+
+    def for_month(self, year, month):
+        first_day, last_day = _history_days(year, month)
+        with self._reading() as conn:
+            archived = self._archived(conn, None, first_day, last_day)
+            rides = [_row_to_ride(row) for row in conn.execute(_SQL_PERIOD_RIDES, _month_bounds(year, month))]
+        return archived.rides_by_seq() + rides
+
+    def for_employee_month(self, employee_id, year, month):
+        first_day, last_day = _history_days(year, month)
+        with self._reading() as conn:
+            archived = self._archived(conn, employee_id, first_day, last_day)
+            rides = [
+                _row_to_ride(row)
+                for row in conn.execute(_SQL_EMPLOYEE_PERIOD_RIDES, (employee_id, *_month_bounds(year, month)))
+            ]
+        return archived.rides_by_seq() + rides
+
+    def iter_unprocessed(self, chunk_size=CHUNK_SIZE, upto=None):
+        """
+        Streamt de onverwerkte ritten (na de export watermark, tot en met seq `upto`)
+        met fetchmany, zonder alles in geheugen te laden.
+        """
+        with self._pool.connection() as conn:
+            cursor = conn.execute(_SQL_UNPROCESSED_RIDES, (_MAX_SEQ if upto is None else upto,))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [_row_to_ride(row) for row in rows]
+
+    def months_for_employee(self, employee_id):
+        return [(row[0], row[1]) for row in self._query(_SQL_EMPLOYEE_MONTHS, (employee_id,))]
+
+    def employees_with_rides(self, year, month):
+        return {row[0] for row in self._query(_SQL_MONTH_EMPLOYEES, (year, month))}
+
+    def unprocessed_for_employee(self, employee_id, start_date=None):
+        """(seq, rit) van de onverwerkte ritten van één medewerker vanaf start_date, op datum."""
+        params = (employee_id, (start_date or date.min).isoformat())
+        return [(row[0], _row_to_ride(row[1:])) for row in self._query(_SQL_EMPLOYEE_UNPROCESSED_FROM, params)]
+
+    def history(self, employee_id, year=None, month=None, offset=0, limit=None):
+        """
+        Eén pagina historiek via de index op (employee_id, date), nieuwste eerst.
+        Heeft de medewerker gearchiveerde ritten in de periode, dan komen de eerste
+        offset + limit ritten uit de tabel en worden ze samengevoegd met het archief.
+        """
+        bounds = _history_bounds(year, month)
+        with self._reading() as conn:
+            archived = self._archived(conn, employee_id, *_history_days(year, month))
+            if not len(archived):
+                params = (employee_id, *bounds, -1 if limit is None else limit, offset)
+                return [_row_to_ride(row) for row in conn.execute(_SQL_EMPLOYEE_HISTORY, params)]
+            params = (employee_id, *bounds, -1 if limit is None else offset + limit, 0)
+            rides = [_row_to_ride(row) for row in conn.execute(_SQL_EMPLOYEE_HISTORY, params)]
+        return _merge_history(rides, archived, offset, limit)
+
+    def history_summary(self, employee_id, year=None, month=None):
+        with self._reading() as conn:
+            archived = self._archived(conn, employee_id, *_history_days(year, month))
+            count, total = conn.execute(
+                _SQL_EMPLOYEE_HISTORY_SUMMARY, (employee_id, *_history_bounds(year, month))
+            ).fetchone()
+        if len(archived):
+            count, total = count + len(archived), total + float(archived.column("amount").sum())
+        return count, total
+
+    def version(self, employee_id):
+        return self._scalar(_SQL_GET_VERSION, (employee_id,), default=0)
+
+    # -------------------------------------------------------------------------
+    # Afgeleide waarden
+    # -------------------------------------------------------------------------
+
+    def year_total(self, employee_id, year):
+        return self._scalar(_SQL_YEAR_TOTAL, (employee_id, year), default=0.0)
+
+    def month_total(self, employee_id, year, month):
+        return self._scalar(_SQL_MONTH_TOTAL, (employee_id, year, month), default=0.0)
+
+    def pending_total(self, employee_id):
+        return self._scalar(_SQL_PENDING_TOTAL, (employee_id,), default=0.0)
+
+    def pending_summary(self):
+        with self._pool.connection() as conn:
+            count, total = conn.execute(_SQL_PENDING_SUMMARY).fetchone()
+        return count, total
+
+    def period_total(self, employee_id, start_date, end_date):
+        if start_date.day == 1 and end_date.year == start_date.year:
+            if start_date.month == 1 and end_date == date(end_date.year, 12, 31):
+                return self.year_total(employee_id, start_date.year)
+            if (start_date.isoformat(), end_date.isoformat()) == _month_bounds(start_date.year, start_date.month):
+                return self.month_total(employee_id, start_date.year, start_date.month)
+        with self._reading() as conn:
+            archived = self._archived(conn, employee_id, start_date, end_date)
+            total = conn.execute(_SQL_PERIOD_TOTAL, (employee_id, start_date.isoformat(), end_date.isoformat())).fetchone()[0]
+        return total + float(archived.column("amount").sum()) if len(archived) else total
+
+    def day_points(self, employee_id, day):
+        return self._scalar(_SQL_DAY_POINTS, (employee_id, day.isoformat()), default=0)
+
+    def last_seq(self):
+        """Hoogste rit seq; de bovengrens van een export batch."""
+        return self._scalar(_SQL_LAST_SEQ)
+
+    def export_watermark(self):
+        """Hoogste seq die in een export batch zat (0 zonder exports met watermark)."""
+        return self._scalar(_SQL_EXPORT_WATERMARK)
+
+    def pending_groups(self, upto=None):
+        """
+        Totalen per (employee_id, jaar, maand) van de onverwerkte ritten na de watermark
+        (tot en met seq `upto`), gesorteerd op maand en medewerker: tuples
+        (employee_id, jaar, maand, aantal, km, bedrag, eerste datum, laatste datum).
+        De planning van een gepartitioneerde export en de maandsamenvatting.
+        """
+        return [
+            (emp_id, year, month, count, distance, amount, date.fromisoformat(first), date.fromisoformat(last))
+            for emp_id, year, month, count, distance, amount, first, last
+            in self._query(_SQL_PENDING_GROUPS, (_MAX_SEQ if upto is None else upto,))
+        ]
+
+    def mark_processed(self, batch_id, export_timestamp, upto=None):
+        """
+        Markeert de onverwerkte ritten na de watermark (tot en met seq `upto`) als
+        geëxporteerd. Geeft het aantal gemarkeerde ritten terug. De watermark schuift
+        op met de export geschiedenis (append_export met last_seq).
+        """
+        upto = _MAX_SEQ if upto is None else upto
+        with self._pool.transaction() as conn:
+            conn.execute(_SQL_BUMP_PENDING_VERSIONS, (upto,))  # status in de historiek wijzigt
+            return conn.execute(_SQL_MARK_PROCESSED, (batch_id, export_timestamp.isoformat(), upto)).rowcount
+
+    def apply_recalculation(self, updates, expected_versions):
+        """
+        Past herberekende bedragen toe in één transactie, met dezelfde optimistische
+        versiecontrole als submit_ride: als een medewerker sinds de planning een rit
+        kreeg (of geëxporteerd werd), wordt niets gewijzigd en is het resultaat False.
+        """
+        with self._pool.transaction() as conn:
+            for emp_id, version in expected_versions.items():
+                row = conn.execute(_SQL_GET_VERSION, (emp_id,)).fetchone()
+                if (row[0] if row is not None else 0) != version:
+                    return False
+            conn.executemany(_SQL_UPDATE_RIDE_AMOUNT, [
+                (new_amount, rate, config_version, ride_id)
+                for ride_id, _, _, _, new_amount, rate, config_version in updates
+            ])
+            conn.executemany(_SQL_ADD_MONTH_TOTAL, [
+                (emp_id, ride_date.year, ride_date.month, new_amount - old_amount)
+                for _, emp_id, ride_date, old_amount, new_amount, _, _ in updates
+            ])
+            conn.executemany(_SQL_BUMP_VERSION, [(emp_id,) for emp_id in {update[1] for update in updates}])
+            conn.execute(_SQL_APPEND_EVENT, _event_row(EVENT_RIDES_RECALCULATED, None, None, [
+                (ride_id, emp_id, ride_date.isoformat(), old_amount, new_amount, rate, config_version)
+                for ride_id, emp_id, ride_date, old_amount, new_amount, rate, config_version in updates
+            ]))
+        return True
+
+    def check_consistency(self, repair=False):
+        """
+        Vergelijkt de aggregaat-tabellen met een herberekening uit de ritten-tabel
+        en het archief. Geeft drift-records (aggregaat, sleutel, bijgehouden, verwacht) terug.
+        """
+        with self._pool.transaction() as conn:
+            stored_months = {(r[0], r[1], r[2]): r[3] for r in conn.execute(
+                "SELECT employee_id, year, month, amount FROM ride_month_totals")}
+            stored_points = {(r[0], r[1]): r[2] for r in conn.execute(
+                "SELECT employee_id, date, points FROM ride_day_points")}
+            expected_months, expected_points = self.archive.aggregates(
+                [row[0] for row in conn.execute(_SQL_ALL_ARCHIVE_SEGMENTS)]
+            )
+            for r in conn.execute(_SQL_REBUILD_MONTH_TOTALS):
+                expected_months[(r[0], r[1], r[2])] = expected_months.get((r[0], r[1], r[2]), 0.0) + r[3]
+            for r in conn.execute(_SQL_REBUILD_DAY_POINTS):
+                expected_points[(r[0], r[1])] = expected_points.get((r[0], r[1]), 0) + r[2]
+
+            drift = []
+            for name, stored_values, expected_values in (
+                ("month", stored_months, expected_months),
+                ("day_points", stored_points, expected_points),
+            ):
+                for key in set(stored_values) | set(expected_values):
+                    stored = stored_values.get(key, 0)
+                    expected = expected_values.get(key, 0)
+                    if abs(stored - expected) > DRIFT_TOLERANCE:
+                        drift.append((name, key, stored, expected))
+
+            if repair and drift:
+                conn.execute("DELETE FROM ride_month_totals")
+                conn.executemany(_SQL_ADD_MONTH_TOTAL, [k + (v,) for k, v in expected_months.items()])
+                conn.execute("DELETE FROM ride_day_points")
+                conn.executemany(_SQL_ADD_DAY_POINTS, [k + (v,) for k, v in expected_points.items()])
+        return drift
+
+    # -------------------------------------------------------------------------
+    # Archief (koude opslag, zie ride_archive.py)
+    # -------------------------------------------------------------------------
+
+    def archive_exported(self, chunk=ARCHIVE_CHUNK):
+        """
+        Verplaatst de geëxporteerde ritten naar het archief: alle ritten na het al
+        gearchiveerde bereik tot vóór de eerste onverwerkte rit, in rondes van
+        hoogstens `chunk` seqs. Elke ronde is één schrijftransactie: segmenten per
+        (jaar, maand) schrijven, registreren en de ritten uit de tabel verwijderen.
+        Zo heeft een gearchiveerde rit altijd een lagere seq dan elke rit in de tabel.
+        De aggregaat-tabellen en versies blijven ongewijzigd. Geeft het aantal
+        gearchiveerde ritten terug.
+        """
+        archived = 0
+        first_round = True
+        while True:
+            with self._pool.transaction() as conn:
+                if first_round:  # restanten van een onderbroken ronde (onder de schrijflock)
+                    self.archive.discard_unregistered({row[0] for row in conn.execute(_SQL_ALL_ARCHIVE_SEGMENTS)})
+                    first_round = False
+                after_seq, upto_seq = conn.execute(_SQL_ARCHIVE_RANGE).fetchone()
+                upto_seq = min(upto_seq, after_seq + chunk)
+                if upto_seq <= after_seq:
+                    return archived
+                segments = self._write_segments(conn, after_seq, upto_seq)
+                ride_count = sum(segment[5] for segment in segments)
+                if conn.execute(_SQL_DELETE_ARCHIVED, (after_seq, upto_seq)).rowcount != ride_count:
+                    raise RuntimeError(f"Archivering ({after_seq}, {upto_seq}]: ritten gewijzigd tijdens het schrijven")
+                conn.executemany(_SQL_PUT_ARCHIVE_SEGMENT, segments)
+                conn.execute(_SQL_APPEND_EVENT, _event_row(EVENT_RIDES_ARCHIVED, None, upto_seq, {
+                    "after_seq": after_seq,
+                    "ride_count": ride_count,
+                    "segments": [segment[0] for segment in segments],
+                }))
+            archived += ride_count
+
+    def _write_segments(self, conn, after_seq, upto_seq):
+        """
+        Schrijft de ritten van ronde (after_seq, upto_seq] als één segment per
+        (jaar, maand), gestreamd in maandvolgorde. Geeft de register-rijen terug.
+        """
+        created_at = datetime.now().isoformat()
+        segments = []
+
+        def flush(month_key, columns, seqs):
+            name = segment_name(*month_key, after_seq, upto_seq)
+            header = self.archive.write(name, columns, seqs)
+            segments.append((name, *month_key, after_seq, upto_seq, len(seqs), header["stats"]["amount"], created_at))
+
+        cursor = conn.execute(_SQL_ARCHIVE_CANDIDATES, (after_seq, upto_seq))
+        month_key, columns, seqs = None, None, []
+        while True:
+            rows = cursor.fetchmany(CHUNK_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                ride = _row_to_ride(row[1:])
+                key = (ride["date"].year, ride["date"].month)
+                if key != month_key:
+                    if seqs:
+                        flush(month_key, columns, seqs)
+                    month_key, columns, seqs = key, RideColumns(), []
+                columns.append(ride)
+                seqs.append(row[0])
+        if seqs:
+            flush(month_key, columns, seqs)
+        return segments
+
+    def archive_status(self):
+        """Per gearchiveerde (jaar, maand): (jaar, maand, segmenten, ritten, bedrag)."""
+        return self._query(_SQL_ARCHIVE_STATUS)
+
+
+def iter_shard_rides(path, watermark, upto, employee_ids, start_date=None, end_date=None, chunk_size=CHUNK_SIZE):
+    """
+    Streamt de onverwerkte ritten met seq in (watermark, upto] van de medewerkers
+    `employee_ids` (optioneel tussen start_date en end_date) via een eigen
+    read-only connectie, voor een export worker in een ander proces. Zolang de
+    exporterende transactie enkel gelezen heeft, ziet deze connectie (WAL) exact
+    dezelfde ritten.
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30.0)
+    try:
+        cursor = conn.execute(_SQL_SHARD_RIDES, (
+            watermark,
+            upto,
+            json.dumps(sorted(employee_ids)),
+            (start_date or date.min).isoformat(),
+            (end_date or date.max).isoformat(),
+        ))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [_row_to_ride(row) for row in rows]
+    finally:
+        conn.close()
+
+
+class SqliteStorage:
+    """
+    Storage laag voor config, werknemers, ritten, export geschiedenis en
+    deadline uitzonderingen. Eén instantie per proces (gedeelde connection pool).
+    """
+
+    def __init__(self, path, pool_size=POOL_SIZE, archive_dir=None):
+        self.pool = ConnectionPool(path, pool_size)
+        with self.pool.connection() as conn:
+            conn.executescript(_SCHEMA)
+        self.rides = SqliteRideStore(self.pool, RideArchive(archive_dir or archive_dir_for(path)))
+        self._migrate()
+
+    def _migrate(self):
+        """
+        Brengt een bestaande database naar het huidige schema: ritten krijgen een
+        (lege) config_version kolom, de export geschiedenis een (lege) watermark en
+        bestandsnaam, en medewerkers een (lege) juridische entiteit. Een database
+        van vóór de event log krijgt een basis-snapshot van de huidige toestand,
+        zodat replay daar start.
+        """
+        with self.pool.transaction() as conn:
+            needs_baseline = conn.execute(_SQL_EVENT_LOG_EMPTY).fetchone()[0]
+            if "config_version" not in {row[1] for row in conn.execute(_SQL_RIDE_TABLE_INFO)}:
+                conn.execute(_SQL_ADD_RIDE_CONFIG_VERSION)
+            if "last_seq" not in {row[1] for row in conn.execute(_SQL_EXPORT_TABLE_INFO)}:
+                for statement in _SQL_ADD_EXPORT_COLUMNS:
+                    conn.execute(statement)
+            if "entity" not in {row[1] for row in conn.execute(_SQL_EMPLOYEE_TABLE_INFO)}:
+                conn.execute(_SQL_ADD_EMPLOYEE_ENTITY)
+            if needs_baseline:
+                event_log.take_snapshot(self, event_log.EventState.from_storage(self))
+
+    def seed(self, config, employees):
+        """Vult een lege database met de standaard configuratie (versie 1) en master data."""
+        with self.pool.transaction() as conn:
+            if conn.execute("SELECT EXISTS (SELECT 1 FROM config_versions)").fetchone()[0]:
+                return
+            self._put_config(conn, config, date.min)
+            for account_key, employee in employees.items():
+                self._put_employee(conn, account_key, employee)
+
+    @property
+    def path(self):
+        """Pad van het database bestand (voor worker processen met een eigen connectie)."""
+        return self.pool.path
+
+    def transaction(self):
+        """Groepeert meerdere schrijfacties (bv. export markering + geschiedenis) atomair."""
+        return self.pool.transaction()
+
+    def snapshot(self):
+        """Consistente leessnapshot zonder schrijflock (bv. het streamen van een export)."""
+        return self.pool.snapshot()
+
+    def close(self):
+        self.pool.close()
+
+    # -------------------------------------------------------------------------
+    # Configuratie
+    # -------------------------------------------------------------------------
+
+    def load_config_history(self):
+        """Alle config snapshots (ConfigHistory), leeg als de database nog niet geseed is."""
+        with self.pool.connection() as conn:
+            return ConfigHistory(
+                make_snapshot(row[0], date.fromisoformat(row[1]), json.loads(row[2]))
+                for row in conn.execute(_SQL_GET_CONFIG_VERSIONS)
+            )
+
+    def load_config(self, day=None):
+        """Configuratie (dict) die geldt op `day` (standaard vandaag), of {} zonder configuratie."""
+        history = self.load_config_history()
+        if not history:
+            return {}
+        return dict(history.at(day or date.today()).values)
+
+    @staticmethod
+    def _put_config(conn, config, effective_from):
+        version = conn.execute(
+            _SQL_PUT_CONFIG_VERSION,
+            (effective_from.isoformat(), datetime.now().isoformat(), json.dumps(dict(config))),
+        ).fetchone()[0]
+        conn.execute(_SQL_APPEND_EVENT, _event_row(
+            EVENT_CONFIG_CHANGED, None, version, (effective_from.isoformat(), dict(config))
+        ))
+        return version
+
+    def save_config(self, config, effective_from=None):
+        """
+        Bewaart de configuratie als nieuwe, onveranderlijke snapshot die geldt vanaf
+        `effective_from` (standaard vandaag). Bestaande snapshots blijven ongewijzigd;
+        geeft het nieuwe versienummer terug.
+        """
+        with self.pool.transaction() as conn:
+            return self._put_config(conn, config, effective_from or date.today())
+
+    # -------------------------------------------------------------------------
+    # Master data (werknemers)
+    # -------------------------------------------------------------------------
+
+    def load_employees(self):
+        with self.pool.connection() as conn:
+            return {row[0]: _row_to_employee(row[1:]) for row in conn.execute(_SQL_GET_EMPLOYEES)}
+
+    @staticmethod
+    def _put_employee(conn, account_key, employee):
+        params = _employee_params(employee)
+        conn.execute(_SQL_PUT_EMPLOYEE, (params[0], account_key) + params[1:])
+        conn.execute(_SQL_APPEND_EVENT, _event_row(EVENT_EMPLOYEE_SAVED, employee["id"], None, (account_key,) + params))
+
+    def save_employee(self, account_key, employee):
+        with self.pool.transaction() as conn:
+            self._put_employee(conn, account_key, employee)
+
+    # -------------------------------------------------------------------------
+    # Export geschiedenis
+    # -------------------------------------------------------------------------
+
+    def load_export_history(self):
+        with self.pool.connection() as conn:
+            return [_row_to_export(row) for row in conn.execute(_SQL_GET_EXPORTS)]
+
+    def next_export_batch_id(self):
+        """Eerstvolgende batch id (binnen transaction() consistent met append_export)."""
+        with self.pool.connection() as conn:
+            return conn.execute(_SQL_NEXT_BATCH_ID).fetchone()[0]
+
+    def append_export(self, entry):
+        params = _export_params(entry)
+        with self.pool.transaction() as conn:
+            conn.execute(_SQL_PUT_EXPORT, params)
+            conn.execute(_SQL_APPEND_EVENT, _event_row(EVENT_RIDES_EXPORTED, None, entry["batch_id"], params))
+
+    # -------------------------------------------------------------------------
+    # Deadline uitzonderingen
+    # -------------------------------------------------------------------------
+
+    def load_deadline_exceptions(self):
+        with self.pool.connection() as conn:
+            return {row[0]: date.fromisoformat(row[1]) for row in conn.execute(_SQL_GET_EXCEPTIONS)}
+
+    def set_deadline_exception(self, employee_id, expires):
+        with self.pool.transaction() as conn:
+            conn.execute(_SQL_PUT_EXCEPTION, (employee_id, expires.isoformat()))
+            conn.execute(_SQL_APPEND_EVENT, _event_row(EVENT_EXCEPTION_GRANTED, employee_id, None, expires.isoformat()))
+
+    def delete_deadline_exception(self, employee_id, expires=None):
+        """Verwijdert de uitzondering; met `expires` enkel als ze nog die vervaldatum heeft."""
+        with self.pool.transaction() as conn:
+            if expires is None:
+                row = conn.execute(_SQL_DELETE_EXCEPTION, (employee_id,)).fetchone()
+            else:
+                row = conn.execute(_SQL_DELETE_EXCEPTION_IF, (employee_id, expires.isoformat())).fetchone()
+            if row is not None:
+                conn.execute(_SQL_APPEND_EVENT, _event_row(EVENT_EXCEPTION_REMOVED, employee_id, None, row[0]))
+        return row is not None
+
+    def claim_reminders(self, period, employee_ids):
+        """
+        Registreert een herinnering voor `period` per medewerker en geeft de ids terug
+        die er nog geen hadden: over processen heen krijgt elke medewerker er één.
+        """
+        sent_at = datetime.now().isoformat()
+        with self.pool.transaction() as conn:
+            return [
+                emp_id for emp_id in employee_ids
+                if conn.execute(_SQL_CLAIM_REMINDER, (emp_id, period, sent_at)).rowcount == 1
+            ]
+
+    # -------------------------------------------------------------------------
+    # Event log en snapshots (zie event_log.py)
+    # -------------------------------------------------------------------------
+
+    def last_event_seq(self):
+        with self.pool.connection() as conn:
+            return conn.execute(_SQL_LAST_EVENT_SEQ).fetchone()[0]
+
+    def pending_rides_changed(self, after):
+        """
+        True als er na event `after` een export of herberekening werd gelogd: de
+        onverwerkte ritten (of hun bedragen) zijn dan niet meer die van toen.
+        """
+        with self.pool.connection() as conn:
+            return bool(conn.execute(_SQL_PENDING_RIDES_CHANGED, (after,)).fetchone()[0])
+
+    def state_version(self):
+        """
+        Seq van het laatste event dat geen ingediende rit is: verandert enkel als de
+        config, master data, export geschiedenis of uitzonderingen wijzigen.
+        """
+        with self.pool.connection() as conn:
+            return conn.execute(_SQL_STATE_VERSION).fetchone()[0]
+
+    def event_seq_at(self, moment):
+        """Seq van het laatste event op of vóór `moment` (datetime), 0 als er geen is."""
+        with self.pool.connection() as conn:
+            return conn.execute(_SQL_EVENT_SEQ_AT, (moment.isoformat(),)).fetchone()[0]
+
+    def iter_events(self, after=0, upto=None, chunk_size=CHUNK_SIZE):
+        """Streamt de events met seq in (after, upto] in seq volgorde, in chunks (replay)."""
+        with self.pool.connection() as conn:
+            cursor = conn.execute(_SQL_EVENTS_RANGE, (after, _MAX_SEQ if upto is None else upto))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [_row_to_event(row) for row in rows]
+
+    def load_events(self, employee_id=None, kind=None, after=0, upto=None, limit=100):
+        """
+        Audit: de recentste events (nieuwste eerst) van één medewerker (optioneel van
+        één soort) of van één soort, via de index op (employee_id, seq) of (kind, seq).
+        """
+        upto = _MAX_SEQ if upto is None else upto
+        if employee_id is not None:
+            sql, params = _SQL_EMPLOYEE_EVENTS, (employee_id, after, upto, kind, kind, limit)
+        elif kind == EVENT_RIDE_SUBMITTED:
+            sql, params = _SQL_RIDE_EVENTS, (after, upto, limit)
+        elif kind is not None:
+            sql, params = _SQL_KIND_EVENTS, (kind, after, upto, limit)
+        else:
+            sql, params = _SQL_RECENT_EVENTS, (after, upto, limit)
+        with self.pool.connection() as conn:
+            return [_row_to_event(row) for row in conn.execute(sql, params)]
+
+    def latest_snapshot(self, upto=None):
+        """(event_seq, blob) van de laatste snapshot op of vóór event `upto`, of None."""
+        with self.pool.connection() as conn:
+            return conn.execute(_SQL_LATEST_SNAPSHOT, (_MAX_SEQ if upto is None else upto,)).fetchone()
+
+    def save_snapshot(self, event_seq, blob, keep=None):
+        """Bewaart een snapshot op `event_seq`; met `keep` blijven enkel de recentste over."""
+        with self.pool.transaction() as conn:
+            conn.execute(_SQL_PUT_SNAPSHOT, (event_seq, datetime.now().isoformat(), blob))
+            if keep is not None:
+                conn.execute(_SQL_PRUNE_SNAPSHOTS, (keep,))
+
+    def load_startup_state(self, version):
+        """Voorberekende startup snapshot (bytes) voor state versie `version`, of None."""
+        with self.pool.connection() as conn:
+            row = conn.execute(_SQL_GET_STARTUP_STATE, (version,)).fetchone()
+        return row[0] if row is not None else None
+
+    def save_startup_state(self, version, blob):
+        """Vervangt de startup snapshot door die van `version`."""
+        with self.pool.transaction() as conn:
+            conn.execute(_SQL_PUT_STARTUP_STATE, (version, datetime.now().isoformat(), blob))
+            conn.execute(_SQL_PRUNE_STARTUP_STATE, (version,))
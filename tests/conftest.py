@@ -0,0 +1,43 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+
+# De modules staan plat in de root van de repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import generate_dataset, load_dataset  # noqa: E402
+
+# Vaste "vandaag" (een zaterdag: de dataset heeft enkel ritten op werkdagen)
+TODAY = date(2026, 10, 17)
+
+
+@pytest.fixture(scope="session")
+def dataset():
+    """Kleine deterministische dataset; alles vóór september 2026 is geëxporteerd. Niet wijzigen."""
+    return generate_dataset(n_employees=30, years=1, seed=7, today=TODAY)
+
+
+@pytest.fixture
+def sqlite_ctx(dataset, tmp_path):
+    """(context, SqliteStorage) met de dataset in een tijdelijke database (zie benchmarks.load_dataset)."""
+    ctx, storage = load_dataset(dataset, "sqlite", path=str(tmp_path / "fietsvergoeding.db"))
+    yield ctx, storage
+    storage.close()
+
+
+def make_ride(employee, day, ride_type, amount, trajectory="Thuis-Werk"):
+    """Rit-dict zoals de UI en de API hem bouwen."""
+    return {
+        "date": day,
+        "employee_id": employee["id"],
+        "employee_name": employee["name"],
+        "trajectory": trajectory,
+        "ride_type": ride_type,
+        "distance": employee["trajectories"][trajectory],
+        "amount": amount,
+        "rate_applied": 0.27,
+        "processed": False,
+        "config_version": 2,
+    }
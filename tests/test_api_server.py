@@ -0,0 +1,104 @@
+import asyncio
+import gc
+import json
+from datetime import timedelta
+from http import HTTPStatus
+
+import pytest
+
+from api_server import RideApi
+from conftest import TODAY
+
+
+@pytest.fixture
+def api(sqlite_ctx):
+    _, storage = sqlite_ctx
+    api = RideApi(storage)
+    yield api
+    api.close()
+
+
+def _ride(employee_id, **fields):
+    ride = {"employee_id": employee_id, "date": TODAY.isoformat(), "trajectory": "Thuis-Werk", "ride_type": "Enkel"}
+    return dict(ride, **fields)
+
+
+def _post(api, path, payload):
+    return asyncio.run(api.dispatch("POST", path, json.dumps(payload).encode()))
+
+
+def test_unknown_ride_type_is_rejected(sqlite_ctx, api):
+    ctx, storage = sqlite_ctx
+    employee_id = ctx["employees"][0]["id"]
+    count = len(storage.rides)
+
+    status, body = _post(api, "/rides", _ride(employee_id, ride_type="retoer"))
+    assert status == HTTPStatus.BAD_REQUEST and "ride_type" in body["error"]
+    status, body = _post(api, "/rides/batch", {"rides": [_ride(employee_id), _ride(employee_id, ride_type="x")]})
+    assert status == HTTPStatus.BAD_REQUEST and "rit 1" in body["error"]
+    assert len(storage.rides) == count
+
+    status, body = _post(api, "/rides", _ride(employee_id))
+    assert status == HTTPStatus.OK and body["valid"]
+    assert len(storage.rides) == count + 1
+
+
+@pytest.mark.parametrize("trajectory", [["Thuis-Werk"], {"naam": "Thuis-Werk"}, 12])
+def test_non_string_trajectory_is_rejected(sqlite_ctx, api, trajectory):
+    ctx, storage = sqlite_ctx
+    employee_id = ctx["employees"][0]["id"]
+    count = len(storage.rides)
+
+    status, body = _post(api, "/rides", _ride(employee_id, trajectory=trajectory))
+    assert status == HTTPStatus.BAD_REQUEST and "trajectory" in body["error"]
+    status, body = _post(api, "/rides/batch", {"rides": [_ride(employee_id), _ride(employee_id, trajectory=trajectory)]})
+    assert status == HTTPStatus.BAD_REQUEST and "rit 1" in body["error"]
+    assert len(storage.rides) == count
+
+
+def test_employee_locks_are_not_kept(sqlite_ctx, api):
+    ctx, _ = sqlite_ctx
+
+    async def submit_all():
+        for employee_id in range(10_000_000, 10_000_050):
+            status, _ = await api.dispatch("POST", "/rides", json.dumps(_ride(employee_id)).encode())
+            assert status == HTTPStatus.NOT_FOUND
+        await api.dispatch("POST", "/rides", json.dumps(_ride(ctx["employees"][0]["id"])).encode())
+
+    asyncio.run(submit_all())
+    gc.collect()
+    assert len(api._employee_locks) == 0
+
+
+def test_batch_enforces_limits_against_stored_rides(sqlite_ctx, api):
+    ctx, storage = sqlite_ctx
+    rides = storage.rides
+    yesterday = TODAY - timedelta(days=1)
+    full_day = next(employee for employee in ctx["employees"] if rides.day_points(employee["id"], yesterday) >= 2)
+    be = next(
+        employee for employee in ctx["employees"]
+        if employee["country"] == "BE" and employee is not full_day and rides.year_total(employee["id"], TODAY.year) > 0
+    )
+    nl = next(employee for employee in ctx["employees"] if employee["country"] == "NL")
+    # BE medewerker zit precies aan de jaarlimiet vanaf deze maand
+    year_total = rides.year_total(be["id"], TODAY.year)
+    storage.save_config(dict(storage.load_config_history().at(TODAY).values, BE_YEARLY_LIMIT=year_total),
+                        TODAY.replace(day=1))
+    api.state.refresh(force=True)
+    count = len(rides)
+
+    status, body = _post(api, "/rides/batch", {"rides": [
+        _ride(full_day["id"], date=yesterday.isoformat()),
+        _ride(be["id"]),
+        _ride(nl["id"]),
+        _ride(nl["id"], ride_type="Heen-en-Terug"),
+    ]})
+
+    assert status == HTTPStatus.OK
+    assert [result["valid"] for result in body["results"]] == [False, False, True, False]
+    assert (body["accepted"], body["rejected"]) == (1, 3)
+    assert len(rides) == count + 1
+    # Zelfde verdict als het enkelvoudige endpoint
+    for ride in (_ride(full_day["id"], date=yesterday.isoformat()), _ride(be["id"])):
+        status, single = _post(api, "/rides", ride)
+        assert status == HTTPStatus.OK and not single["valid"]
@@ -0,0 +1,194 @@
+import random
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+import metrics
+from batch_validation import MSG_UNKNOWN_EMPLOYEE, MSG_UNKNOWN_RIDE_TYPE, MSG_UNKNOWN_TRAJECTORY, validate_batch
+from benchmarks import BENCH_CONFIG
+from config_snapshots import ConfigHistory, make_snapshot
+from conftest import TODAY, make_ride
+from employees import EmployeeIndex
+from export_locks import ExportLocks
+from ride_store import RIDE_TYPES, RideStore
+from rules import LIMIT_LABELS, MSG_DAY_LIMIT, MSG_LIMIT_BLOCKED, RulesEngine
+
+# =============================================================================
+# validate_batch tegenover RulesEngine.validate_ride (rij per rij, in volgorde)
+# =============================================================================
+# Per seed: willekeurige config snapshots (BLOCK/CAP, maand/jaar limieten, kleine
+# limieten zodat afkappen en weigeren voorkomen), deadline uitzonderingen en
+# kandidaat-ritten rond de export grens en het deadline venster, plus enkele
+# rijen met een onbekende medewerker, traject of rittype.
+
+
+def _random_configs(rng):
+    snapshots = []
+    for version in range(1, rng.randint(1, 3) + 1):
+        values = dict(
+            BENCH_CONFIG,
+            BE_RATE=rng.choice([0.2, 0.27, 0.35]),
+            BE_LIMIT_TYPE=rng.choice(["YEARLY", "MONTHLY"]),
+            BE_LIMIT_ENFORCE_MODE=rng.choice(["BLOCK", "CAP"]),
+            BE_MONTHLY_LIMIT=rng.choice([20.0, 100.0, 265.0]),
+            BE_YEARLY_LIMIT=rng.choice([300.0, 1500.0, 3160.0]),
+            NL_COMPANY_BIKE_RATE=rng.choice([0.0, 0.1]),
+            DEADLINE_DAY=rng.choice([1, 15, 28]),
+            MAX_RIDES_DAY=rng.choice([2, 2, 3]),
+        )
+        effective_from = date.min if version == 1 else TODAY - timedelta(days=rng.randint(0, 60))
+        snapshots.append(make_snapshot(version, effective_from, values))
+    return ConfigHistory(snapshots)
+
+
+def _candidates(rng, employees, n):
+    rows = []
+    for _ in range(n):
+        employee = rng.choice(employees)
+        row = {
+            "date": TODAY - timedelta(days=rng.randint(-3, 70)),
+            "employee_id": employee["id"],
+            "trajectory": rng.choice(list(employee["trajectories"])),
+            "ride_type": rng.choice(RIDE_TYPES),
+        }
+        roll = rng.random()
+        if roll < 0.02:
+            row["employee_id"] = 999_999
+        elif roll < 0.04:
+            row["trajectory"] = "Thuis-Sportclub"
+        elif roll < 0.06:
+            row["ride_type"] = "retoer"
+        rows.append(row)
+    return rows
+
+
+def _expected(rules, store, employees_by_id, row):
+    """Verdict van het enkelvoudige pad; een aanvaarde rit wordt bewaard zoals in de UI."""
+    employee = employees_by_id.get(row["employee_id"])
+    if employee is None:
+        return False, [MSG_UNKNOWN_EMPLOYEE.format(employee_id=row["employee_id"])], 0.0
+    if row["trajectory"] not in employee["trajectories"]:
+        return False, [MSG_UNKNOWN_TRAJECTORY.format(trajectory=row["trajectory"])], 0.0
+    if row["ride_type"] not in RIDE_TYPES:
+        return False, [MSG_UNKNOWN_RIDE_TYPE.format(ride_type=row["ride_type"])], 0.0
+    valid, msgs, amount = rules.validate_ride(employee, row["date"], row["trajectory"], row["ride_type"])
+    if valid:
+        store.append(make_ride(employee, row["date"], row["ride_type"], amount, row["trajectory"]))
+    return valid, msgs, amount
+
+
+def _verdicts(result):
+    return [
+        (bool(valid), msgs, float(amount))
+        for valid, msgs, amount in zip(result["valid"], result["messages"], result["amount"])
+    ]
+
+
+def _validation_counters():
+    return {key: value for key, value in metrics.REGISTRY.snapshot()[1].items() if key[0] == "validations"}
+
+
+@pytest.fixture
+def metrics_enabled():
+    metrics.enable()
+    metrics.REGISTRY.reset()
+    yield
+    metrics.REGISTRY.reset()
+    metrics.disable()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_batch_matches_sequential_validation(dataset, metrics_enabled, seed):
+    rng = random.Random(seed)
+    employees = list(dataset["employees"].values())
+    employees_by_id = {employee["id"]: employee for employee in employees}
+    configs = _random_configs(rng)
+    export_locks = ExportLocks(dataset["export_history"])
+    exceptions = {
+        employee["id"]: TODAY + timedelta(days=rng.randint(-3, 5)) for employee in rng.sample(employees, 5)
+    }
+    rows = _candidates(rng, employees, 200)
+
+    reference_store = RideStore(dataset["rides"])
+    rules = RulesEngine(configs, reference_store, export_locks, exceptions, clock=lambda: TODAY)
+    expected = [_expected(rules, reference_store, employees_by_id, row) for row in rows]
+    expected_counters = _validation_counters()
+    metrics.REGISTRY.reset()
+
+    result = validate_batch(
+        pd.DataFrame(rows), EmployeeIndex(dataset["employees"]), configs, RideStore(dataset["rides"]),
+        export_locks, exceptions, today=TODAY,
+    )
+    actual = _verdicts(result)
+
+    for pos, (want, got) in enumerate(zip(expected, actual)):
+        assert got == want, (pos, rows[pos])
+    # Zelfde verdicts per reden, behalve de rijen die het enkelvoudige pad nooit ziet
+    batch_only = {"unknown_employee", "unknown_trajectory", "unknown_ride_type"}
+    counters = {key: value for key, value in _validation_counters().items() if dict(key[1])["reason"] not in batch_only}
+    assert counters == expected_counters
+
+
+def test_unknown_ride_type_is_rejected_not_single(dataset):
+    employee = next(iter(dataset["employees"].values()))
+    rows = [
+        {"date": TODAY, "employee_id": employee["id"], "trajectory": "Thuis-Werk", "ride_type": ride_type}
+        for ride_type in ("retoer", None, "Enkel")
+    ]
+    configs = ConfigHistory([make_snapshot(1, date.min, BENCH_CONFIG)])
+    result = validate_batch(
+        pd.DataFrame(rows), EmployeeIndex(dataset["employees"]), configs, RideStore(), ExportLocks(), {}, today=TODAY,
+    )
+    assert result["valid"].tolist() == [False, False, True]
+    assert result["messages"][0] == [MSG_UNKNOWN_RIDE_TYPE.format(ride_type="retoer")]
+    assert result["amount"].tolist()[:2] == [0.0, 0.0]
+
+
+# =============================================================================
+# validate_batch tegen de SQLite store (bestaande ritten in de database)
+# =============================================================================
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_batch_against_sqlite_store_matches_validate_ride(sqlite_ctx, seed):
+    ctx, storage = sqlite_ctx
+    rng = random.Random(seed)
+    employees_by_id = {employee["id"]: employee for employee in ctx["employees"]}
+    configs = _random_configs(rng)
+    rows = _candidates(rng, ctx["employees"], 200)
+
+    result = validate_batch(
+        pd.DataFrame(rows), ctx["employee_index"], configs, storage.rides, ctx["export_locks"],
+        ctx["deadline_exceptions"], today=TODAY,
+    )
+    # Daarna het enkelvoudige pad op dezelfde database (dat bewaart de aanvaarde ritten)
+    rules = RulesEngine(configs, storage.rides, ctx["export_locks"], ctx["deadline_exceptions"], clock=lambda: TODAY)
+    expected = [_expected(rules, storage.rides, employees_by_id, row) for row in rows]
+
+    # SQLite telt de limiet totalen opnieuw op (SUM): een afgekapt bedrag mag op de laatste bits verschillen
+    for pos, (want, got) in enumerate(zip(expected, _verdicts(result))):
+        assert got[:2] == want[:2] and got[2] == pytest.approx(want[2]), (pos, rows[pos])
+
+
+def test_batch_counts_rides_already_in_sqlite(sqlite_ctx):
+    ctx, storage = sqlite_ctx
+    rides = storage.rides
+    day = TODAY - timedelta(days=1)
+    full_day = next(employee for employee in ctx["employees"] if rides.day_points(employee["id"], day) >= 2)
+    be = next(
+        employee for employee in ctx["employees"]
+        if employee["country"] == "BE" and rides.year_total(employee["id"], TODAY.year) > 0
+    )
+    year_total = rides.year_total(be["id"], TODAY.year)
+    configs = ConfigHistory([make_snapshot(1, date.min, dict(BENCH_CONFIG, BE_YEARLY_LIMIT=year_total))])
+    rows = [
+        {"date": day, "employee_id": full_day["id"], "trajectory": "Thuis-Werk", "ride_type": "Heen-en-Terug"},
+        {"date": TODAY, "employee_id": be["id"], "trajectory": "Thuis-Werk", "ride_type": "Enkel"},
+    ]
+
+    result = validate_batch(pd.DataFrame(rows), ctx["employee_index"], configs, rides, ExportLocks(), {}, today=TODAY)
+
+    assert result["valid"].tolist() == [False, False]
+    assert result["messages"][0] == [MSG_DAY_LIMIT.format(points=rides.day_points(full_day["id"], day))]
+    assert result["messages"][1] == [MSG_LIMIT_BLOCKED.format(adjective=LIMIT_LABELS["YEARLY"][1], limit=year_total)]
@@ -0,0 +1,62 @@
+import csv
+from datetime import date, timedelta
+
+from batch_validation import REQUIRED_COLUMNS
+from benchmarks import BENCH_CONFIG
+from bulk_import import CSV_SEPARATOR, import_rides, iter_chunks
+from config_snapshots import ConfigHistory, make_snapshot
+from conftest import TODAY
+from export_locks import ExportLocks
+from rules import LIMIT_LABELS, MSG_DAY_LIMIT, MSG_LIMIT_BLOCKED
+
+# =============================================================================
+# import_rides in een SQLite database: limieten tegenover bestaande ritten en
+# tegenover de vorige chunks van dezelfde import
+# =============================================================================
+
+
+def _write_csv(path, rows):
+    with open(path, "w", encoding="utf-8", newline="") as fileobj:
+        writer = csv.writer(fileobj, delimiter=CSV_SEPARATOR)
+        writer.writerow(REQUIRED_COLUMNS)
+        writer.writerows(rows)
+    return path
+
+
+def test_import_rejects_over_limit_rows(sqlite_ctx, tmp_path):
+    ctx, storage = sqlite_ctx
+    rides = storage.rides
+    yesterday = TODAY - timedelta(days=1)
+    full_day = next(employee for employee in ctx["employees"] if rides.day_points(employee["id"], yesterday) >= 2)
+    be = next(
+        employee for employee in ctx["employees"]
+        if employee["country"] == "BE" and employee is not full_day and rides.year_total(employee["id"], TODAY.year) > 0
+    )
+    nl = next(employee for employee in ctx["employees"] if employee["country"] == "NL" and employee is not full_day)
+    year_total = rides.year_total(be["id"], TODAY.year)
+    configs = ConfigHistory([make_snapshot(1, date.min, dict(BENCH_CONFIG, BE_YEARLY_LIMIT=year_total + 1.0))])
+    path = _write_csv(tmp_path / "ritten.csv", [
+        (yesterday.isoformat(), full_day["id"], "Thuis-Werk", "Enkel"),   # dag al vol in de database
+        (TODAY.isoformat(), nl["id"], "Thuis-Werk", "Enkel"),
+        (TODAY.isoformat(), nl["id"], "Thuis-Werk", "Enkel"),
+        (TODAY.isoformat(), nl["id"], "Thuis-Werk", "Enkel"),             # dag vol door chunk 2 en 3
+        (TODAY.isoformat(), be["id"], "Thuis-Werk", "Heen-en-Terug"),  # over de jaarlimiet
+    ])
+    count = len(rides)
+
+    # Eén rij per chunk: elke chunk moet de vorige chunks van de import zien
+    report = import_rides(
+        storage, iter_chunks(str(path), chunk_size=1), ctx["employee_index"], configs, ExportLocks(), {},
+        today=TODAY,
+    )
+
+    assert (report["accepted"], report["rejected"]) == (2, 3)
+    assert report["rejections"]["row"].tolist() == [1, 4, 5]
+    assert report["rejections"]["reason"].tolist() == [
+        MSG_DAY_LIMIT.format(points=rides.day_points(full_day["id"], yesterday)),
+        MSG_DAY_LIMIT.format(points=2),
+        MSG_LIMIT_BLOCKED.format(adjective=LIMIT_LABELS["YEARLY"][1], limit=year_total + 1.0),
+    ]
+    assert len(rides) == count + 2
+    assert rides.day_points(nl["id"], TODAY) == 2
+    assert rides.year_total(be["id"], TODAY.year) == year_total
@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+import pytest
+
+import event_log
+from benchmarks import BENCH_CONFIG
+from conftest import TODAY, make_ride
+from employees import EmployeeIndex
+from payroll_export import run_export
+from recalculation import apply_plan, plan_recalculation
+
+# =============================================================================
+# event_log.restore tegenover de live tabellen
+# =============================================================================
+
+
+def assert_matches_live(state, storage):
+    """De herstelde toestand is rit per rit en tabel per tabel gelijk aan de storage."""
+    assert list(state.rides) == list(storage.rides)
+    assert list(state.config_history) == list(storage.load_config_history())
+    assert state.employees == storage.load_employees()
+    assert state.deadline_exceptions == storage.load_deadline_exceptions()
+    assert state.export_history == storage.load_export_history()
+    assert state.event_seq == storage.last_event_seq()
+    live = storage.rides
+    assert state.rides.pending_summary() == pytest.approx(live.pending_summary())
+    for employee_id in {ride["employee_id"] for ride in live}:
+        for year in (TODAY.year - 1, TODAY.year):
+            assert state.rides.year_total(employee_id, year) == pytest.approx(live.year_total(employee_id, year))
+    assert event_log.verify(storage) == []
+
+
+def _mutate(ctx, storage, tmp_path):
+    """Eén van elke soort wijziging: ritten, uitzonderingen, master data, config, herberekening, export."""
+    employees = ctx["employees"]
+    rules = ctx["rules"]
+    for employee in employees[:5]:
+        storage.rides.submit_ride(
+            employee["id"],
+            lambda employee=employee: rules.validate_ride(employee, TODAY - timedelta(days=1), "Thuis-Werk", "Enkel"),
+            lambda amount, employee=employee: make_ride(employee, TODAY - timedelta(days=1), "Enkel", amount),
+        )
+    storage.set_deadline_exception(employees[0]["id"], TODAY + timedelta(days=3))
+    storage.set_deadline_exception(employees[1]["id"], TODAY + timedelta(days=3))
+    storage.delete_deadline_exception(employees[1]["id"])
+    account_key, employee = next(iter(storage.load_employees().items()))
+    storage.save_employee(account_key, dict(employee, trajectories=dict(employee["trajectories"], Extra=12)))
+
+    # Nieuw BE tarief sinds de eerste van de maand: de onverwerkte ritten worden herberekend
+    storage.save_config(dict(BENCH_CONFIG, BE_RATE=0.33), TODAY.replace(day=1))
+    index = EmployeeIndex(storage.load_employees())
+    plan = plan_recalculation(storage.rides, index, storage.load_config_history(), workers=1)
+    assert plan.versions and apply_plan(storage.rides, plan)
+
+    run_export(storage, index, export_dir=str(tmp_path / "exports"), archive=True)
+
+
+def test_restore_matches_loaded_dataset(sqlite_ctx):
+    _, storage = sqlite_ctx
+    assert_matches_live(event_log.restore(storage), storage)
+
+
+def test_restore_matches_live_tables_after_changes(sqlite_ctx, tmp_path):
+    ctx, storage = sqlite_ctx
+    _mutate(ctx, storage, tmp_path)
+    assert storage.rides.archive_status()  # de export heeft ritten gearchiveerd
+    assert_matches_live(event_log.restore(storage), storage)
+
+
+def test_restore_from_snapshot_equals_full_replay(sqlite_ctx, tmp_path):
+    ctx, storage = sqlite_ctx
+    snapshot_seq = event_log.take_snapshot(storage)
+    _mutate(ctx, storage, tmp_path)
+
+    assert storage.latest_snapshot()[0] == snapshot_seq
+    assert_matches_live(event_log.restore(storage), storage)
+
+
+def test_restore_upto_returns_earlier_state(sqlite_ctx, tmp_path):
+    ctx, storage = sqlite_ctx
+    before_seq = storage.last_event_seq()
+    rides_before = list(storage.rides)
+    exceptions_before = storage.load_deadline_exceptions()
+    _mutate(ctx, storage, tmp_path)
+
+    state = event_log.restore(storage, before_seq)
+    assert state.event_seq == before_seq
+    assert list(state.rides) == rides_before
+    assert state.deadline_exceptions == exceptions_before
@@ -0,0 +1,220 @@
+import csv
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import payroll_export
+from benchmarks import BENCH_CONFIG
+from conftest import TODAY, make_ride
+from payroll_export import MANIFEST_NAME, PARTIAL_SUFFIX, export_filename, recover_exports, run_export
+from recalculation import apply_plan, plan_recalculation
+from storage import SqliteStorage
+
+# =============================================================================
+# run_export: .part bestand, commit, publicatie en herstel na een crash
+# =============================================================================
+
+EXPORT_TIMESTAMP = datetime(2026, 10, 17, 9, 30)
+
+
+def _export(ctx, storage, export_dir, **kwargs):
+    return run_export(
+        storage, ctx["employee_index"], export_dir=str(export_dir), export_timestamp=EXPORT_TIMESTAMP,
+        archive=False, **kwargs,
+    )
+
+
+def _files(export_dir):
+    return sorted(os.listdir(export_dir)) if os.path.isdir(export_dir) else []
+
+
+def test_run_export_publishes_and_marks_batch(sqlite_ctx, tmp_path):
+    ctx, storage = sqlite_ctx
+    export_dir = tmp_path / "exports"
+    pending_count, pending_amount = storage.rides.pending_summary()
+    last_seq = storage.rides.last_seq()
+    assert pending_count > 0
+
+    entry, path = _export(ctx, storage, export_dir)
+
+    assert _files(export_dir) == [entry["file_name"]] and path == str(export_dir / entry["file_name"])
+    assert entry["ride_count"] == pending_count
+    assert entry["total_amount"] == pytest.approx(pending_amount)
+    assert entry["last_seq"] == last_seq
+    assert storage.load_export_history()[-1] == entry
+    assert storage.rides.pending_summary()[0] == 0
+    assert storage.rides.export_watermark() == last_seq
+    with open(path, encoding="utf-8", newline="") as fileobj:
+        rows = list(csv.reader(fileobj, delimiter=";"))
+    assert len(rows) == pending_count + 1  # header
+
+    # Niets meer te exporteren: geen batch en geen bestand
+    assert _export(ctx, storage, export_dir) == (None, None)
+    assert _files(export_dir) == [entry["file_name"]]
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"aggregate": True}, {"partition_by": ("country",), "workers": 1}],
+    ids=["rides", "summary", "partitioned"],
+)
+def test_crash_after_commit_is_published_by_recovery(sqlite_ctx, tmp_path, monkeypatch, options):
+    ctx, storage = sqlite_ctx
+    export_dir = tmp_path / "exports"
+    batches = len(storage.load_export_history())
+
+    def crash(partial_path, export_path):
+        raise OSError("proces gestopt vóór de hernoeming")
+
+    monkeypatch.setattr(payroll_export, "_publish", crash)
+    with pytest.raises(OSError):
+        _export(ctx, storage, export_dir, **options)
+    monkeypatch.undo()
+
+    # De batch is gecommit, maar enkel het .part bestand bestaat
+    entry = storage.load_export_history()[-1]
+    assert len(storage.load_export_history()) == batches + 1
+    assert _files(export_dir) == [entry["file_name"] + PARTIAL_SUFFIX]
+    assert storage.rides.pending_summary()[0] == 0
+
+    assert recover_exports(storage, str(export_dir)) == ([entry["file_name"]], [])
+    assert _files(export_dir) == [entry["file_name"]]
+    if options.get("partition_by"):
+        assert MANIFEST_NAME in _files(export_dir / entry["file_name"])
+    assert recover_exports(storage, str(export_dir)) == ([], [])
+
+
+def test_rolled_back_export_leaves_no_file(sqlite_ctx, tmp_path, monkeypatch):
+    ctx, storage = sqlite_ctx
+    export_dir = tmp_path / "exports"
+    history = storage.load_export_history()
+    pending = storage.rides.pending_summary()
+
+    def fail(entry):
+        raise RuntimeError("schijf vol")
+
+    monkeypatch.setattr(storage, "append_export", fail)
+    with pytest.raises(RuntimeError):
+        _export(ctx, storage, export_dir)
+    monkeypatch.undo()
+
+    assert _files(export_dir) == []
+    assert storage.load_export_history() == history
+    assert storage.rides.pending_summary() == pending
+
+
+def test_recovery_keeps_the_next_batch_until_a_commit(sqlite_ctx, tmp_path):
+    ctx, storage = sqlite_ctx
+    export_dir = tmp_path / "exports"
+    export_dir.mkdir()
+    # Exports die gekild werden tijdens het schrijven: .part zonder batch in de geschiedenis.
+    # Een lager batch id kan nooit meer gecommit worden; het volgende kan van een lopende export zijn.
+    next_batch_id = storage.next_export_batch_id()
+    stale = export_filename(next_batch_id - 1, datetime(2026, 9, 1, 8, 0)) + PARTIAL_SUFFIX
+    current = export_filename(next_batch_id, datetime(2026, 10, 1, 8, 0)) + PARTIAL_SUFFIX
+    for name in (stale, current):
+        (export_dir / name).write_text("date;employee_id\n", encoding="utf-8")
+
+    assert recover_exports(storage, str(export_dir)) == ([], [stale])
+    assert _files(export_dir) == [current]
+
+    entry, _ = _export(ctx, storage, export_dir)
+    assert entry["batch_id"] == next_batch_id
+    assert _files(export_dir) == [entry["file_name"]]
+
+
+# =============================================================================
+# Streamen zonder schrijflock: gelijktijdige schrijvers tijdens een export
+# =============================================================================
+
+
+@pytest.fixture
+def other_process(sqlite_ctx):
+    """Tweede storage op dezelfde database, zoals de API naast de Streamlit app."""
+    _, storage = sqlite_ctx
+    other = SqliteStorage(storage.path)
+    yield other
+    other.close()
+
+
+def _while_streaming(monkeypatch, storage, action):
+    """Voert action() in een andere thread uit tijdens elke poging, na de eerste chunk."""
+    iter_unprocessed = storage.rides.iter_unprocessed
+    attempts = []
+
+    def streaming(*args, **kwargs):
+        for pos, chunk in enumerate(iter_unprocessed(*args, **kwargs)):
+            if pos == 0:
+                writer = threading.Thread(target=action, args=(len(attempts),))
+                writer.start()
+                writer.join(timeout=5)
+                attempts.append(not writer.is_alive())
+            yield chunk
+
+    monkeypatch.setattr(storage.rides, "iter_unprocessed", streaming)
+    return attempts
+
+
+def test_rides_are_submitted_while_streaming(sqlite_ctx, other_process, tmp_path, monkeypatch):
+    ctx, storage = sqlite_ctx
+    employee = ctx["employees"][0]
+    pending_count, pending_amount = storage.rides.pending_summary()
+
+    def submit(attempt):
+        other_process.rides.append(make_ride(employee, TODAY, "Enkel", 1.5))
+
+    attempts = _while_streaming(monkeypatch, storage, submit)
+    entry, _ = _export(ctx, storage, tmp_path / "exports")
+
+    assert attempts == [True]  # de schrijver wachtte niet op de export
+    # De nieuwe rit (seq > last_seq) hoort niet bij de batch en blijft openstaan
+    assert entry["ride_count"] == pending_count and entry["total_amount"] == pytest.approx(pending_amount)
+    assert storage.rides.pending_summary() == (1, pytest.approx(1.5))
+
+
+def test_recalculation_while_streaming_rewrites_the_batch(sqlite_ctx, other_process, tmp_path, monkeypatch):
+    ctx, storage = sqlite_ctx
+    recalculated = []
+
+    def recalculate(attempt):
+        if attempt:
+            return
+        other_process.save_config(dict(BENCH_CONFIG, BE_RATE=0.33), TODAY.replace(day=1))
+        plan = plan_recalculation(
+            other_process.rides, ctx["employee_index"], other_process.load_config_history(), workers=1
+        )
+        recalculated.append(bool(plan.versions) and apply_plan(other_process.rides, plan))
+        recalculated.append(other_process.rides.pending_summary())
+
+    attempts = _while_streaming(monkeypatch, storage, recalculate)
+    entry, path = _export(ctx, storage, tmp_path / "exports")
+
+    # De eerste poging las de oude bedragen en werd niet vastgelegd
+    assert attempts == [True, True] and recalculated[0]
+    pending_count, pending_amount = recalculated[1]
+    assert entry["ride_count"] == pending_count and entry["total_amount"] == pytest.approx(pending_amount)
+    with open(path, encoding="utf-8", newline="") as fileobj:
+        amounts = [float(row["amount"]) for row in csv.DictReader(fileobj, delimiter=";")]
+    assert sum(amounts) == pytest.approx(pending_amount)
+    assert storage.rides.pending_summary()[0] == 0
+
+
+def test_export_committed_while_streaming_wins(sqlite_ctx, other_process, tmp_path, monkeypatch):
+    ctx, storage = sqlite_ctx
+    export_dir = tmp_path / "exports"
+    other_entries = []
+
+    def export_elsewhere(attempt):
+        if not attempt:
+            other_entries.append(run_export(
+                other_process, ctx["employee_index"], export_dir=str(export_dir),
+                export_timestamp=EXPORT_TIMESTAMP + timedelta(minutes=1), archive=False,
+            )[0])
+
+    _while_streaming(monkeypatch, storage, export_elsewhere)
+    # De watermark schoof op: geen dubbele batch, en niets meer te exporteren
+    assert _export(ctx, storage, export_dir) == (None, None)
+    assert storage.load_export_history()[-1] == other_entries[0]
+    assert _files(export_dir) == [other_entries[0]["file_name"]]
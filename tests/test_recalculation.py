@@ -0,0 +1,110 @@
+import pytest
+
+from conftest import TODAY, make_ride
+from payroll_export import run_export
+from recalculation import STATUS_BLOCKED, STATUS_CAPPED, STATUS_RECALCULATED, apply_plan, plan_recalculation
+
+# =============================================================================
+# plan_recalculation / apply_plan op de SQLite store
+# =============================================================================
+# Een nieuwe BE snapshot vanaf de eerste van de maand: de onverwerkte ritten van
+# oktober worden in datumvolgorde opnieuw afgespeeld door de CAP/BLOCK logica.
+
+MONTH_START = TODAY.replace(day=1)
+NEW_RATE = 0.35
+
+
+def _be_employee(ctx, storage):
+    """BE medewerker met minstens drie onverwerkte ritten deze maand."""
+    return next(
+        employee for employee in ctx["employees"]
+        if employee["country"] == "BE" and len(storage.rides.unprocessed_for_employee(employee["id"], MONTH_START)) >= 3
+    )
+
+
+def _new_snapshot(storage, **values):
+    config = dict(storage.load_config_history().at(TODAY).values, BE_RATE=NEW_RATE, **values)
+    storage.save_config(config, MONTH_START)
+    return storage.load_config_history()
+
+
+def _plan(ctx, storage, configs):
+    return plan_recalculation(storage.rides, ctx["employee_index"], configs, workers=1)
+
+
+def _changes_for(plan, employee_id):
+    return {change["ride_id"]: change for change in plan.changes if change["employee_id"] == employee_id}
+
+
+def test_cap_replay_gives_the_remainder_in_date_order(sqlite_ctx):
+    ctx, storage = sqlite_ctx
+    employee = _be_employee(ctx, storage)
+    pending = storage.rides.unprocessed_for_employee(employee["id"], MONTH_START)
+    new_amounts = [ride["distance"] * NEW_RATE for _, ride in pending]
+    # De maandlimiet valt halverwege de derde rit van de maand
+    limit = new_amounts[0] + new_amounts[1] + new_amounts[2] / 2
+    configs = _new_snapshot(storage, BE_LIMIT_TYPE="MONTHLY", BE_MONTHLY_LIMIT=limit, BE_LIMIT_ENFORCE_MODE="CAP")
+
+    plan = _plan(ctx, storage, configs)
+    changes = _changes_for(plan, employee["id"])
+
+    assert list(changes) == [ride_id for ride_id, _ in pending]  # datumvolgorde
+    expected = [
+        (STATUS_RECALCULATED, new_amounts[0]),
+        (STATUS_RECALCULATED, new_amounts[1]),
+        (STATUS_CAPPED, new_amounts[2] / 2),
+    ] + [(STATUS_BLOCKED, 0.0)] * (len(pending) - 3)
+    assert [(change["status"], change["new_amount"]) for change in changes.values()] == [
+        (status, pytest.approx(amount)) for status, amount in expected
+    ]
+    assert all(change["new_rate"] == NEW_RATE for change in changes.values())
+
+    assert apply_plan(storage.rides, plan)
+    stored = [ride["amount"] for _, ride in storage.rides.unprocessed_for_employee(employee["id"], MONTH_START)]
+    assert stored == [pytest.approx(amount) for _, amount in expected]
+    assert storage.rides.month_total(employee["id"], TODAY.year, TODAY.month) == pytest.approx(limit)
+    assert storage.rides.check_consistency() == []
+
+
+def test_block_replay_sets_amount_to_zero(sqlite_ctx):
+    ctx, storage = sqlite_ctx
+    employee = _be_employee(ctx, storage)
+    pending = storage.rides.unprocessed_for_employee(employee["id"], MONTH_START)
+    # De jaarlimiet is al bereikt door de ritten vóór deze maand
+    limit = storage.rides.year_total(employee["id"], TODAY.year) - sum(ride["amount"] for _, ride in pending)
+    configs = _new_snapshot(storage, BE_LIMIT_TYPE="YEARLY", BE_YEARLY_LIMIT=limit, BE_LIMIT_ENFORCE_MODE="BLOCK")
+
+    plan = _plan(ctx, storage, configs)
+    changes = _changes_for(plan, employee["id"])
+
+    assert list(changes) == [ride_id for ride_id, _ in pending]
+    for change, (_, ride) in zip(changes.values(), pending):
+        assert change["status"] == STATUS_BLOCKED
+        assert change["new_amount"] == 0.0 and change["delta"] == -ride["amount"]
+
+    assert apply_plan(storage.rides, plan)
+    assert all(ride["amount"] == 0.0 for _, ride in storage.rides.unprocessed_for_employee(employee["id"], MONTH_START))
+    assert storage.rides.month_total(employee["id"], TODAY.year, TODAY.month) == pytest.approx(0.0)
+    assert storage.rides.year_total(employee["id"], TODAY.year) == pytest.approx(limit)
+    assert storage.rides.check_consistency() == []
+
+
+@pytest.mark.parametrize("change", ["new_ride", "export"])
+def test_apply_plan_changes_nothing_after_a_concurrent_change(sqlite_ctx, tmp_path, change):
+    ctx, storage = sqlite_ctx
+    employee = _be_employee(ctx, storage)
+    configs = _new_snapshot(storage)
+    plan = _plan(ctx, storage, configs)
+    assert _changes_for(plan, employee["id"])
+
+    # Na de planning: een nieuwe rit van de medewerker, of een export van de openstaande ritten
+    if change == "new_ride":
+        storage.rides.append(make_ride(employee, TODAY, "Enkel", 1.0))
+    else:
+        run_export(storage, ctx["employee_index"], export_dir=str(tmp_path / "exports"), archive=False)
+    rides_before = list(storage.rides)
+    month_total = storage.rides.month_total(employee["id"], TODAY.year, TODAY.month)
+
+    assert apply_plan(storage.rides, plan) is False
+    assert list(storage.rides) == rides_before
+    assert storage.rides.month_total(employee["id"], TODAY.year, TODAY.month) == month_total
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import event_log
+from benchmarks import load_dataset
+from conftest import TODAY, make_ride
+from payroll_export import run_export
+
+# =============================================================================
+# Archief (koude opslag): dezelfde reads met en zonder gearchiveerde ritten
+# =============================================================================
+# Twee databases met dezelfde dataset; in `cold` verhuizen de geëxporteerde
+# ritten naar het archief (kleine rondes, dus meerdere segmenten per maand).
+
+ARCHIVE_ROUND = 1000
+
+
+@pytest.fixture
+def hot_and_cold(dataset, tmp_path):
+    _, hot = load_dataset(dataset, "sqlite", path=str(tmp_path / "hot.db"))
+    ctx, cold = load_dataset(dataset, "sqlite", path=str(tmp_path / "cold.db"))
+    archived = cold.rides.archive_exported(chunk=ARCHIVE_ROUND)
+    yield ctx, hot, cold, archived
+    hot.close()
+    cold.close()
+
+
+def _employee_ids(dataset):
+    return [employee["id"] for employee in dataset["employees"].values()]
+
+
+def test_archive_moves_exported_rides(dataset, hot_and_cold):
+    _, hot, cold, archived = hot_and_cold
+    processed = sum(1 for ride in dataset["rides"] if ride["processed"])
+
+    assert archived == processed
+    assert cold.rides._scalar("SELECT COUNT(*) FROM rides") == len(dataset["rides"]) - processed
+    assert sum(status[3] for status in cold.rides.archive_status()) == processed
+    assert cold.rides.archive_exported(chunk=ARCHIVE_ROUND) == 0
+    assert len(cold.rides) == len(hot.rides) and cold.rides.last_seq() == hot.rides.last_seq()
+    assert list(cold.rides) == list(hot.rides)
+    assert cold.rides.check_consistency() == []
+    assert event_log.verify(cold) == []
+
+
+def test_history_reads_match_table_only_store(dataset, hot_and_cold):
+    _, hot, cold, _ = hot_and_cold
+    H, C = hot.rides, cold.rides
+    previous_month = TODAY.replace(day=1) - timedelta(days=1)
+    for employee_id in _employee_ids(dataset):
+        assert C.months_for_employee(employee_id) == H.months_for_employee(employee_id)
+        assert C.for_employee(employee_id) == H.for_employee(employee_id)
+        # Volledige historiek, pagina's over de grens tussen tabel (sept/okt) en archief (≤ aug)
+        assert C.history(employee_id) == H.history(employee_id)
+        for offset in (0, 10, 25, 40):
+            assert C.history(employee_id, offset=offset, limit=20) == H.history(employee_id, offset=offset, limit=20)
+        count, total = C.history_summary(employee_id)
+        assert count == H.history_summary(employee_id)[0] and total == pytest.approx(H.history_summary(employee_id)[1])
+
+        for year, month in H.months_for_employee(employee_id):
+            assert C.for_employee_month(employee_id, year, month) == H.for_employee_month(employee_id, year, month)
+            assert C.history(employee_id, year, month, 5, 10) == H.history(employee_id, year, month, 5, 10)
+            count, total = C.history_summary(employee_id, year, month)
+            assert count == H.history_summary(employee_id, year, month)[0]
+            assert total == pytest.approx(H.history_summary(employee_id, year, month)[1])
+            assert C.month_total(employee_id, year, month) == pytest.approx(H.month_total(employee_id, year, month))
+
+        for year in (TODAY.year - 1, TODAY.year):
+            assert C.year_total(employee_id, year) == pytest.approx(H.year_total(employee_id, year))
+        # Periode over de archiefgrens heen (half augustus tot half september)
+        start, end = previous_month.replace(day=1) - timedelta(days=16), previous_month.replace(day=15)
+        assert C.period_total(employee_id, start, end) == pytest.approx(H.period_total(employee_id, start, end))
+        assert C.pending_total(employee_id) == pytest.approx(H.pending_total(employee_id))
+        for day in (TODAY - timedelta(days=60), previous_month):
+            assert C.for_employee_on(employee_id, day) == H.for_employee_on(employee_id, day)
+            assert C.day_points(employee_id, day) == H.day_points(employee_id, day)
+
+    for year, month in ((TODAY.year, 3), (previous_month.year, previous_month.month)):
+        assert C.for_month(year, month) == H.for_month(year, month)
+
+
+def test_export_after_archive_keeps_reads_and_log_consistent(dataset, hot_and_cold, tmp_path):
+    ctx, hot, cold, _ = hot_and_cold
+    employee = ctx["employees"][0]
+    ride = make_ride(employee, TODAY - timedelta(days=1), "Enkel", 2.5)
+    hot.rides.append(ride)
+    cold.rides.append(ride)
+
+    exported_at = datetime(2026, 10, 17, 9, 30)
+    run_export(hot, ctx["employee_index"], export_dir=str(tmp_path / "hot-exports"), export_timestamp=exported_at,
+               archive=False)
+    entry, _ = run_export(cold, ctx["employee_index"], export_dir=str(tmp_path / "cold-exports"),
+                          export_timestamp=exported_at)
+
+    # De export van september/oktober is intussen ook gearchiveerd: de tabel is leeg
+    assert cold.rides._scalar("SELECT COUNT(*) FROM rides") == 0
+    assert sum(status[3] for status in cold.rides.archive_status()) == len(dataset["rides"]) + 1
+    assert list(cold.rides) == list(hot.rides)
+    for employee_id in _employee_ids(dataset):
+        assert cold.rides.history(employee_id, offset=5, limit=30) == hot.rides.history(employee_id, offset=5, limit=30)
+        year_total = hot.rides.year_total(employee_id, TODAY.year)
+        assert cold.rides.year_total(employee_id, TODAY.year) == pytest.approx(year_total)
+        assert cold.rides.pending_total(employee_id) == 0.0
+    assert cold.rides.check_consistency() == []
+    assert event_log.verify(cold) == []
+
+    # Nieuwe ritten na een volledig gearchiveerde tabel krijgen een hogere seq
+    cold.rides.append(make_ride(employee, TODAY, "Enkel", 1.0))
+    assert cold.rides.last_seq() == entry["last_seq"] + 1
+    assert cold.rides.history(employee["id"], limit=1)[0]["date"] == TODAY
+
+
+def test_consistency_check_over_archived_negative_ids(sqlite_ctx, tmp_path):
+    ctx, storage = sqlite_ctx
+    employee = dict(ctx["employees"][0], id=-5)
+    for day in (TODAY - timedelta(days=3), TODAY - timedelta(days=2)):
+        storage.rides.append(make_ride(employee, day, "Heen-en-Terug", 4.0))
+    run_export(storage, ctx["employee_index"], export_dir=str(tmp_path / "exports"))
+
+    assert storage.rides.year_total(-5, TODAY.year) == pytest.approx(8.0)
+    assert storage.rides.check_consistency() == []
@@ -0,0 +1,60 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import make_ride
+from ride_store import RIDE_TYPES, RideStore
+
+# =============================================================================
+# RideStore (kolommen): snapshot en maandgroepering met elke geldige employee_id
+# =============================================================================
+
+EMPLOYEE_IDS = (-(2 ** 31), -5, 0, 7, 1001, 2 ** 31 - 1)  # het volledige int32 bereik van de kolom
+
+
+def _employee(employee_id):
+    return {"id": employee_id, "name": f"Medewerker {employee_id}", "trajectories": {"Thuis-Werk": 12}}
+
+
+@pytest.fixture
+def store():
+    rng = random.Random(3)
+    rides = RideStore()
+    for _ in range(400):
+        day = date(2025, 11, 1) + timedelta(days=rng.randint(0, 120))
+        employee = _employee(rng.choice(EMPLOYEE_IDS))
+        rides.append(make_ride(employee, day, rng.choice(RIDE_TYPES), round(rng.uniform(1, 8), 2)))
+    return rides
+
+
+def _expected_groups(rides):
+    groups = {}
+    for ride in rides:
+        key = (ride["date"].year, ride["date"].month, ride["employee_id"])
+        count, distance, amount, first, last = groups.get(key, (0, 0.0, 0.0, ride["date"], ride["date"]))
+        groups[key] = (
+            count + 1, distance + ride["distance"], amount + ride["amount"], min(first, ride["date"]), max(last, ride["date"])
+        )
+    return [
+        (emp_id, year, month, count, pytest.approx(distance), pytest.approx(amount), first, last)
+        for (year, month, emp_id), (count, distance, amount, first, last) in sorted(groups.items())
+    ]
+
+
+def test_pending_groups_sorts_by_month_then_employee(store):
+    assert store.pending_groups() == _expected_groups(list(store))
+
+
+def test_from_snapshot_keeps_the_month_index(store):
+    restored = RideStore.from_snapshot(*store.snapshot())
+
+    assert list(restored) == list(store)
+    for employee_id in EMPLOYEE_IDS:
+        assert restored.months_for_employee(employee_id) == store.months_for_employee(employee_id)
+        assert restored.for_employee(employee_id) == store.for_employee(employee_id)
+        for year, month in store.months_for_employee(employee_id):
+            assert restored.for_employee_month(employee_id, year, month) == store.for_employee_month(employee_id, year, month)
+        for year in (2025, 2026):
+            assert restored.year_total(employee_id, year) == pytest.approx(store.year_total(employee_id, year))
+    assert restored.pending_groups() == store.pending_groups()
@@ -0,0 +1,138 @@
+from datetime import datetime
+
+from conftest import TODAY, make_ride
+from rules import MSG_EXPORTED
+from storage import MAX_SUBMIT_RETRIES
+
+# =============================================================================
+# SqliteRideStore.submit_ride: optimistische versiecontrole per medewerker
+# =============================================================================
+
+
+def _submit(ctx, employee, ride_type, after_validate=None):
+    """
+    Dient een rit van vandaag in; after_validate(poging) draait na elke validatie,
+    vóór de schrijftransactie (het venster van een gelijktijdige schrijver).
+    """
+    rules, rides = ctx["rules"], ctx["rides"]
+    calls = []
+
+    def validate():
+        calls.append(rides.version(employee["id"]))
+        result = rules.validate_ride(employee, TODAY, "Thuis-Werk", ride_type)
+        if after_validate is not None:
+            after_validate(len(calls))
+        return result
+
+    result = rides.submit_ride(
+        employee["id"], validate, lambda amount: make_ride(employee, TODAY, ride_type, amount)
+    )
+    return result, calls
+
+
+def test_submit_ride_stores_valid_ride(sqlite_ctx):
+    ctx, _ = sqlite_ctx
+    employee, rides = ctx["employees"][0], ctx["rides"]
+    count, version = len(rides), rides.version(employee["id"])
+
+    (valid, msgs, amount), calls = _submit(ctx, employee, "Enkel")
+
+    assert valid and amount > 0
+    assert len(calls) == 1
+    assert len(rides) == count + 1
+    assert rides.version(employee["id"]) == version + 1
+    assert rides.day_points(employee["id"], TODAY) == 1
+
+
+def test_submit_ride_rejection_stores_nothing(sqlite_ctx):
+    ctx, _ = sqlite_ctx
+    employee, rides = ctx["employees"][0], ctx["rides"]
+    rides.append(make_ride(employee, TODAY, "Heen-en-Terug", 1.0))
+    count = len(rides)
+
+    (valid, msgs, amount), calls = _submit(ctx, employee, "Enkel")
+
+    assert not valid and amount == 0.0
+    assert msgs[0].startswith("❌ Daglimiet")
+    assert len(calls) == 1
+    assert len(rides) == count
+
+
+def test_submit_ride_revalidates_after_concurrent_ride(sqlite_ctx):
+    ctx, _ = sqlite_ctx
+    employee, rides = ctx["employees"][0], ctx["rides"]
+
+    def concurrent_writer(attempt):
+        # Een ander proces legt na de eerste validatie een rit vast
+        if attempt == 1:
+            rides.append(make_ride(employee, TODAY, "Enkel", 1.0))
+
+    count = len(rides)
+    (valid, msgs, amount), calls = _submit(ctx, employee, "Heen-en-Terug", concurrent_writer)
+
+    # Opnieuw gevalideerd met de verse rit-punten: 1 + 2 > 2
+    assert len(calls) == 2 and calls[1] == calls[0] + 1
+    assert not valid and msgs[0].startswith("❌ Daglimiet")
+    assert len(rides) == count + 1
+    assert rides.day_points(employee["id"], TODAY) == 1
+
+
+def test_submit_ride_retries_then_stores(sqlite_ctx):
+    ctx, _ = sqlite_ctx
+    employee, other = ctx["employees"][0], ctx["employees"][1]
+    rides = ctx["rides"]
+
+    def concurrent_writer(attempt):
+        if attempt == 1:
+            # Zelfde medewerker, andere dag: versie wijzigt maar de rit blijft geldig
+            rides.append(make_ride(employee, TODAY.replace(day=1), "Enkel", 1.0))
+            rides.append(make_ride(other, TODAY, "Enkel", 1.0))
+
+    count = len(rides)
+    (valid, _, _), calls = _submit(ctx, employee, "Enkel", concurrent_writer)
+
+    assert valid and len(calls) == 2
+    assert len(rides) == count + 3
+    assert rides.day_points(employee["id"], TODAY) == 1
+
+
+def test_submit_ride_gives_up_after_max_retries(sqlite_ctx):
+    ctx, _ = sqlite_ctx
+    employee, rides = ctx["employees"][0], ctx["rides"]
+
+    def always_conflicting(attempt):
+        rides.append(make_ride(employee, TODAY.replace(day=attempt), "Enkel", 1.0))
+
+    count = len(rides)
+    (valid, msgs, amount), calls = _submit(ctx, employee, "Enkel", always_conflicting)
+
+    assert not valid and amount == 0.0
+    assert "gelijktijdige wijzigingen" in msgs[0]
+    assert len(calls) == MAX_SUBMIT_RETRIES
+    assert len(rides) == count + MAX_SUBMIT_RETRIES  # enkel de concurrerende ritten
+    assert rides.day_points(employee["id"], TODAY) == 0
+
+
+def test_submit_ride_rechecks_export_lock_in_transaction(sqlite_ctx):
+    ctx, storage = sqlite_ctx
+    employee, rides = ctx["employees"][0], ctx["rides"]
+    employee_id = employee["id"]
+
+    def export_in_between(attempt):
+        # Een export vergrendelt de periode tussen validatie en insert; de versie
+        # van deze medewerker wijzigt daarbij niet als ze geen openstaande ritten heeft
+        storage.append_export({
+            "batch_id": storage.next_export_batch_id(),
+            "export_date": datetime.combine(TODAY, datetime.min.time()),
+            "period_start": TODAY.replace(day=1),
+            "period_end": TODAY,
+            "ride_count": 0,
+            "total_amount": 0.0,
+        })
+
+    count, version = len(rides), rides.version(employee_id)
+    (valid, msgs, amount), calls = _submit(ctx, employee, "Enkel", export_in_between)
+
+    assert len(calls) == 1 and rides.version(employee_id) == version
+    assert (valid, msgs, amount) == (False, [MSG_EXPORTED], 0.0)
+    assert len(rides) == count